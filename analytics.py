@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按时间分桶的统计汇总 (小时 / 天 / 月), transcribe.py 入库时增量更新, web_viewer.py 直接查询。
+
+汇总表 analytics_rollup 每行是 (粒度, 时间段, 说话人, 情绪) 的片段数、语音时长、字数和词数,
+查询任意时间范围都不需要再解析原始分段。每条录音的时长、说话人摘要和预览也在入库时写入 transcriptions,
+列表接口直接投影这几列。历史数据或汇总表损坏时重建:
+    python analytics.py --rebuild --source-path /volume2/download/records/Sony-2
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+
+import partitions
+
+# 时间段格式互为前缀, 细粒度的时间段截断后就是粗粒度的时间段
+BUCKET_FORMATS = {
+    "month": "%Y-%m",
+    "day": "%Y-%m-%d",
+    "hour": "%Y-%m-%d %H",
+}
+# 查询时可用的分组方式; hour_of_day 由小时汇总按一天中的小时合并
+QUERY_BUCKETS = ("hour", "day", "month", "hour_of_day")
+
+TIME_PATTERNS = [
+    r'^\s*(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})\s*',
+    r'^\s*recording-(\d{4})(\d{2})(\d{2})-(\d{2})(\d{2})(\d{2})\s*'
+]
+WORD_PATTERN = re.compile(r'[\u4e00-\u9fff]|[A-Za-z0-9]+')
+# 列表预览的长度 (字)
+PREVIEW_CHARS = 120
+# transcriptions 中的摘要列, 旧数据库启动时自动补上
+SUMMARY_COLUMNS = {"duration_ms": "INTEGER", "speakers_json": "TEXT", "preview": "TEXT"}
+# 入库时累加汇总和补齐摘要的语句, check_db.py 直接引用检查执行计划
+ROLLUP_UPSERT_SQL = '''
+        INSERT INTO analytics_rollup (bucket, period, speaker, emotion, segments, speech_ms, chars, words)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (bucket, period, speaker, emotion) DO UPDATE SET
+            segments = segments + excluded.segments,
+            speech_ms = speech_ms + excluded.speech_ms,
+            chars = chars + excluded.chars,
+            words = words + excluded.words
+    '''
+MISSING_SUMMARIES_SQL = "SELECT id, full_text, segments_json FROM transcriptions WHERE speakers_json IS NULL AND id > ? ORDER BY id LIMIT ?"
+
+def parse_recorded_time(filename, created_at=None):
+    """从文件名解析录音时间, 解析不出时退回入库时间"""
+    for pattern in TIME_PATTERNS:
+        match = re.match(pattern, os.path.splitext(filename)[0])
+        if match:
+            try:
+                if pattern == TIME_PATTERNS[0]:
+                    date_part = match.group(1)
+                    time_part = match.group(2)
+                    dt_str = f"{date_part} {time_part.replace('-', ':')}"
+                else:
+                    year, month, day, hour, minute, second = match.groups()
+                    dt_str = f"{year}-{month}-{day} {hour}:{minute}:{second}"
+                return datetime.datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                continue
+    if created_at:
+        try: return datetime.datetime.fromisoformat(created_at)
+        except: pass
+    return None
+
+def init_rollup_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS analytics_rollup (
+        bucket TEXT NOT NULL,
+        period TEXT NOT NULL,
+        speaker TEXT NOT NULL,
+        emotion TEXT NOT NULL,
+        segments INTEGER NOT NULL DEFAULT 0,
+        speech_ms INTEGER NOT NULL DEFAULT 0,
+        chars INTEGER NOT NULL DEFAULT 0,
+        words INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, period, speaker, emotion)
+    ) WITHOUT ROWID;
+    ''')
+
+def rollup_segments(filename, created_at, segments, totals=None):
+    """把一条录音的分段累加到 {(粒度, 时间段, 说话人, 情绪): [片段数, 语音毫秒, 字数, 词数]}。"""
+    totals = {} if totals is None else totals
+    recorded = parse_recorded_time(filename, created_at)
+    if recorded is None:
+        return totals
+    for seg in segments:
+        text = re.sub(r'<\|.*?\|>', '', seg.get('text') or '')
+        chars = len(re.sub(r'\s', '', text))
+        if not chars:
+            continue
+        start, end = seg.get('start') or 0, seg.get('end') or 0
+        speech_ms = int(end - start) if end > start else 0
+        # 按片段自己的开始时间分桶, 跨小时的长录音会分到多个时间段
+        moment = recorded + datetime.timedelta(milliseconds=start)
+        speaker = str(seg.get('spk', 'unknown'))
+        emotion = str(seg.get('emotion') or 'neutral').lower()
+        words = len(WORD_PATTERN.findall(text))
+        for bucket, fmt in BUCKET_FORMATS.items():
+            row = totals.setdefault((bucket, moment.strftime(fmt), speaker, emotion), [0, 0, 0, 0])
+            row[0] += 1
+            row[1] += speech_ms
+            row[2] += chars
+            row[3] += words
+    return totals
+
+def apply_rollup(cursor, totals):
+    """累加到汇总表; 调用方负责事务, 与写入 transcriptions 放在同一个事务中。"""
+    cursor.executemany(ROLLUP_UPSERT_SQL, [key + tuple(values) for key, values in totals.items()])
+
+def rebuild_rollups(conn, progress_every=1000):
+    """清空汇总表后从 transcriptions (所有分区) 全量重新统计。"""
+    started = time.time()
+    init_rollup_tables(conn.cursor())
+    totals, count = {}, 0
+    for _ in partitions.each_group(conn, partitions.all_partitions(conn)):
+        cursor = conn.execute("SELECT filename, created_at, segments_json FROM transcriptions")
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            for filename, created_at, segments_json in rows:
+                try:
+                    segments = json.loads(segments_json or '[]')
+                except ValueError:
+                    segments = []
+                rollup_segments(filename, created_at, segments, totals)
+                count += 1
+                if count % progress_every == 0:
+                    print(f"\r  已统计 {count} 条录音", end="", flush=True)
+    with conn:
+        conn.execute("DELETE FROM analytics_rollup")
+        apply_rollup(conn, totals)
+    print(f"\r  已统计 {count} 条录音，写入 {len(totals)} 行汇总，耗时 {time.time() - started:.1f}s")
+    return count
+
+def has_content(text):
+    """去掉标签、标点和空白后是否还有内容"""
+    return bool(re.sub(r'[\W_]', '', re.sub(r'<\|.*?\|>', '', text or '')))
+
+def summarize_transcript(full_text, segments):
+    """一条录音的列表摘要: (时长毫秒, 说话人摘要 JSON, 预览)。
+
+    说话人摘要为 [{"spk": 0, "segments": 3, "speech_ms": 12000}], 只统计有有效内容的片段。
+    """
+    duration_ms, speakers, texts = 0, {}, []
+    for seg in segments or []:
+        start, end = seg.get('start') or 0, seg.get('end') or 0
+        duration_ms = max(duration_ms, int(end or start))
+        if not has_content(seg.get('text')):
+            continue
+        spk = seg.get('spk', 0)
+        entry = speakers.setdefault(str(spk), {"spk": spk, "segments": 0, "speech_ms": 0})
+        entry["segments"] += 1
+        entry["speech_ms"] += int(end - start) if end > start else 0
+        if len(texts) < 20:
+            texts.append(re.sub(r'<\|.*?\|>', '', seg.get('text')).strip())
+    text = re.sub(r'<\|.*?\|>', '', full_text or '').strip()
+    if not has_content(text):
+        text = " ".join(texts)
+    preview = re.sub(r'\s+', ' ', text)[:PREVIEW_CHARS]
+    return duration_ms, json.dumps(list(speakers.values()), ensure_ascii=False), preview
+
+def init_summary_columns(cursor):
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(transcriptions)")}
+    for column, column_type in SUMMARY_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE transcriptions ADD COLUMN {column} {column_type}")
+
+def fill_missing_summaries(conn, batch_size=500):
+    """为升级前写入的录音补齐摘要列, 返回补齐的条数。"""
+    init_summary_columns(conn.cursor())
+    started, last_id, count = time.time(), 0, 0
+    while True:
+        rows = conn.execute(MISSING_SUMMARIES_SQL, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for transcription_id, full_text, segments_json in rows:
+            try:
+                segments = json.loads(segments_json or '[]')
+            except ValueError:
+                segments = []
+            updates.append(summarize_transcript(full_text, segments) + (transcription_id,))
+        with conn:
+            conn.executemany("UPDATE transcriptions SET duration_ms = ?, speakers_json = ?, preview = ? WHERE id = ?", updates)
+        last_id, count = rows[-1][0], count + len(rows)
+    if count:
+        print(f"  已补齐 {count} 条录音的列表摘要，耗时 {time.time() - started:.1f}s")
+    return count
+
+def _is_aligned(start, end, bucket):
+    """范围的起止是否正好落在该粒度的边界上 (end 为包含在内的最后时刻)"""
+    if start is not None and start != datetime.datetime.strptime(start.strftime(BUCKET_FORMATS[bucket]), BUCKET_FORMATS[bucket]):
+        return False
+    if end is not None:
+        after = end + datetime.timedelta(microseconds=1)
+        if after != datetime.datetime.strptime(after.strftime(BUCKET_FORMATS[bucket]), BUCKET_FORMATS[bucket]):
+            return False
+    return True
+
+def rollup_query(start=None, end=None, bucket="day"):
+    """query_rollups 执行的 (SQL, 参数)。
+
+    范围边界没有对齐到所需粒度时 (例如按月分组但从月中开始), 改用更细的汇总行再合并。
+    """
+    if bucket not in QUERY_BUCKETS:
+        raise ValueError(f"bucket 必须是 {', '.join(QUERY_BUCKETS)} 之一")
+    candidates = {"month": ["month", "day", "hour"], "day": ["day", "hour"]}.get(bucket, ["hour"])
+    source = next((level for level in candidates if _is_aligned(start, end, level)), "hour")
+    fmt = BUCKET_FORMATS[source]
+    if bucket == "hour_of_day":
+        group_expr = "substr(period, 12, 2)"
+    else:
+        group_expr = f"substr(period, 1, {len(datetime.datetime(2000, 1, 1).strftime(BUCKET_FORMATS[bucket]))})"
+    sql = f'''
+        SELECT {group_expr} AS grp, speaker, emotion,
+               SUM(segments), SUM(speech_ms), SUM(chars), SUM(words)
+        FROM analytics_rollup WHERE bucket = ?'''
+    params = [source]
+    if start is not None:
+        sql += " AND period >= ?"
+        params.append(start.strftime(fmt))
+    if end is not None:
+        sql += " AND period <= ?"
+        params.append(end.strftime(fmt))
+    sql += " GROUP BY grp, speaker, emotion ORDER BY grp"
+    return sql, params
+
+def query_rollups(conn, start=None, end=None, bucket="day"):
+    """按粒度返回 [start, end] 范围内的汇总序列。"""
+    sql, params = rollup_query(start, end, bucket)
+    series, totals = {}, {"segments": 0, "speech_seconds": 0.0, "chars": 0, "words": 0, "speakers": {}}
+    for period, speaker, emotion, segments, speech_ms, chars, words in conn.execute(sql, params):
+        entry = series.setdefault(period, {"period": period, "segments": 0, "speech_seconds": 0.0,
+                                           "chars": 0, "words": 0, "speakers": {}})
+        for target in (entry, totals):
+            target["segments"] += segments
+            target["speech_seconds"] += speech_ms / 1000
+            target["chars"] += chars
+            target["words"] += words
+            spk = target["speakers"].setdefault(speaker, {"segments": 0, "speech_seconds": 0.0,
+                                                         "chars": 0, "words": 0, "emotions": {}})
+            spk["segments"] += segments
+            spk["speech_seconds"] += speech_ms / 1000
+            spk["chars"] += chars
+            spk["words"] += words
+            spk["emotions"][emotion] = spk["emotions"].get(emotion, 0) + segments
+    # 第一个参数是实际读取的汇总粒度
+    return {"bucket": bucket, "source": params[0], "series": list(series.values()), "totals": totals}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='按时间分桶的统计汇总')
+    parser.add_argument('--source-path', type=str, help='源音频文件路径')
+    parser.add_argument('--rebuild', action='store_true', help='从 transcriptions 全量重建汇总表')
+    parser.add_argument('--from', dest='start', type=str, help='查询起始日期 YYYY-MM-DD')
+    parser.add_argument('--to', dest='end', type=str, help='查询结束日期 YYYY-MM-DD')
+    parser.add_argument('--bucket', type=str, default='day', choices=QUERY_BUCKETS, help='分组粒度')
+    return parser.parse_args()
+
+def main():
+    import transcribe
+    args = parse_args()
+    transcribe.update_config(args)
+    print(f"数据库: {transcribe.CONFIG['DB_PATH']}")
+    transcribe.init_db()
+    conn = sqlite3.connect(transcribe.CONFIG["DB_PATH"])
+    try:
+        if args.rebuild:
+            rebuild_rollups(conn)
+            return 0
+        start = datetime.datetime.fromisoformat(args.start) if args.start else None
+        end = datetime.datetime.fromisoformat(args.end) + datetime.timedelta(days=1, microseconds=-1) if args.end else None
+        result = query_rollups(conn, start, end, args.bucket)
+        for entry in result["series"]:
+            print(f"{entry['period']:<14} {entry['segments']:>6} 段  {entry['speech_seconds'] / 60:>8.1f} 分钟  {entry['chars']:>8} 字")
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
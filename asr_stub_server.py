@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟 ASR 服务端, 不需要 GPU 和模型, 用于联调 transcribe.py 的同步和异步 (提交 + 轮询) 两种调用方式。
+
+    python asr_stub_server.py --port 5008 --realtime 20 --workers 1
+    # transcribe.py 的 config.json 中: "ASR_API_URL": "http://127.0.0.1:5008/transcribe", "ASR_MODE": "async"
+
+接口:
+    GET  /                        探测
+    POST /transcribe              同步: 转录完成后返回 {"full_text", "segments"}
+    POST /jobs                    异步: 立即返回 {"job_id"} (HTTP 202)
+    GET  /jobs/<job_id>?wait=30   长轮询: {"status": "queued|running|done|failed", "result": {...}, "error": "..."}, 未知任务 404
+    POST /admin/reset             丢弃所有任务, 模拟服务端重启
+"""
+
+import io
+import sys
+import time
+import uuid
+import wave
+import random
+import argparse
+import threading
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+SETTINGS = {"realtime": 20.0, "min_seconds": 0.5, "fail_rate": 0.0}
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+# 同时转录的任务数, 模拟单块 GPU
+GPU = threading.Semaphore(1)
+
+def audio_seconds(data, fmt):
+    """wav 读取文件头; 其他格式按 32 kbps 估算"""
+    if fmt == "wav":
+        try:
+            with wave.open(io.BytesIO(data)) as wav:
+                return wav.getnframes() / float(wav.getframerate())
+        except (wave.Error, EOFError):
+            pass
+    return len(data) * 8 / 32000.0
+
+def fake_result(seconds, filename):
+    segments = []
+    start = 0
+    while start < seconds * 1000 and len(segments) < 500:
+        end = min(start + 5000, int(seconds * 1000))
+        segments.append({"start": start, "end": end, "spk": len(segments) % 2,
+                         "text": f"模拟转录第 {len(segments) + 1} 段"})
+        start = end
+    return {"full_text": f"{filename} 的模拟转录结果 ({seconds:.1f}s)", "segments": segments}
+
+def run_transcription(data, fmt, filename):
+    """占用 GPU, 按实时倍率等待; 返回 (结果, 错误)"""
+    seconds = audio_seconds(data, fmt)
+    with GPU:
+        time.sleep(max(seconds / SETTINGS["realtime"], SETTINGS["min_seconds"]))
+    if random.random() < SETTINGS["fail_rate"]:
+        return None, "模拟的转录失败"
+    return fake_result(seconds, filename), None
+
+def read_upload():
+    upload = request.files.get('audio_file')
+    if upload is None:
+        return None, None, None
+    return upload.read(), request.form.get('format', 'wav'), upload.filename
+
+@app.route('/')
+def index():
+    return "ok"
+
+@app.route('/transcribe', methods=['POST'])
+def transcribe():
+    data, fmt, filename = read_upload()
+    if data is None:
+        return jsonify(error="缺少 audio_file"), 400
+    result, error = run_transcription(data, fmt, filename)
+    if error:
+        return jsonify(error=error)
+    return jsonify(result)
+
+def run_job(job):
+    job["status"] = "running"
+    job["started_at"] = time.time()
+    result, error = run_transcription(job.pop("data"), job["format"], job["filename"])
+    job.update(result=result, error=error, status="failed" if error else "done", finished_at=time.time())
+    job["event"].set()
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    data, fmt, filename = read_upload()
+    if data is None:
+        return jsonify(error="缺少 audio_file"), 400
+    job_id = uuid.uuid4().hex[:12]
+    job = {"id": job_id, "status": "queued", "data": data, "format": fmt, "filename": filename,
+           "submitted_at": time.time(), "event": threading.Event()}
+    with JOBS_LOCK:
+        JOBS[job_id] = job
+    threading.Thread(target=run_job, args=(job,), daemon=True).start()
+    print(f"[stub] 提交 {job_id} {filename} ({len(data) / 1024:.0f} KB)", flush=True)
+    return jsonify(job_id=job_id, status="queued"), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+    wait = min(max(request.args.get('wait', 0, type=float), 0), 120)
+    if wait and job["status"] in ("queued", "running"):
+        job["event"].wait(wait)
+    body = {"job_id": job_id, "status": job["status"]}
+    if job["status"] == "done":
+        body["result"] = job["result"]
+    elif job["status"] == "failed":
+        body["error"] = job["error"]
+    return jsonify(body)
+
+@app.route('/admin/reset', methods=['POST'])
+def reset():
+    with JOBS_LOCK:
+        count = len(JOBS)
+        JOBS.clear()
+    return jsonify(cleared=count)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='模拟 ASR 服务端')
+    parser.add_argument('--port', type=int, default=5008)
+    parser.add_argument('--realtime', type=float, default=20.0, help='实时倍率: 每秒处理多少秒音频')
+    parser.add_argument('--min-seconds', type=float, default=0.5, help='每个任务至少耗时 (秒)')
+    parser.add_argument('--workers', type=int, default=1, help='同时转录的任务数')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='随机失败的比例')
+    return parser.parse_args()
+
+def main():
+    global GPU
+    args = parse_args()
+    SETTINGS.update(realtime=max(args.realtime, 0.01), min_seconds=args.min_seconds, fail_rate=args.fail_rate)
+    GPU = threading.Semaphore(max(args.workers, 1))
+    print(f"模拟 ASR 服务端: http://0.0.0.0:{args.port} (实时倍率 {args.realtime}x, 并发 {args.workers})")
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
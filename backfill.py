@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+从 TRANSCRIPT_DIR 中的 TXT 转录文件重建 transcriptions 表。
+
+换新数据库或 transcripts.db 丢失时使用, 不需要重新转录:
+    python backfill.py --source-path /volume2/download/records/Sony-2
+    python backfill.py --requeue      # 同时把没有转录结果的已归档音频放回源目录重新排队
+"""
+
+import os
+import re
+import json
+import sys
+import time
+import sqlite3
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import analytics
+import similarity
+import partitions
+import transcribe
+from transcribe import CONFIG, EMOTION_LABELS, TXT_SUMMARY_HEADER, TXT_DIALOGUE_HEADER, SUPPORTED_EXTENSIONS
+
+# TXT 中的情绪标签 -> 原始情绪键
+EMOTION_KEYS = {label: key for key, label in EMOTION_LABELS.items() if label}
+LINE_PATTERN = re.compile(
+    r'^\[(\d+):(\d{2}):(\d{2})\] \[(.*?)\](?: (' + '|'.join(map(re.escape, EMOTION_KEYS)) + r'))?: (.*)$',
+    re.S
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='从 TXT 转录文件回填数据库')
+    parser.add_argument('--source-path', type=str, help='源音频文件路径')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='解析进程数')
+    parser.add_argument('--batch-size', type=int, default=2000, help='每个事务插入的行数')
+    parser.add_argument('--requeue', action='store_true', help='把没有转录结果的已归档音频移回源目录')
+    parser.add_argument('--dry-run', action='store_true', help='只统计, 不写数据库也不移动文件')
+    return parser.parse_args()
+
+def parse_transcript_file(txt_path):
+    """解析 save_transcript_with_spk 写出的 TXT, 返回 (全文, 分段列表, 修改时间)。"""
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    head, _, dialogue = content.partition(f"\n\n{TXT_DIALOGUE_HEADER}")
+    if head.startswith(TXT_SUMMARY_HEADER):
+        head = head[len(TXT_SUMMARY_HEADER):]
+    full_text = head.strip("\n")
+    segments = []
+    for block in dialogue.split("\n\n"):
+        if not block.strip():
+            continue
+        match = LINE_PATTERN.match(block)
+        if not match:
+            # 文本本身含空行时, 续接到上一段
+            if segments:
+                segments[-1]["text"] += "\n\n" + block
+            continue
+        h, m, s, spk, emotion_label, text = match.groups()
+        seg = {"start": (int(h) * 3600 + int(m) * 60 + int(s)) * 1000, "text": text}
+        if spk != "Unknown":
+            seg["spk"] = int(spk) if spk.isdigit() else spk
+        if emotion_label:
+            seg["emotion"] = EMOTION_KEYS[emotion_label]
+        segments.append(seg)
+    return full_text, segments, os.path.getmtime(txt_path)
+
+def _parse_safe(txt_path):
+    try:
+        return txt_path, parse_transcript_file(txt_path), None
+    except Exception as e:
+        return txt_path, None, str(e)
+
+def index_processed_audio():
+    """已归档音频: 文件名(不含扩展名) -> 文件名"""
+    processed_dir = CONFIG["PROCESSED_DIR"]
+    if not os.path.isdir(processed_dir):
+        return {}
+    return {os.path.splitext(name)[0]: name for name in os.listdir(processed_dir)
+            if name.lower().endswith(SUPPORTED_EXTENSIONS)}
+
+def load_existing_stems(conn):
+    rows = partitions.query(conn, partitions.all_partitions(conn), "SELECT filename FROM transcriptions")
+    return {os.path.splitext(row[0])[0] for row in rows}
+
+class Progress:
+    def __init__(self, total, label):
+        self.total = total
+        self.label = label
+        self.done = 0
+        self.started = time.time()
+        self.last_print = 0
+
+    def update(self, n=1, force=False):
+        self.done += n
+        now = time.time()
+        if force or now - self.last_print >= 1 or self.done == self.total:
+            rate = self.done / max(now - self.started, 1e-6)
+            print(f"\r  [{self.label}] {self.done}/{self.total} ({rate:.0f} 个/秒)", end="", flush=True)
+            self.last_print = now
+
+    def finish(self):
+        elapsed = max(time.time() - self.started, 1e-6)
+        print(f"\r  [{self.label}] 完成 {self.done}/{self.total}，耗时 {elapsed:.1f}s ({self.done / elapsed:.0f} 个/秒)".ljust(60))
+
+def backfill_transcripts(conn, args, audio_index):
+    transcript_dir = CONFIG["TRANSCRIPT_DIR"]
+    existing = load_existing_stems(conn)
+    if not os.path.isdir(transcript_dir):
+        print(f"转录目录不存在: {transcript_dir}")
+        return existing
+    txt_files = sorted(name for name in os.listdir(transcript_dir) if name.endswith('.txt'))
+    pending = [os.path.join(transcript_dir, name) for name in txt_files
+               if os.path.splitext(name)[0] not in existing]
+    print(f"TXT 文件 {len(txt_files)} 个，数据库中已有 {len(txt_files) - len(pending)} 个，待导入 {len(pending)} 个")
+    if not pending:
+        return existing
+
+    progress = Progress(len(pending), "导入")
+    batch, inserted, failed = [], 0, 0
+
+    def flush():
+        nonlocal inserted
+        if batch and not args.dry_run:
+            # 按录音月份分组, 每个分区一个事务 (分区和目录库一起提交)
+            groups = {}
+            for row in batch:
+                groups.setdefault(partitions.partition_key(row[0], row[1]), []).append(row)
+            for name, rows in groups.items():
+                schema = partitions.attach_for_write(conn, name, transcribe.get_partition_dir())
+                with conn:
+                    totals = {}
+                    for filename, created_at, full_text, segments_json, *summary in rows:
+                        transcription_id = partitions.insert_transcription(
+                            conn, schema, name, filename, created_at, full_text, segments_json, summary)
+                        segments = json.loads(segments_json)
+                        analytics.rollup_segments(filename, created_at, segments, totals)
+                        similarity.store_terms(conn, transcription_id, full_text, segments)
+                    analytics.apply_rollup(conn, totals)
+                partitions.detach(conn, schema)
+        inserted += len(batch)
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        for txt_path, parsed, error in executor.map(_parse_safe, pending, chunksize=64):
+            progress.update()
+            stem = os.path.splitext(os.path.basename(txt_path))[0]
+            if error:
+                failed += 1
+                print(f"\n  [解析失败] {txt_path}: {error}")
+                continue
+            full_text, segments, mtime = parsed
+            created_at = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            filename = audio_index.get(stem, stem)
+            batch.append((filename, created_at, full_text, json.dumps(segments, ensure_ascii=False))
+                         + analytics.summarize_transcript(full_text, segments))
+            existing.add(stem)
+            if len(batch) >= args.batch_size:
+                flush()
+    flush()
+    progress.finish()
+    print(f"导入 {inserted} 条，失败 {failed} 条" + (" (dry-run，未写入)" if args.dry_run else ""))
+    return existing
+
+def requeue_untranscribed(existing, audio_index, args):
+    """已归档但既没有 TXT 也不在数据库中的音频, 移回源目录重新转录。"""
+    transcript_dir = CONFIG["TRANSCRIPT_DIR"]
+    missing = [name for stem, name in sorted(audio_index.items())
+               if stem not in existing and not os.path.exists(os.path.join(transcript_dir, f"{stem}.txt"))]
+    print(f"没有转录结果的已归档音频: {len(missing)} 个")
+    if not missing or args.dry_run:
+        return
+    progress = Progress(len(missing), "重新排队")
+    for name in missing:
+        target = os.path.join(CONFIG["SOURCE_DIR"], name)
+        if not os.path.exists(target):
+            os.rename(os.path.join(CONFIG["PROCESSED_DIR"], name), target)
+        progress.update()
+    progress.finish()
+
+def main():
+    args = parse_args()
+    transcribe.update_config(args)
+    print(f"数据库: {CONFIG['DB_PATH']}")
+    transcribe.init_db()
+    conn = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        audio_index = index_processed_audio()
+        existing = backfill_transcripts(conn, args, audio_index)
+        if args.requeue:
+            requeue_untranscribed(existing, audio_index, args)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,58 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库健康检查: 表和索引占用、碎片、web_viewer.py / transcribe.py 所用查询的执行计划和耗时、完整性检查。
+目录库和每个月份分区分别检查; 只输出统计, 不输出表内容。
+
+    python check_db.py                        # 全部检查 (只读)
+    python check_db.py --analyze              # 先 ANALYZE 更新优化器统计, 再看执行计划
+    python check_db.py --vacuum 2000          # 增量 VACUUM, 每个数据库最多回收 2000 个空闲页 (0 为全部)
+    python check_db.py --enable-incremental   # 把数据库转换为增量 VACUUM 模式 (需要一次完整 VACUUM)
+    python check_db.py --no-timing --quick    # 不实际执行查询, 用 quick_check 代替 integrity_check
+
+--analyze / --vacuum / --enable-incremental 会写数据库, 建议在转录服务空闲时运行。
+查询语句取自 partitions / analytics / similarity / web_viewer / transcribe 中的常量,
+新增查询时在模块中定义常量, 再在 registered_queries() 中登记一条。
+"""
+
+import os
+import sys
+import time
 import sqlite3
-import json
-
-# 从web_viewer.py导入配置
-try:
-    import sys
-    sys.path.append('.')
-    from web_viewer import CONFIG
-    db_path = CONFIG["DB_PATH"]
-except:
-    # 如果导入失败，使用默认路径
-    db_path = "transcriptions.db"
-
-print(f"检查数据库: {db_path}")
-
-# 连接到数据库
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
-# 查询所有表
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-tables = cursor.fetchall()
-print("Tables in database:")
-for table in tables:
-    print(f"- {table[0]}")
-
-# 检查chat_history表是否存在
-if any('chat_history' in table for table in tables):
-    print("\nchat_history table structure:")
-    cursor.execute("PRAGMA table_info(chat_history)")
-    columns = cursor.fetchall()
-    for col in columns:
-        print(f"- {col[1]} ({col[2]})")
-    
-    # 查询chat_history表中的数据
-    print("\nData in chat_history table:")
-    cursor.execute("SELECT * FROM chat_history")
-    rows = cursor.fetchall()
+import argparse
+import datetime
+
+import analytics
+import partitions
+import similarity
+
+# 执行计划中的全表扫描: "SCAN 表名" 后面没有 USING (INDEX / COVERING INDEX / INTEGER PRIMARY KEY)
+SCAN_PREFIX = "SCAN "
+TEMP_SORT = "USE TEMP B-TREE"
+AUTO_VACUUM_MODES = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}
+
+def _recent(conn, sample):
+    return partitions.recent_partitions(conn, 100)
+
+def _by_id(conn, sample):
+    return partitions.partitions_for_ids(conn, [sample["id"]])
+
+def _each(conn, sample):
+    return partitions.all_partitions(conn)
+
+# 这些作用范围的查询像 partitions.query_merged 一样在每个分区上单独执行, 视图每次只包含一张表
+PER_PARTITION_SCOPES = (_each,)
+
+def registered_queries():
+    """要检查的查询: (来源, 说明, SQL, 参数 (由样本值生成), 作用范围, 是否预期全表扫描)。
+
+    SQL 直接取自各模块的常量, 与实际执行的语句一致; 新增查询时先在模块中定义常量, 再在这里登记。
+    作用范围为 None 时直接在目录库上执行; 否则返回要挂载的分区, 像 partitions.query 一样在 transcriptions 视图上执行。
+    """
+    import transcribe
+    import web_viewer
+    today = datetime.date.today()
+    rollup_sql, rollup_params = analytics.rollup_query(
+        datetime.datetime.combine(today - datetime.timedelta(days=30), datetime.time.min),
+        datetime.datetime.combine(today, datetime.time.max), "day")
+    export_sql, _ = web_viewer.export_query({"source": "-"})
+    by_ids = lambda columns: web_viewer.BY_IDS_SQL.format(columns=columns, placeholders="?")
+    return [
+        ("web_viewer", "列表: 最近录音所在分区", partitions.RECENT_PARTITIONS_SQL, lambda s: (100,), None, False),
+        ("web_viewer", "列表: 最近录音", web_viewer.RECENT_SQL.format(columns=web_viewer.LIST_COLUMNS),
+         lambda s: (100,), _recent, False),
+        ("web_viewer", "按编号查找分区", partitions.PARTITIONS_FOR_IDS_SQL.format(placeholders="?"),
+         lambda s: (s["id"],), None, False),
+        ("web_viewer", "按编号读取录音", by_ids("id, filename, created_at, full_text, segments_json"),
+         lambda s: (s["id"],), _by_id, False),
+        ("web_viewer", "导出: 按来源过滤", export_sql, lambda s: (f"%{s['filename'][:8]}%",), _each, True),
+        ("web_viewer", "聊天会话列表", web_viewer.CHAT_SESSIONS_SQL, lambda s: (), None, True),
+        ("web_viewer", "聊天会话消息", web_viewer.CHAT_MESSAGES_SQL, lambda s: (s["session_id"],), None, False),
+        ("web_viewer", "删除聊天会话", web_viewer.DELETE_CHAT_SQL, lambda s: (s["session_id"],), None, False),
+        ("web_viewer", "音频归档名", web_viewer.ARCHIVED_NAME_SQL, lambda s: (s["filename"],), None, False),
+        ("web_viewer", "统计: 按天汇总 (最近 30 天)", rollup_sql, lambda s: tuple(rollup_params), None, False),
+        ("web_viewer", "相似度: 加载词频", similarity.LOAD_TERMS_SQL, lambda s: (0,), None, True),
+        ("web_viewer", "相似度: 录音文件名", by_ids("id, filename, created_at, preview"),
+         lambda s: (s["id"],), _by_id, False),
+        ("transcribe", "入库: 编号索引", partitions.INSERT_INDEX_SQL, lambda s: (s["partition"], ""), None, False),
+        ("transcribe", "入库: 写入分区", partitions.INSERT_TRANSCRIPTION_SQL.format(schema="main"),
+         lambda s: (None,) * len(partitions.COLUMNS), None, False),
+        ("transcribe", "入库: 重置分区压缩标记", partitions.RESET_COMPRESSED_SQL, lambda s: (s["partition"],), None, False),
+        ("transcribe", "入库: 累加统计汇总", analytics.ROLLUP_UPSERT_SQL,
+         lambda s: ("day", s["partition"], "0", "neutral", 0, 0, 0, 0), None, False),
+        ("transcribe", "入库: 相似度词频", similarity.STORE_TERMS_SQL, lambda s: (0, b"", b""), None, False),
+        ("transcribe", "入库: 压缩到期分区", partitions.COMPRESS_CANDIDATES_SQL,
+         lambda s: (partitions.compress_cutoff(3),), None, False),
+        ("transcribe", "通知: 写入发件箱", transcribe.OUTBOX_INSERT_SQL, lambda s: ("",), None, False),
+        ("transcribe", "通知: 取一批待发送", transcribe.OUTBOX_BATCH_SQL, lambda s: (20,), None, True),
+        ("transcribe", "通知: 待发送数量", transcribe.OUTBOX_COUNT_SQL, lambda s: (), None, True),
+        ("transcribe", "通知: 记录失败", transcribe.OUTBOX_FAILED_SQL, lambda s: ("", 0), None, False),
+        ("transcribe", "通知: 删除已发送", transcribe.OUTBOX_DELETE_SQL, lambda s: (0,), None, False),
+        ("transcribe", "异步任务: 保存", transcribe.ASR_JOB_SAVE_SQL,
+         lambda s: (s["filename"], "", "", "", "wav"), None, False),
+        ("transcribe", "异步任务: 读取", transcribe.ASR_JOB_LOAD_SQL, lambda s: (s["filename"],), None, False),
+        ("transcribe", "异步任务: 更新状态", transcribe.ASR_JOB_UPDATE_SQL, lambda s: ("polling", s["filename"]), None, False),
+        ("transcribe", "异步任务: 删除", transcribe.ASR_JOB_DELETE_SQL, lambda s: (s["filename"],), None, False),
+        ("transcribe", "异步任务: 启动时恢复", transcribe.ASR_JOB_LIST_SQL, lambda s: (), None, True),
+        ("transcribe", "归档压缩: 记录结果", transcribe.COMPACTION_RECORD_SQL,
+         lambda s: (s["filename"], None, "skipped", None, None), None, False),
+        ("transcribe", "归档压缩: 已处理文件", transcribe.COMPACTION_HANDLED_SQL, lambda s: (), None, True),
+        ("transcribe", "启动: 补齐列表摘要", analytics.MISSING_SUMMARIES_SQL, lambda s: (0, 200), None, False),
+    ]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='数据库健康检查和查询计划分析')
+    parser.add_argument('--source-path', type=str, help='源音频文件路径')
+    parser.add_argument('--db', type=str, help='目录库路径 (默认读取配置 DB_PATH)')
+    parser.add_argument('--no-timing', action='store_true', help='只看执行计划, 不实际执行查询')
+    parser.add_argument('--time-limit', type=float, default=10, help='每条查询最多执行多少秒')
+    parser.add_argument('--quick', action='store_true', help='用 quick_check 代替 integrity_check')
+    parser.add_argument('--skip-integrity', action='store_true', help='跳过完整性检查')
+    parser.add_argument('--analyze', action='store_true', help='更新查询优化器统计 (ANALYZE)')
+    parser.add_argument('--vacuum', type=int, nargs='?', const=0, metavar='PAGES',
+                        help='增量 VACUUM, 每个数据库最多回收多少页 (默认全部)')
+    parser.add_argument('--enable-incremental', action='store_true', help='转换为增量 VACUUM 模式 (执行一次完整 VACUUM)')
+    return parser.parse_args()
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+def connect(path, writable):
+    """默认只读打开, 不会意外建表或改动数据"""
+    if writable:
+        conn = sqlite3.connect(path, timeout=30)
+    else:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+    conn.create_function("unz", 1, partitions.unz, deterministic=True)
+    return conn
+
+def database_files(conn, catalog_path):
+    """[(标签, 路径)]: 目录库和清单中存在的分区"""
+    files = [("目录库", catalog_path)]
+    for name in partitions.all_partitions(conn):
+        path = partitions.partition_path(conn, name)
+        if path and os.path.exists(path):
+            files.append((f"分区 {name}", path))
+        else:
+            print(f"  [警告] 分区 {name} 的文件不存在: {path}")
+    return files
+
+# ---------------- 大小和碎片 ----------------
+def object_sizes(conn):
+    """[(名称, 类型, 所属表, 字节, 页数, 未使用字节)]; SQLite 没有编译 dbstat 时返回 None"""
+    kinds = {name: (kind, table) for kind, name, table in conn.execute("SELECT type, name, tbl_name FROM sqlite_master")}
+    try:
+        rows = conn.execute("SELECT name, SUM(pgsize), COUNT(*), SUM(unused) FROM dbstat GROUP BY name").fetchall()
+    except sqlite3.OperationalError:
+        return None
+    result = []
+    for name, size, pages, unused in rows:
+        kind, table = kinds.get(name, ("table", name))
+        result.append((name, kind, table, size, pages, unused))
+    return sorted(result, key=lambda row: row[3], reverse=True)
+
+def report_sizes(label, path, conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = AUTO_VACUUM_MODES.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0], "?")
+    print(f"\n== {label}: {path}")
+    print(f"  文件 {format_size(os.path.getsize(path))}，页大小 {page_size}，共 {page_count} 页，"
+          f"空闲页 {freelist} ({freelist / max(page_count, 1):.1%}，{format_size(freelist * page_size)})，auto_vacuum={auto_vacuum}")
+    sizes = object_sizes(conn)
+    if sizes is None:
+        print("  (当前 SQLite 没有编译 dbstat, 只显示行数)")
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"):
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            print(f"  {name:<36} {rows:>10} 行")
+        return
+    # 名称放在最后, 中文表头按显示宽度对齐
+    print("       大小     页数 页内未用       行数  对象")
+    for name, kind, table, size, pages, unused in sizes:
+        rows = ""
+        if kind == "table" and not name.startswith("sqlite_"):
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+        title = name if kind != "index" else f"{name} (索引, {table})"
+        print(f"  {format_size(size):>9} {pages:>8} {unused / max(size, 1):>8.0%} {rows:>10}  {title}")
+
+# ---------------- 完整性 ----------------
+def check_integrity(label, conn, quick):
+    pragma = "quick_check" if quick else "integrity_check"
+    started = time.time()
+    rows = [row[0] for row in conn.execute(f"PRAGMA {pragma}(20)")]
+    elapsed = time.time() - started
+    if rows == ["ok"]:
+        print(f"  [{pragma}] {label}: ok ({elapsed:.1f}s)")
+        return True
+    print(f"  [{pragma}] {label}: 发现 {len(rows)} 个问题 ({elapsed:.1f}s)")
     for row in rows:
-        print(f"- {row}")
-else:
-    print("\nchat_history table does not exist")
-
-# 检查transcriptions表是否存在
-if any('transcriptions' in table for table in tables):
-    print("\ntranscriptions table structure:")
-    cursor.execute("PRAGMA table_info(transcriptions)")
-    columns = cursor.fetchall()
-    for col in columns:
-        print(f"- {col[1]} ({col[2]})")
-    
-    # 查询transcriptions表中的数据数量
-    print("\nData count in transcriptions table:")
-    cursor.execute("SELECT COUNT(*) FROM transcriptions")
-    count = cursor.fetchone()
-    print(f"- Total rows: {count[0]}")
-
-conn.close()
\ No newline at end of file
+        print(f"    - {row}")
+    return False
+
+# ---------------- 查询计划 ----------------
+def load_sample(conn):
+    """生成查询参数用的样本值 (取库中真实存在的一条), 查不到时用占位值"""
+    today = datetime.date.today()
+    sample = {"id": 0, "filename": "", "session_id": "", "partition": today.strftime('%Y-%m')}
+    lookups = {
+        "id": "SELECT MAX(id) FROM main.transcription_index",
+        "partition": "SELECT MAX(name) FROM main.partitions",
+        "session_id": "SELECT session_id FROM chat_history LIMIT 1",
+    }
+    for key, sql in lookups.items():
+        try:
+            row = conn.execute(sql).fetchone()
+        except sqlite3.OperationalError:
+            continue
+        if row and row[0] is not None:
+            sample[key] = row[0]
+    try:
+        rows = partitions.query(conn, partitions.partitions_for_ids(conn, [sample["id"]]),
+                                "SELECT filename FROM transcriptions WHERE id = ?", (sample["id"],))
+        if rows:
+            sample["filename"] = rows[0][0]
+    except sqlite3.OperationalError:
+        pass
+    return sample
+
+def plan_flags(details, expect_scan):
+    """[(是否需要关注, 说明)]; 扫描子查询或视图展开的中间结果 (CO-ROUTINE) 不算全表扫描"""
+    coroutines = {detail.split(" ", 1)[1] for detail in details if detail.startswith("CO-ROUTINE ")}
+    flags = []
+    for detail in details:
+        if detail.startswith(SCAN_PREFIX) and " USING " not in detail:
+            target = detail[len(SCAN_PREFIX):]
+            if target in coroutines or target.startswith(("(", "CONSTANT")):
+                continue
+            flags.append((not expect_scan, ("全表扫描 (预期)" if expect_scan else "全表扫描") + f": {target}"))
+        elif detail.startswith(TEMP_SORT):
+            flags.append((False, f"临时排序: {detail[len(TEMP_SORT):].strip()}"))
+    return flags
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+def time_query(conn, sql, params, time_limit):
+    """执行查询并丢弃结果, 返回 (行数, 秒数); 超过 time_limit 时中止, 行数为 None"""
+    started = time.time()
+    conn.set_progress_handler(lambda: 1 if time.time() - started > time_limit else 0, 10000)
+    rows = 0
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            batch = cursor.fetchmany(500)
+            if not batch:
+                break
+            rows += len(batch)
+    except sqlite3.OperationalError as e:
+        if "interrupted" not in str(e):
+            raise
+        rows = None
+    finally:
+        conn.set_progress_handler(None, 0)
+    return rows, time.time() - started
+
+def check_queries(conn, args):
+    sample = load_sample(conn)
+    print(f"\n== 查询计划 (样本: 编号 {sample['id']}，文件 {sample['filename'] or '-'})")
+    warnings = 0
+    queries = registered_queries()
+    for source, title, sql, make_params, scope, expect_scan in queries:
+        sql = " ".join(sql.split())
+        params = make_params(sample)
+        writes = sql.split()[0].upper() in ("INSERT", "UPDATE", "DELETE")
+        try:
+            names = scope(conn, sample) if scope else None
+            if names is None:
+                groups = [None]
+            elif scope in PER_PARTITION_SCOPES:
+                groups = partitions.each_partition(conn, names)
+            else:
+                groups = partitions.each_group(conn, names)
+            details, rows, elapsed, interrupted = [], 0, 0.0, False
+            for _ in groups:
+                group_details = explain(conn, sql, params)
+                details.extend(detail for detail in group_details if detail not in details)
+                if args.no_timing or writes or interrupted:
+                    continue
+                count, seconds = time_query(conn, sql, params, max(args.time_limit - elapsed, 0.1))
+                elapsed += seconds
+                if count is None:
+                    interrupted = True
+                else:
+                    rows += count
+        except sqlite3.OperationalError as e:
+            print(f"\n  [{source}] {title}: 跳过 ({e})")
+            continue
+        flags = plan_flags(details, expect_scan)
+        if any(warn for warn, _ in flags):
+            warnings += 1
+        if writes:
+            timing = "写语句, 只分析计划"
+        elif args.no_timing:
+            timing = "未执行"
+        elif interrupted:
+            timing = f"超过 {args.time_limit:.0f}s, 已中止"
+        else:
+            timing = f"{elapsed * 1000:.1f}ms，{rows} 行"
+        scope_note = f"，{len(names)} 个分区" if names is not None else ""
+        print(f"\n  [{source}] {title} ({timing}{scope_note})")
+        print(f"    {sql[:160]}{'...' if len(sql) > 160 else ''}")
+        for detail in details:
+            print(f"    | {detail}")
+        for warn, flag in flags:
+            print(f"    {'!' if warn else '-'} {flag}")
+    print(f"\n  共 {len(queries)} 条查询，{warnings} 条存在非预期的全表扫描")
+
+# ---------------- 维护 ----------------
+def analyze(label, conn):
+    started = time.time()
+    conn.execute("ANALYZE")
+    conn.commit()
+    print(f"  [ANALYZE] {label}: 完成 ({time.time() - started:.1f}s)")
+
+def enable_incremental(label, conn):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    started = time.time()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # 已有数据的数据库需要完整 VACUUM 一次才会生效
+    conn.execute("VACUUM")
+    print(f"  [VACUUM] {label}: 已转换为增量模式 ({time.time() - started:.1f}s)")
+
+def incremental_vacuum(label, conn, pages):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        print(f"  [VACUUM] {label}: 不是增量模式, 跳过 (可用 --enable-incremental 转换)")
+        return
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    started = time.time()
+    # incremental_vacuum 每执行一步回收一页, execute() 只执行第一步, executescript 会执行到底
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages) if pages else 0});")
+    freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    print(f"  [VACUUM] {label}: 回收 {freed} 页 ({format_size(freed * page_size)})，耗时 {time.time() - started:.1f}s")
+
+def main():
+    import transcribe
+    args = parse_args()
+    transcribe.update_config(args)
+    db_path = args.db or transcribe.CONFIG["DB_PATH"]
+    print(f"检查数据库: {db_path}")
+    if not os.path.exists(db_path):
+        print("数据库不存在")
+        return 1
+    writable = args.analyze or args.vacuum is not None or args.enable_incremental
+    conn = connect(db_path, writable)
+    try:
+        files = database_files(conn, db_path)
+        healthy = True
+        for label, path in files:
+            file_conn = conn if path == db_path else connect(path, writable)
+            try:
+                report_sizes(label, path, file_conn)
+                if not args.skip_integrity:
+                    healthy = check_integrity(label, file_conn, args.quick) and healthy
+                if args.analyze:
+                    analyze(label, file_conn)
+            finally:
+                if file_conn is not conn:
+                    file_conn.close()
+        check_queries(conn, args)
+        if args.enable_incremental or args.vacuum is not None:
+            print("\n== 维护")
+            for label, path in files:
+                file_conn = conn if path == db_path else connect(path, True)
+                try:
+                    if args.enable_incremental:
+                        enable_incremental(label, file_conn)
+                    if args.vacuum is not None:
+                        incremental_vacuum(label, file_conn, args.vacuum)
+                finally:
+                    if file_conn is not conn:
+                        file_conn.close()
+        return 0 if healthy else 1
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
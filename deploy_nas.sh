@@ -15,6 +15,11 @@ SOURCE_PATH="${SOURCE_PATH_OVERRIDE:-$DEFAULT_SOURCE_PATH}"
 
 # 日志路径配置
 LOG_FILE_PATH="${SCRIPT_DIR}/transcribe.log"
+
+# 停止服务时等待正常退出的最长秒数, 超时后才强制停止
+# transcribe.py 收到 SIGTERM 后会等在途转录完成 (SHUTDOWN_DRAIN_SECONDS, 默认 900 秒), 这里要比它略长
+MONITOR_STOP_TIMEOUT="${MONITOR_STOP_TIMEOUT:-960}"
+WEB_STOP_TIMEOUT="${WEB_STOP_TIMEOUT:-10}"
 # ===========================================
 
 echo "=== 开始执行 NAS 部署 (幂等模式) ==="
@@ -40,9 +45,20 @@ ensure_service_running() {
     if [ "$PROC_COUNT" -ge 1 ]; then
         local PIDS=$(ps aux | grep "[${SCRIPT_NAME:0:1}]${SCRIPT_NAME:1}" | awk '{print $2}')
         echo "  [停止] 检测到 $PROC_COUNT 个 $SCRIPT_NAME 实例在运行 (PID: $PIDS)。正在停止..."
-        pkill -f "$SCRIPT_NAME"
-        # 等待进程完全停止
-        sleep 1
+        pkill -TERM -f "$SCRIPT_NAME"
+        # 等待进程正常退出 (转录服务会先完成正在进行的转录)
+        local STOP_TIMEOUT=$WEB_STOP_TIMEOUT
+        if [ "$SCRIPT_NAME" = "$MONITOR_SCRIPT" ]; then
+            STOP_TIMEOUT=$MONITOR_STOP_TIMEOUT
+        fi
+        local WAITED=0
+        while [ "$WAITED" -lt "$STOP_TIMEOUT" ] && ps aux | grep -q "[${SCRIPT_NAME:0:1}]${SCRIPT_NAME:1}"; do
+            sleep 2
+            WAITED=$((WAITED + 2))
+            if [ $((WAITED % 30)) -eq 0 ]; then
+                echo "  [等待] $SCRIPT_NAME 正在完成在途任务，已等待 ${WAITED}s (最多 ${STOP_TIMEOUT}s)..."
+            fi
+        done
         # 再次检查是否还有进程残留
         local REMAINING=$(ps aux | grep "[${SCRIPT_NAME:0:1}]${SCRIPT_NAME:1}" | wc -l)
         if [ "$REMAINING" -gt 0 ]; then
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按月分区的转录数据库。
+
+DB_PATH 作为目录库: 保存分区清单 partitions、录音编号索引 transcription_index, 以及统计汇总、相似度词频、
+发件箱等小表; 录音的全文和分段按录音月份写入 DB_PARTITION_DIR/transcripts-YYYY-MM.db。
+读取时只 ATTACH 本次查询需要的分区, 再建立 TEMP VIEW transcriptions 把它们和目录库中升级前的
+transcriptions 表合并, 原有的查询语句不需要修改。超过 DB_PARTITION_COMPRESS_MONTHS 个月的分区,
+全文和分段压缩为 zlib BLOB, 读取时自动解压。
+
+升级前的数据可以在服务运行时逐批迁移到分区:
+    python partitions.py --migrate --source-path /volume2/download/records/Sony-2
+    python partitions.py --compress      # 立即压缩所有旧分区
+    python partitions.py --list
+"""
+
+import os
+import sys
+import time
+import zlib
+import heapq
+import sqlite3
+import argparse
+import datetime
+
+import analytics
+
+# SQLite 默认最多 ATTACH 10 个数据库, 留出余量; 需要更多分区时分组依次查询
+MAX_ATTACHED = 8
+COLUMNS = ("id", "filename", "created_at", "full_text", "segments_json", "duration_ms", "speakers_json", "preview")
+# 压缩后以 BLOB 保存的列, 视图中由 unz() 解压
+COMPRESSED_COLUMNS = ("full_text", "segments_json")
+WRITE_SCHEMA = "w"
+
+# 写入和查找分区用到的语句, check_db.py 直接引用这些常量检查执行计划
+INSERT_INDEX_SQL = "INSERT INTO main.transcription_index (partition, created_at) VALUES (?, ?)"
+INSERT_TRANSCRIPTION_SQL = (f"INSERT INTO {{schema}}.transcriptions ({', '.join(COLUMNS)}) "
+                            f"VALUES ({', '.join('?' * len(COLUMNS))})")
+RESET_COMPRESSED_SQL = "UPDATE main.partitions SET compressed_at = NULL WHERE name = ? AND compressed_at IS NOT NULL"
+RECENT_PARTITIONS_SQL = '''
+        SELECT DISTINCT partition FROM (
+            SELECT partition FROM main.transcription_index ORDER BY created_at DESC, id DESC LIMIT ?
+        ) ORDER BY partition DESC'''
+PARTITIONS_FOR_IDS_SQL = "SELECT DISTINCT partition FROM main.transcription_index WHERE id IN ({placeholders})"
+COMPRESS_CANDIDATES_SQL = "SELECT name FROM main.partitions WHERE compressed_at IS NULL AND name < ? ORDER BY name"
+
+def init_catalog(cursor):
+    """目录库中的分区清单和编号索引; 需要在 transcriptions 表创建之后调用。"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS partitions (
+        name TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        compressed_at TIMESTAMP
+    );
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS transcription_index (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        partition TEXT NOT NULL,
+        created_at TIMESTAMP
+    );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_transcription_index_created ON transcription_index(created_at)")
+    # 新录音的编号接在升级前的记录之后, 迁移时保留原编号
+    legacy_max = max(
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM main.transcriptions").fetchone()[0],
+        (cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transcriptions'").fetchone() or [0])[0]
+    )
+    row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transcription_index'").fetchone()
+    if row is None and legacy_max:
+        cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('transcription_index', ?)", (legacy_max,))
+    elif row is not None and row[0] < legacy_max:
+        cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'transcription_index'", (legacy_max,))
+
+def partition_key(filename, created_at):
+    """按录音时间 (解析不出时按入库时间) 分到 YYYY-MM 分区"""
+    recorded = analytics.parse_recorded_time(filename, created_at)
+    return (recorded or datetime.datetime.now()).strftime('%Y-%m')
+
+def partition_dir(db_path, configured=""):
+    return configured or os.path.join(os.path.dirname(os.path.abspath(db_path)), "partitions")
+
+def catalog_dir(conn):
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main" and path:
+            return os.path.dirname(path)
+    return os.getcwd()
+
+def _catalog_rows(conn, sql, params=()):
+    """读取目录库; 旧数据库还没有分区表时返回空"""
+    try:
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+def partition_path(conn, name):
+    rows = _catalog_rows(conn, "SELECT path FROM main.partitions WHERE name = ?", (name,))
+    # 清单中保存相对目录库的路径, 整个目录搬走后仍然有效
+    return os.path.join(catalog_dir(conn), rows[0][0]) if rows else None
+
+def unz(value):
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+def z(value):
+    if isinstance(value, str):
+        return zlib.compress(value.encode('utf-8'), 6)
+    return value
+
+def attached_schemas(conn):
+    return [name for _, name, _ in conn.execute("PRAGMA database_list") if name not in ("main", "temp")]
+
+def detach(conn, schema):
+    if schema in attached_schemas(conn):
+        conn.execute(f"DETACH DATABASE {schema}")
+
+def create_partition_table(conn, schema):
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {schema}.transcriptions (
+        id INTEGER PRIMARY KEY,
+        filename TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        full_text TEXT,
+        segments_json TEXT,
+        duration_ms INTEGER,
+        speakers_json TEXT,
+        preview TEXT
+    );
+    ''')
+
+def attach_for_write(conn, name, directory):
+    """确保分区存在并挂载为 w, 返回 schema 名。ATTACH 不能在事务中执行, 需要在写入之前调用。"""
+    path = partition_path(conn, name)
+    if path is None:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(os.path.abspath(directory), f"transcripts-{name}.db")
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO main.partitions (name, path) VALUES (?, ?)",
+                         (name, os.path.relpath(path, catalog_dir(conn))))
+        # 其他线程可能同时创建了同一个分区, 以清单中的路径为准
+        path = partition_path(conn, name)
+    detach(conn, WRITE_SCHEMA)
+    conn.execute(f"ATTACH DATABASE ? AS {WRITE_SCHEMA}", (path,))
+    create_partition_table(conn, WRITE_SCHEMA)
+    return WRITE_SCHEMA
+
+def insert_transcription(cursor, schema, name, filename, created_at, full_text, segments_json, summary):
+    """写入一条录音, 返回全局编号; 调用方负责事务, 目录库和分区在同一个事务中提交。"""
+    transcription_id = cursor.execute(INSERT_INDEX_SQL, (name, created_at)).lastrowid
+    cursor.execute(
+        INSERT_TRANSCRIPTION_SQL.format(schema=schema),
+        (transcription_id, filename, created_at, full_text, segments_json) + tuple(summary)
+    )
+    # 迟到的录音写入已压缩的分区, 之后需要重新压缩
+    cursor.execute(RESET_COMPRESSED_SQL, (name,))
+    return transcription_id
+
+def _select_sql(schema, existing, decompress):
+    columns = []
+    for column in COLUMNS:
+        if column not in existing:
+            columns.append(f"NULL AS {column}")
+        elif decompress and column in COMPRESSED_COLUMNS:
+            columns.append(f"unz({column}) AS {column}")
+        else:
+            columns.append(column)
+    return f"SELECT {', '.join(columns)} FROM {schema}.transcriptions"
+
+def release(conn):
+    """删除视图并卸载分区; 连接处于未完成的语句中时忽略错误 (连接随后关闭)"""
+    try:
+        conn.execute("DROP VIEW IF EXISTS temp.transcriptions")
+        for schema in attached_schemas(conn):
+            if schema != WRITE_SCHEMA:
+                conn.execute(f"DETACH DATABASE {schema}")
+    except sqlite3.Error:
+        pass
+
+def attach(conn, names, include_legacy=True):
+    """挂载指定分区, 建立 TEMP VIEW transcriptions。ATTACH 不能在事务中执行。"""
+    conn.create_function("unz", 1, unz, deterministic=True)
+    release(conn)
+    selects = []
+    if include_legacy:
+        existing = {row[1] for row in conn.execute("PRAGMA main.table_info(transcriptions)")}
+        if existing:
+            selects.append(_select_sql("main", existing, decompress=False))
+    for i, name in enumerate(names):
+        path = partition_path(conn, name)
+        if not path or not os.path.exists(path):
+            continue
+        conn.execute(f"ATTACH DATABASE ? AS p{i}", (path,))
+        selects.append(_select_sql(f"p{i}", COLUMNS, decompress=True))
+    if not selects:
+        selects.append(f"SELECT {', '.join(f'NULL AS {column}' for column in COLUMNS)} WHERE 0")
+    conn.execute("CREATE TEMP VIEW transcriptions AS " + " UNION ALL ".join(selects))
+
+def each_group(conn, names):
+    """按 MAX_ATTACHED 个一组依次挂载分区, 每组挂载后 yield 一次; 升级前的旧表只在第一组中出现。"""
+    names = list(names)
+    try:
+        for start in range(0, max(len(names), 1), MAX_ATTACHED):
+            attach(conn, names[start:start + MAX_ATTACHED], include_legacy=(start == 0))
+            yield
+    finally:
+        release(conn)
+
+def each_partition(conn, names):
+    """依次单独挂载升级前的旧表和每个分区, 每次 yield 时视图只包含一张表, 按主键排序不需要临时排序"""
+    try:
+        attach(conn, [], include_legacy=True)
+        yield
+        for name in names:
+            attach(conn, [name], include_legacy=False)
+            yield
+    finally:
+        release(conn)
+
+def query_merged(open_conn, names, sql, params=(), key=lambda row: row[0]):
+    """在旧表和每个分区上分别执行同一条已按 key 排序的查询, 归并为整体有序的结果逐行产出。
+
+    每个分区使用 open_conn() 打开的独立连接, 所有游标同时打开, 内存占用与数据量无关。
+    """
+    conns = []
+    try:
+        cursors = []
+        for name in [None] + list(names):
+            conn = open_conn()
+            conns.append(conn)
+            attach(conn, [] if name is None else [name], include_legacy=name is None)
+            cursors.append(conn.execute(sql, params))
+        yield from heapq.merge(*cursors, key=key)
+    finally:
+        for conn in conns:
+            release(conn)
+            conn.close()
+
+def query(conn, names, sql, params=()):
+    """在指定分区 (和旧表) 上执行同一条查询, 返回所有分组结果的拼接; 需要排序时由调用方合并。"""
+    rows = []
+    for _ in each_group(conn, names):
+        rows.extend(conn.execute(sql, params).fetchall())
+    return rows
+
+def all_partitions(conn):
+    return [row[0] for row in _catalog_rows(conn, "SELECT name FROM main.partitions ORDER BY name")]
+
+def recent_partitions(conn, limit):
+    """最近入库的 limit 条录音所在的分区"""
+    return [row[0] for row in _catalog_rows(conn, RECENT_PARTITIONS_SQL, (limit,))]
+
+def partitions_for_ids(conn, ids):
+    names = set()
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        names.update(row[0] for row in _catalog_rows(
+            conn, PARTITIONS_FOR_IDS_SQL.format(placeholders=','.join('?' * len(chunk))), chunk))
+    return sorted(names)
+
+def partitions_between(conn, start=None, end=None):
+    """录音时间落在 [start, end] 内的分区"""
+    return [name for name in all_partitions(conn)
+            if (start is None or name >= start.strftime('%Y-%m')) and (end is None or name <= end.strftime('%Y-%m'))]
+
+# ---------------- 压缩 ----------------
+def compress_cutoff(months):
+    """早于该月份 (YYYY-MM) 的分区需要压缩"""
+    today = datetime.date.today()
+    index = today.year * 12 + today.month - 1 - int(months)
+    return f"{index // 12:04}-{index % 12 + 1:02}"
+
+def compress_candidates(conn, months):
+    if not months or int(months) <= 0:
+        return []
+    return [row[0] for row in _catalog_rows(
+        conn, COMPRESS_CANDIDATES_SQL, (compress_cutoff(months),))]
+
+def compress_partition(conn, name):
+    """把分区中的全文和分段压缩为 zlib BLOB 并 VACUUM, 返回 (压缩前字节数, 压缩后字节数)。"""
+    path = partition_path(conn, name)
+    # 先标记: 压缩期间写入的迟到录音会清除标记, 下次再压缩
+    with conn:
+        conn.execute("UPDATE main.partitions SET compressed_at = CURRENT_TIMESTAMP WHERE name = ?", (name,))
+    before = os.path.getsize(path)
+    part = sqlite3.connect(path)
+    try:
+        part.create_function("z", 1, z, deterministic=True)
+        with part:
+            part.execute('''UPDATE transcriptions SET full_text = z(full_text), segments_json = z(segments_json)
+                            WHERE typeof(full_text) = 'text' OR typeof(segments_json) = 'text' ''')
+        part.execute("VACUUM")
+    finally:
+        part.close()
+    return before, os.path.getsize(path)
+
+def compress_step(conn, months):
+    """压缩一个到期的分区, 返回分区名; 没有需要压缩的分区时返回 None"""
+    candidates = compress_candidates(conn, months)
+    if not candidates:
+        return None
+    name = candidates[0]
+    started = time.time()
+    before, after = compress_partition(conn, name)
+    print(f"[分区] 已压缩 {name}: {before / 1048576:.1f}MB -> {after / 1048576:.1f}MB，耗时 {time.time() - started:.1f}s")
+    return name
+
+# ---------------- 迁移 ----------------
+def migrate_legacy(conn, directory, batch_size=500, pause=0.05):
+    """把目录库中升级前的 transcriptions 逐批移到分区, 保留原编号。
+
+    每批在目录库和分区的同一个事务中插入并删除, 查询方在任何时刻都只看到每条录音一次, 可以在服务运行时执行。
+    """
+    total = conn.execute("SELECT COUNT(*) FROM main.transcriptions").fetchone()[0]
+    if not total:
+        print("没有需要迁移的记录")
+        return 0
+    print(f"待迁移 {total} 条录音 -> {directory}")
+    started, moved = time.time(), 0
+    while True:
+        rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM main.transcriptions ORDER BY id LIMIT ?",
+                            (batch_size,)).fetchall()
+        if not rows:
+            break
+        groups = {}
+        for row in rows:
+            groups.setdefault(partition_key(row[1], row[2]), []).append(row)
+        for name, group in groups.items():
+            schema = attach_for_write(conn, name, directory)
+            with conn:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {schema}.transcriptions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    group
+                )
+                conn.executemany("INSERT OR REPLACE INTO main.transcription_index (id, partition, created_at) VALUES (?, ?, ?)",
+                                 [(row[0], name, row[2]) for row in group])
+                conn.executemany("DELETE FROM main.transcriptions WHERE id = ?", [(row[0],) for row in group])
+                conn.execute("UPDATE main.partitions SET compressed_at = NULL WHERE name = ?", (name,))
+            detach(conn, schema)
+        moved += len(rows)
+        rate = moved / max(time.time() - started, 1e-6)
+        print(f"\r  已迁移 {moved}/{total} ({rate:.0f} 条/秒)", end="", flush=True)
+        # 让出锁, 转录服务和网页的读写不必长时间等待
+        time.sleep(pause)
+    print(f"\r  已迁移 {moved} 条录音到 {len(all_partitions(conn))} 个分区，耗时 {time.time() - started:.1f}s".ljust(60))
+    return moved
+
+def print_partitions(conn):
+    counts = dict(_catalog_rows(conn, "SELECT partition, COUNT(*) FROM main.transcription_index GROUP BY partition"))
+    legacy = conn.execute("SELECT COUNT(*) FROM main.transcriptions").fetchone()[0]
+    print(f"目录库: {legacy} 条未迁移的录音")
+    for name, path, compressed_at in _catalog_rows(conn, "SELECT name, path, compressed_at FROM main.partitions ORDER BY name"):
+        full_path = os.path.join(catalog_dir(conn), path)
+        size = os.path.getsize(full_path) / 1048576 if os.path.exists(full_path) else 0
+        print(f"  {name}  {counts.get(name, 0):>7} 条  {size:>8.1f}MB  {'已压缩 ' + compressed_at if compressed_at else ''}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='按月分区的转录数据库')
+    parser.add_argument('--source-path', type=str, help='源音频文件路径')
+    parser.add_argument('--migrate', action='store_true', help='把目录库中升级前的记录迁移到分区')
+    parser.add_argument('--batch-size', type=int, default=500, help='迁移时每个事务移动的行数')
+    parser.add_argument('--vacuum', action='store_true', help='迁移后 VACUUM 目录库, 释放空间')
+    parser.add_argument('--compress', action='store_true', help='立即压缩所有到期的旧分区')
+    parser.add_argument('--months', type=int, help='压缩超过多少个月的分区 (默认读取配置 DB_PARTITION_COMPRESS_MONTHS)')
+    parser.add_argument('--list', action='store_true', help='列出分区')
+    return parser.parse_args()
+
+def main():
+    import transcribe
+    args = parse_args()
+    transcribe.update_config(args)
+    print(f"数据库: {transcribe.CONFIG['DB_PATH']}")
+    transcribe.init_db()
+    conn = sqlite3.connect(transcribe.CONFIG["DB_PATH"])
+    try:
+        if args.migrate:
+            migrate_legacy(conn, transcribe.get_partition_dir(), args.batch_size)
+            if args.vacuum:
+                started = time.time()
+                conn.execute("VACUUM")
+                print(f"  目录库 VACUUM 完成，耗时 {time.time() - started:.1f}s")
+        if args.compress:
+            months = args.months if args.months is not None else transcribe.CONFIG.get("DB_PARTITION_COMPRESS_MONTHS", 3)
+            while compress_step(conn, months):
+                pass
+        if args.list or not (args.migrate or args.compress):
+            print_partitions(conn)
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
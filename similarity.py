@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相关录音: 基于字符 n-gram TF-IDF 的离线相似度索引, 不需要联网或外部模型。
+
+transcribe.py 入库时把每条录音的 n-gram 词频 (哈希到固定维度) 写入 similarity_terms,
+web_viewer.py 在内存中维护稀疏矩阵, 只增量加载新写入的行, /api/related/<id> 返回余弦相似度最高的录音。
+升级前已有的数据需要先生成词频:
+    python similarity.py --rebuild --source-path /volume2/download/records/Sony-2
+    python similarity.py --query 123        # 命令行查看相关录音
+"""
+
+import re
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+import threading
+from array import array
+from collections import Counter
+
+import partitions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NGRAM_SIZES = (2, 3)
+# n-gram 哈希到的维度 (2^20), 冲突对相似度排序的影响可以忽略
+N_FEATURES = 1 << 20
+# 内存索引中每条录音只保留权重最高的词, 控制矩阵大小
+MAX_TERMS_PER_DOC = 128
+# 出现在超过该比例 (且超过 MIN_SKIP_DOC_FREQ 条) 录音中的词区分度太低, 查询时跳过, 也避免遍历过长的倒排列表
+MAX_DOC_FREQ = 0.2
+MIN_SKIP_DOC_FREQ = 100
+# 新增录音超过该比例时全量重建, 让旧录音按最新的 IDF 重新挑选保留的词
+FULL_REBUILD_GROWTH = 0.2
+# 两次刷新索引的最短间隔 (秒)
+REFRESH_INTERVAL = 30
+# 入库和增量加载词频的语句, check_db.py 直接引用检查执行计划
+STORE_TERMS_SQL = "INSERT OR REPLACE INTO similarity_terms (transcription_id, terms, counts) VALUES (?, ?, ?)"
+LOAD_TERMS_SQL = "SELECT transcription_id, terms, counts FROM similarity_terms WHERE transcription_id > ? ORDER BY transcription_id"
+
+def init_similarity_tables(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS similarity_terms (
+        transcription_id INTEGER PRIMARY KEY,
+        terms BLOB NOT NULL,
+        counts BLOB NOT NULL
+    );
+    ''')
+
+def document_text(full_text, segments):
+    text = full_text or " ".join(seg.get('text', '') for seg in segments or [])
+    return re.sub(r'<\|.*?\|>', '', text).lower()
+
+def term_counts(text):
+    """连续的文字/数字串内取 2-gram 和 3-gram, 哈希为特征编号"""
+    counts = Counter()
+    for run in re.findall(r'\w+', text):
+        for n in NGRAM_SIZES:
+            for i in range(len(run) - n + 1):
+                counts[zlib.crc32(run[i:i + n].encode('utf-8')) & (N_FEATURES - 1)] += 1
+    return counts
+
+def encode_terms(counts):
+    terms = sorted(counts)
+    return array('I', terms).tobytes(), array('H', (min(counts[t], 65535) for t in terms)).tobytes()
+
+def store_terms(cursor, transcription_id, full_text, segments):
+    """写入一条录音的词频; 调用方负责事务, 与写入 transcriptions 放在同一个事务中。"""
+    terms, counts = encode_terms(term_counts(document_text(full_text, segments)))
+    cursor.execute(STORE_TERMS_SQL, (transcription_id, terms, counts))
+
+def rebuild_terms(conn, only_missing=False):
+    started = time.time()
+    init_similarity_tables(conn.cursor())
+    sql = "SELECT id, full_text, segments_json FROM transcriptions"
+    if only_missing:
+        sql += " WHERE id NOT IN (SELECT transcription_id FROM similarity_terms)"
+    else:
+        with conn:
+            conn.execute("DELETE FROM similarity_terms")
+    count = 0
+    # 逐组挂载分区, 每组一个事务
+    for _ in partitions.each_group(conn, partitions.all_partitions(conn)):
+        rows = conn.execute(sql).fetchall()
+        with conn:
+            for transcription_id, full_text, segments_json in rows:
+                try:
+                    segments = json.loads(segments_json or '[]')
+                except ValueError:
+                    segments = []
+                store_terms(conn, transcription_id, full_text, segments)
+                count += 1
+                if count % 500 == 0:
+                    print(f"\r  已处理 {count}", end="", flush=True)
+    print(f"\r  已生成 {count} 条录音的词频，耗时 {time.time() - started:.1f}s".ljust(40))
+    return count
+
+class SimilarityIndex:
+    """内存中的 TF-IDF 稀疏矩阵 (CSR 按行追加, 查询前转为按列排序的倒排表)。"""
+
+    def __init__(self, db_path_getter):
+        self.db_path_getter = db_path_getter
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.doc_ids = np.zeros(0, dtype=np.int64)
+        self.row_of = {}
+        self.df = np.zeros(N_FEATURES, dtype=np.int32)
+        self.indptr = [np.zeros(1, dtype=np.int64)]
+        self.indices = []
+        self.tf = []
+        self.last_id = 0
+        self.built_docs = 0
+        self.nnz = 0
+        self.dirty = False
+        self.columns = None
+        self.last_refresh = 0
+
+    @property
+    def size(self):
+        return len(self.doc_ids)
+
+    def _load_new_rows(self, conn):
+        """只读取上次之后新写入的行, 追加到 CSR"""
+        rows = conn.execute(LOAD_TERMS_SQL, (self.last_id,)).fetchall()
+        if not rows:
+            return 0
+        parsed = []
+        for transcription_id, terms_blob, counts_blob in rows:
+            terms = np.frombuffer(terms_blob, dtype=np.uint32).astype(np.int32)
+            counts = np.frombuffer(counts_blob, dtype=np.uint16).astype(np.float32)
+            self.df[terms] += 1
+            parsed.append((transcription_id, terms, counts))
+        n_docs = self.size + len(parsed)
+        idf = self._idf(n_docs)
+        new_ids, lengths = [], []
+        for transcription_id, terms, counts in parsed:
+            weights = (1 + np.log(counts)) * idf[terms]
+            if len(terms) > MAX_TERMS_PER_DOC:
+                keep = np.sort(np.argpartition(weights, -MAX_TERMS_PER_DOC)[-MAX_TERMS_PER_DOC:])
+                terms, counts = terms[keep], counts[keep]
+            self.row_of[transcription_id] = self.size + len(new_ids)
+            new_ids.append(transcription_id)
+            self.indices.append(terms)
+            self.tf.append(1 + np.log(counts))
+            lengths.append(len(terms))
+        self.indptr.append(self.nnz + np.cumsum(lengths))
+        self.nnz += int(sum(lengths))
+        self.doc_ids = np.concatenate((self.doc_ids, np.array(new_ids, dtype=np.int64)))
+        self.last_id = int(new_ids[-1])
+        self.dirty = True
+        return len(new_ids)
+
+    def _idf(self, n_docs):
+        return (np.log((1 + n_docs) / (1 + self.df)) + 1).astype(np.float32)
+
+    def _build_columns(self):
+        """按当前 IDF 计算归一化权重, 并按特征编号排序得到倒排表"""
+        indptr = np.concatenate(self.indptr)
+        indices = np.concatenate(self.indices) if self.indices else np.zeros(0, dtype=np.int32)
+        tf = np.concatenate(self.tf) if self.tf else np.zeros(0, dtype=np.float32)
+        self.indptr, self.indices, self.tf = [indptr], [indices], [tf]
+        rows = np.repeat(np.arange(self.size, dtype=np.int32), np.diff(indptr))
+        weights = tf * self._idf(self.size)[indices]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=self.size)).astype(np.float32)
+        weights /= np.maximum(norms[rows], 1e-9)
+        order = np.argsort(indices, kind='stable')
+        col_ptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indices, minlength=N_FEATURES), out=col_ptr[1:])
+        self.columns = {
+            "indptr": indptr, "indices": indices, "weights": weights,
+            "col_ptr": col_ptr, "col_rows": rows[order], "col_weights": weights[order]
+        }
+        self.dirty = False
+
+    def refresh(self, force=False):
+        now = time.time()
+        if not force and now - self.last_refresh < REFRESH_INTERVAL and self.columns is not None:
+            return
+        with self.lock:
+            self.last_refresh = now
+            conn = sqlite3.connect(self.db_path_getter())
+            try:
+                if self.built_docs and self.size > self.built_docs * (1 + FULL_REBUILD_GROWTH):
+                    self._reset()
+                    self.last_refresh = now
+                self._load_new_rows(conn)
+            finally:
+                conn.close()
+            if not self.built_docs or self.columns is None:
+                self.built_docs = self.size
+            if self.dirty or self.columns is None:
+                self._build_columns()
+
+    def related(self, transcription_id, k=10):
+        """返回 [(transcription_id, 余弦相似度)], 录音不在索引中时返回 None"""
+        self.refresh()
+        with self.lock:
+            row = self.row_of.get(transcription_id)
+            if row is None or self.columns is None:
+                return None
+            c = self.columns
+            start, end = c["indptr"][row], c["indptr"][row + 1]
+            terms, q_weights = c["indices"][start:end], c["weights"][start:end]
+            keep = self.df[terms] <= max(MAX_DOC_FREQ * self.size, MIN_SKIP_DOC_FREQ)
+            terms, q_weights = terms[keep], q_weights[keep]
+            if len(terms) == 0:
+                return []
+            # 拼接这些词的倒排列表, 按行累加 q·d
+            starts, ends = c["col_ptr"][terms], c["col_ptr"][terms + 1]
+            lengths = ends - starts
+            total = int(lengths.sum())
+            if total == 0:
+                return []
+            offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + np.arange(total)
+            scores = np.bincount(c["col_rows"][offsets], weights=c["col_weights"][offsets] * np.repeat(q_weights, lengths),
+                                 minlength=self.size)
+            scores[row] = 0
+            k = min(k, self.size - 1)
+            if k <= 0:
+                return []
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(scores[top])[::-1]]
+            return [(int(self.doc_ids[i]), round(float(scores[i]), 4)) for i in top if scores[i] > 0]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='相关录音索引')
+    parser.add_argument('--source-path', type=str, help='源音频文件路径')
+    parser.add_argument('--rebuild', action='store_true', help='重新生成所有录音的词频')
+    parser.add_argument('--missing', action='store_true', help='只为还没有词频的录音生成')
+    parser.add_argument('--query', type=int, help='查看某条录音的相关录音')
+    parser.add_argument('-k', type=int, default=10, help='返回条数')
+    return parser.parse_args()
+
+def main():
+    import transcribe
+    args = parse_args()
+    transcribe.update_config(args)
+    print(f"数据库: {transcribe.CONFIG['DB_PATH']}")
+    transcribe.init_db()
+    conn = sqlite3.connect(transcribe.CONFIG["DB_PATH"])
+    try:
+        if args.rebuild or args.missing:
+            rebuild_terms(conn, only_missing=args.missing)
+        if args.query is not None:
+            if np is None:
+                print("需要安装 numpy")
+                return 1
+            index = SimilarityIndex(lambda: transcribe.CONFIG["DB_PATH"])
+            started = time.time()
+            index.refresh(force=True)
+            print(f"索引 {index.size} 条录音，{index.nnz} 个非零项，构建耗时 {time.time() - started:.2f}s")
+            started = time.time()
+            related = index.related(args.query, args.k)
+            print(f"查询耗时 {(time.time() - started) * 1000:.1f}ms")
+            ids = [transcription_id for transcription_id, _ in related or []]
+            filenames = dict(partitions.query(
+                conn, partitions.partitions_for_ids(conn, ids),
+                f"SELECT id, filename FROM transcriptions WHERE id IN ({','.join('?' * len(ids))})", ids)) if ids else {}
+            for transcription_id, score in related or []:
+                print(f"  {score:.3f}  #{transcription_id}  {filenames.get(transcription_id, '?')}")
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1167 @@
+let lastDataFingerprint = "";
+const speakerColorMap = {};
+let nextColorIndex = 0;
+
+function switchTab(tabName) {
+    document.querySelectorAll('.view-container').forEach(el => el.classList.remove('active'));
+    document.querySelectorAll('.nav-btn').forEach(el => el.classList.remove('active'));
+    document.getElementById('view-' + tabName).classList.add('active');
+    
+    const btns = document.querySelectorAll('.nav-btn');
+    if(tabName === 'dashboard') btns[0].classList.add('active');
+    else if(tabName === 'chat') btns[1].classList.add('active');
+    else if(tabName === 'analysis') btns[2].classList.add('active');
+    else if(tabName === 'logs') btns[3].classList.add('active');
+    else if(tabName === 'config') btns[4].classList.add('active');
+    
+    // Load config when switching to config tab
+    if (tabName === 'config') {
+        loadConfig();
+    }
+    
+    // Initialize logs when switching to logs tab
+    if (tabName === 'logs') {
+        initLogsView();
+    }
+
+    // 对话视图隐藏时无法测量行高, 显示后再布局
+    if (tabName === 'chat') {
+        timed('时光对话', layoutChat);
+    }
+}
+
+// Load configuration from API
+function loadConfig() {
+    fetch('/api/config')
+        .then(response => response.json())
+        .then(config => {
+            const form = document.getElementById('config-form');
+            form.innerHTML = '';
+            
+            for (const key in config) {
+                const value = config[key];
+                const div = document.createElement('div');
+                div.style.marginBottom = '15px';
+                
+                const label = document.createElement('label');
+                label.textContent = key;
+                label.style.display = 'block';
+                label.style.marginBottom = '5px';
+                label.style.fontWeight = 'bold';
+                
+                // 列表/对象类型的配置 (如 ASR_ENDPOINTS) 用 JSON 编辑
+                const isJson = value !== null && typeof value === 'object';
+                const input = document.createElement(isJson ? 'textarea' : 'input');
+                if (isJson) {
+                    input.dataset.json = '1';
+                    input.rows = 4;
+                    input.style.fontFamily = 'monospace';
+                    input.value = JSON.stringify(value, null, 2);
+                } else {
+                    input.type = typeof value === 'number' ? 'number' : 'text';
+                    input.value = value;
+                }
+                input.id = 'config-' + key;
+                input.style.width = '100%';
+                input.style.padding = '8px';
+                input.style.border = '1px solid #ccc';
+                input.style.borderRadius = '4px';
+                input.style.fontSize = '14px';
+                
+                div.appendChild(label);
+                div.appendChild(input);
+                form.appendChild(div);
+            }
+        })
+        .catch(error => {
+            const form = document.getElementById('config-form');
+            form.innerHTML = `<div style="text-align: center; color: #dc3545;">加载配置失败: ${error.message}</div>`;
+        });
+}
+
+// 对话历史相关功能
+let currentChatData = [];
+let currentSessionId = null;
+
+// 加载聊天会话列表
+function loadChatSessions() {
+    fetch('/api/chat/sessions')
+        .then(response => response.json())
+        .then(sessions => {
+            const select = document.getElementById('chat-session-select');
+            select.innerHTML = '<option value="">选择历史会话...</option>';
+            
+            sessions.forEach(session => {
+                const option = document.createElement('option');
+                option.value = session.session_id;
+                // 格式化日期显示
+                const createdDate = new Date(session.created_at).toLocaleString();
+                option.textContent = `${session.session_id} (${createdDate})`;
+                select.appendChild(option);
+            });
+        })
+        .catch(error => {
+            console.error('加载聊天会话失败:', error);
+        });
+}
+
+// 保存当前对话
+async function saveChatSession() {
+    if (!currentChatData || currentChatData.length === 0) {
+        alert('没有可保存的对话内容');
+        return;
+    }
+
+    const sessionName = prompt('请输入会话名称:', `对话_${new Date().toLocaleDateString()}`);
+    if (!sessionName) return;
+
+    const sessionId = sessionName.replace(/\s+/g, '_').replace(/[^\w\u4e00-\u9fa5]/g, '');
+    
+    // 列表中只有摘要, 保存前读取每条录音的全部分段
+    let details;
+    try {
+        details = await Promise.all(currentChatData.map(item => item.message_text === undefined ? loadTranscript(item.id) : null));
+    } catch (error) {
+        alert('读取录音内容失败: ' + error.message);
+        return;
+    }
+
+    // 准备符合后端期望的数据结构
+    const chatData = [];
+    currentChatData.forEach((item, index) => {
+        if (details[index]) {
+            chatData.push({
+                segments: details[index].segments
+            });
+        } else if (item.message_text) {
+            // 如果是已加载的历史消息，转换为segments格式
+            chatData.push({
+                segments: [{
+                    text: item.message_text,
+                    spk_id: item.speaker_id,
+                    speaker_name: item.speaker_name,
+                    start: item.timestamp
+                }]
+            });
+        }
+    });
+    
+    fetch('/api/chat/session', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            session_id: sessionId,
+            chat_data: chatData
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            alert('对话保存成功!');
+            loadChatSessions(); // 重新加载会话列表
+        } else {
+            alert('保存失败: ' + data.message);
+        }
+    })
+    .catch(error => {
+        alert('保存失败: ' + error.message);
+    });
+}
+
+// 加载特定会话的对话
+function loadChatSession(sessionId) {
+    if (!sessionId) {
+        // 如果没有选择会话，则加载当前转录数据
+        lastDataFingerprint = "";
+        updateLoop();
+        return;
+    }
+
+    fetch(`/api/chat/session/${sessionId}`)
+        .then(response => response.json())
+        .then(messages => {
+            if (messages && messages.length > 0) {
+                currentSessionId = sessionId;
+                // 将消息转换为前端渲染需要的格式
+                currentChatData = messages.map(msg => ({
+                    message_text: msg.message_text,
+                    speaker_id: msg.speaker_id,
+                    speaker_name: msg.speaker_name,
+                    timestamp: msg.timestamp,
+                    start_fmt: msg.start_fmt
+                }));
+                renderChat(currentChatData);
+            } else {
+                alert('没有找到该会话的对话内容');
+            }
+        })
+        .catch(error => {
+            alert('加载对话失败: ' + error.message);
+        });
+}
+
+// 新建会话
+function newChatSession() {
+    currentSessionId = null;
+    document.getElementById('chat-session-select').value = '';
+    lastDataFingerprint = "";
+    updateLoop(); // 加载当前转录数据
+}
+
+// 添加事件监听器
+document.addEventListener('DOMContentLoaded', function() {
+    // 保存对话按钮
+    document.getElementById('save-chat-btn').addEventListener('click', saveChatSession);
+    
+    // 新建会话按钮
+    document.getElementById('new-chat-btn').addEventListener('click', newChatSession);
+    
+    // 会话选择下拉框
+    document.getElementById('chat-session-select').addEventListener('change', function() {
+        loadChatSession(this.value);
+    });
+    
+    // 初始加载会话列表
+    loadChatSessions();
+});
+
+// Save configuration to API
+document.getElementById('save-config-btn')?.addEventListener('click', () => {
+    const form = document.getElementById('config-form');
+    const inputs = form.querySelectorAll('input, textarea');
+    const newConfig = {};
+    let invalidKey = null;
+    
+    inputs.forEach(input => {
+        const key = input.id.replace('config-', '');
+        const value = input.value;
+        
+        if (input.dataset.json) {
+            try { newConfig[key] = JSON.parse(value); } catch (e) { invalidKey = key; }
+        } else if (input.type === 'number') {
+            newConfig[key] = parseInt(value) || parseFloat(value) || value;
+        } else {
+            newConfig[key] = value;
+        }
+    });
+    if (invalidKey) {
+        const status = document.getElementById('save-status');
+        status.textContent = `保存失败: ${invalidKey} 不是有效的 JSON`;
+        status.style.color = '#dc3545';
+        return;
+    }
+    
+    fetch('/api/config', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(newConfig)
+    })
+    .then(response => {
+        if (!response.ok) {
+            return response.text().then(text => {
+                throw new Error(`HTTP error! status: ${response.status}, message: ${text}`);
+            });
+        }
+        return response.json();
+    })
+    .then(data => {
+        const status = document.getElementById('save-status');
+        if (data.success) {
+            status.textContent = '配置保存成功!';
+            status.style.color = '#28a745';
+            setTimeout(() => status.textContent = '', 2000);
+        } else {
+            status.textContent = '保存失败: ' + data.message;
+            status.style.color = '#dc3545';
+            setTimeout(() => status.textContent = '', 2000);
+        }
+    })
+    .catch(err => {
+        const status = document.getElementById('save-status');
+        status.textContent = `保存失败: ${err.message}`;
+        status.style.color = '#dc3545';
+        setTimeout(() => status.textContent = '', 2000);
+    });
+});
+
+// --- 核心辅助函数 ---
+
+// 1. 深度文本清洗：去除标签、标点、空格
+function cleanText(text) {
+    if (!text) return "";
+    // 去除 SenseVoice 标签
+    let clean = text.replace(/<\|.*?\|>/g, "");
+    return clean;
+}
+
+// 2. 检查是否包含有效内容 (过滤掉只有标点符号的情况)
+function hasMeaningfulContent(text) {
+    if (!text) return false;
+    const clean = cleanText(text);
+    // 去除所有标点符号、空格、换行
+    // 匹配：英文标点, 中文标点, 空白符
+    const stripped = clean.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()。，、？！：；“”‘’\s]/g, "");
+    return stripped.length > 0;
+}
+
+// 3. 获取头像颜色索引 (使用映射表确保颜色稳定)
+function getAvatarIndex(spkId) {
+    if (spkId in speakerColorMap) {
+        return speakerColorMap[spkId];
+    }
+    const colorIndex = nextColorIndex % 5;
+    speakerColorMap[spkId] = colorIndex;
+    nextColorIndex++;
+    return colorIndex;
+}
+
+// 4. 预处理统计数据 (按 id 缓存, 每条录音只统计一次)
+// 列表中的说话人摘要由服务端入库时计算, 只包含有有效内容的片段
+const statsCache = new Map();
+function processStats(items) {
+    items.forEach(item => {
+        if (statsCache.has(item.id)) { item.speaker_stats = statsCache.get(item.id); return; }
+        const stats = {};
+        (item.speakers || []).forEach(speaker => {
+            const spkId = speaker.spk !== undefined && speaker.spk !== null ? speaker.spk : 'unknown';
+            const spkName = typeof spkId === 'number' ? `说话人 ${spkId}` : (spkId || "未知");
+            stats[String(spkId)] = {
+                original_id: spkId,
+                speaker_name: spkName,
+                count: speaker.segments,
+                total_duration: speaker.speech_ms
+            };
+        });
+        item.speaker_stats = stats;
+        statsCache.set(item.id, stats);
+    });
+    return items;
+}
+
+async function updateLoop() {
+    try {
+        const statusRes = await fetch('/api/status');
+        const statusData = await statusRes.json();
+        const asrBadge = document.getElementById('status-asr');
+        const breaker = (statusData.transcriber || {}).breaker;
+        if (breaker && breaker.state !== 'closed') {
+            // 转录进程的熔断器已断开, 暂停转换等待服务端恢复
+            asrBadge.innerText = `熔断中 (${Math.round(breaker.retry_in)}s)`; asrBadge.className = "badge bg-red";
+        } else if (statusData.asr_server === 'online') {
+            asrBadge.innerText = "在线"; asrBadge.className = "badge bg-green";
+        } else {
+            asrBadge.innerText = "离线"; asrBadge.className = "badge bg-red";
+        }
+        document.getElementById('status-files').innerText = statusData.pending_files;
+        renderEndpoints((statusData.transcriber || {}).endpoints || [], (statusData.transcriber || {}).concurrency);
+        renderGovernor((statusData.transcriber || {}).governor);
+        renderGivenUp((statusData.transcriber || {}).given_up);
+        document.getElementById('log-display').innerText = statusData.last_log;
+        const consoleWin = document.querySelector('.console-window');
+        consoleWin.scrollTop = consoleWin.scrollHeight;
+
+        const dataRes = await fetch('/api/list');
+        let items = await dataRes.json();
+        
+        // 更新当前对话数据
+        currentChatData = items;
+        
+        items = processStats(items);
+        
+        if (items.length === 0) return;
+        const currentFingerprint = items.length + "_" + items[0].id;
+        if (currentFingerprint === lastDataFingerprint) return;
+        lastDataFingerprint = currentFingerprint;
+
+        timed('仪表盘', () => renderDashboard(items));
+        timed('时光对话', () => renderChat(items));
+        timed('统计分析', () => renderAnalysis(items));
+        pruneItemCaches(items);
+
+    } catch (e) { console.error(e); }
+}
+
+// 从某个片段开始播放归档音频, 浏览器按 Range 只请求需要的部分
+function playSegment(id, startMs) {
+    const audio = document.getElementById('player-audio');
+    const src = `/api/audio/${id}`;
+    const seek = () => { audio.currentTime = (startMs || 0) / 1000; audio.play().catch(() => {}); };
+    document.getElementById('player-bar').classList.add('active');
+    const item = (currentChatData || []).find(it => it.id === id);
+    document.getElementById('player-title').innerText = item ? item.filename : '';
+    if (audio.getAttribute('src') !== src) {
+        audio.setAttribute('src', src);
+        loadWaveform(id);
+        audio.addEventListener('loadedmetadata', seek, { once: true });
+        audio.load();
+    } else {
+        seek();
+    }
+}
+
+// 波形: 峰值由转录进程预先计算, 不需要下载和解码整个音频
+const SPEAKER_COLORS = ['#1A53E0', '#28A745', '#FF7733', '#8E44AD', '#DC3545'];
+let waveform = null;
+
+function decodePeaks(level) {
+    const bytes = atob(level.data);
+    const values = new Int8Array(bytes.length);
+    for (let i = 0; i < bytes.length; i++) values[i] = bytes.charCodeAt(i) << 24 >> 24;
+    return values;
+}
+
+async function loadWaveform(id) {
+    waveform = null;
+    drawWaveform();
+    try {
+        // 说话人底色需要分段, 与峰值并行读取
+        const detail = loadTranscript(id).catch(() => null);
+        const res = await fetch(`/api/peaks/${id}`);
+        if (!res.ok) return;
+        const peaks = await res.json();
+        const width = document.getElementById('player-waveform').clientWidth || 800;
+        // 选峰值数量不少于画布宽度的最粗一级
+        const levels = peaks.levels.slice().sort((a, b) => b.samples_per_peak - a.samples_per_peak);
+        const level = levels.find(l => l.length >= width) || levels[levels.length - 1];
+        const transcript = await detail;
+        waveform = { id, duration: peaks.duration_ms, values: decodePeaks(level), length: level.length,
+                     segments: transcript ? transcript.segments : [] };
+        drawWaveform();
+    } catch (e) { console.error(e); }
+}
+
+function drawWaveform() {
+    const canvas = document.getElementById('player-waveform');
+    const width = canvas.clientWidth, height = canvas.clientHeight;
+    canvas.width = width * devicePixelRatio; canvas.height = height * devicePixelRatio;
+    const ctx = canvas.getContext('2d');
+    ctx.scale(devicePixelRatio, devicePixelRatio);
+    ctx.clearRect(0, 0, width, height);
+    if (!waveform) return;
+    const duration = waveform.duration || 1;
+    // 说话人片段底色
+    waveform.segments.forEach(seg => {
+        if (seg.start === undefined) return;
+        const end = seg.end && seg.end > seg.start ? seg.end : seg.start + 2000;
+        ctx.fillStyle = SPEAKER_COLORS[getAvatarIndex(seg.spk_id !== undefined ? seg.spk_id : 0) % 5] + '33';
+        ctx.fillRect(seg.start / duration * width, 0, Math.max((end - seg.start) / duration * width, 1), height);
+    });
+    ctx.fillStyle = '#555';
+    const mid = height / 2;
+    for (let x = 0; x < width; x++) {
+        const from = Math.floor(x / width * waveform.length), to = Math.max(Math.floor((x + 1) / width * waveform.length), from + 1);
+        let lo = 0, hi = 0;
+        for (let i = from; i < to && i < waveform.length; i++) {
+            lo = Math.min(lo, waveform.values[2 * i]); hi = Math.max(hi, waveform.values[2 * i + 1]);
+        }
+        ctx.fillRect(x, mid - hi / 128 * mid, 1, Math.max((hi - lo) / 128 * mid, 1));
+    }
+    const audio = document.getElementById('player-audio');
+    if (audio.currentTime) {
+        ctx.fillStyle = '#dc3545';
+        ctx.fillRect(audio.currentTime * 1000 / duration * width, 0, 2, height);
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const canvas = document.getElementById('player-waveform');
+    canvas.addEventListener('click', e => {
+        if (!waveform) return;
+        const ratio = e.offsetX / canvas.clientWidth;
+        playSegment(waveform.id, ratio * waveform.duration);
+    });
+    document.getElementById('player-audio').addEventListener('timeupdate', drawWaveform);
+});
+
+function closePlayer() {
+    const audio = document.getElementById('player-audio');
+    audio.pause();
+    audio.removeAttribute('src');
+    audio.load();
+    waveform = null;
+    document.getElementById('player-bar').classList.remove('active');
+}
+
+function renderEndpoints(endpoints, concurrency) {
+    const container = document.getElementById('status-endpoints');
+    // 只有一个服务端且并发固定时, 上面的 PC 服务状态已经足够
+    const adaptive = concurrency && concurrency.adaptive;
+    if (endpoints.length < 2 && !adaptive) { container.innerHTML = ''; return; }
+    container.innerHTML = endpoints.map(ep => {
+        const host = ep.url.replace(/^https?:\/\//, '').split('/')[0];
+        const rtf = ep.realtime_factor ? `${ep.realtime_factor}x` : '-';
+        const limit = ep.limit !== undefined ? ep.limit : ep.max_inflight;
+        // 悬停显示并发范围和最近几次调整
+        const changes = (ep.limit_history || []).slice(-5).map(h => `${h.time.slice(11)} → ${h.limit} (${h.reason})`);
+        const title = [`${ep.url}`, `并发上限 ${limit} (范围 ${ep.min_inflight || 1}-${ep.max_inflight})`, ...changes].join('\n');
+        return `<div class="status-item"><span class="status-label" title="${title.replace(/"/g, '&quot;')}">${host}<br><small style="color:#888;">${ep.completed} 个 · ${ep.files_per_hour}/小时 · ${rtf}</small></span>` +
+               `<span class="badge ${ep.healthy ? 'bg-green' : 'bg-red'}">${ep.healthy ? `在线 ${ep.inflight}/${limit}` : '离线'}</span></div>`;
+    }).join('');
+}
+
+function renderGovernor(governor) {
+    const container = document.getElementById('status-governor');
+    if (!governor || !governor.enabled) { container.innerHTML = ''; return; }
+    const throttled = governor.state === 'throttled';
+    const disks = Object.entries(governor.disk_busy || {}).map(([name, busy]) => `${name} ${Math.round(busy * 100)}%`).join(' · ');
+    const upload = governor.upload_limit_kbps ? `上传 ${governor.upload_kbps}/${governor.upload_limit_kbps} KB/s` : `上传 ${governor.upload_kbps} KB/s`;
+    const detail = `负载 ${governor.load ?? '-'}${disks ? ' · ' + disks : ''}`;
+    const title = `${throttled ? governor.reason + '\n' : ''}转换 ${governor.conversions}/${governor.conversion_slots}，排队 ${governor.conversions_waiting}\n${upload}`;
+    container.innerHTML = `<div class="status-item"><span class="status-label" title="${title.replace(/"/g, '&quot;')}">系统资源<br><small style="color:#888;">${detail}</small></span>` +
+        `<span class="badge ${throttled ? 'bg-orange' : 'bg-green'}">${throttled ? '限流中' : '正常'}</span></div>`;
+}
+
+// 连续失败达到 JOB_MAX_FAILURES、不再重试的文件, 悬停查看文件名和原因
+function renderGivenUp(files) {
+    const container = document.getElementById('status-given-up');
+    if (!files || !files.length) { container.innerHTML = ''; return; }
+    const title = files.map(f => `${f.filename}: ${f.error} (${f.failures} 次)`).join('\n');
+    container.innerHTML = `<div class="status-item"><span class="status-label" title="${title.replace(/&/g, '&amp;').replace(/"/g, '&quot;')}">放弃重试的文件</span>` +
+        `<span class="badge bg-red">${files.length}</span></div>`;
+}
+
+// === 增量渲染 ===
+// 每条录音的渲染数据只计算一次 (按 id 缓存), DOM 也按 id 复用, 刷新时只处理新增和移除的录音
+const DEBUG_RENDER = new URLSearchParams(location.search).get('debug') === '1';
+const renderTimings = {};
+const itemModels = new Map();
+
+function timed(name, fn) {
+    const started = performance.now();
+    fn();
+    renderTimings[name] = performance.now() - started;
+    updateDebugOverlay();
+}
+
+// ?debug=1 时在左下角显示各视图的渲染耗时和 DOM 规模
+function updateDebugOverlay() {
+    if (!DEBUG_RENDER) return;
+    let overlay = document.getElementById('debug-overlay');
+    if (!overlay) {
+        overlay = document.createElement('div');
+        overlay.id = 'debug-overlay';
+        overlay.className = 'debug-overlay';
+        document.body.appendChild(overlay);
+    }
+    const lines = Object.entries(renderTimings).map(([name, ms]) => `${name}: ${ms.toFixed(1)} ms`);
+    lines.push(`DOM 节点: ${document.getElementsByTagName('*').length}`);
+    lines.push(`对话行: ${chatView.rendered.size} / ${chatView.rows.length}`);
+    overlay.innerText = lines.join('\n');
+}
+
+// 全文和分段按需从 /api/transcript/<id> 读取, 每条录音只请求一次
+const transcriptDetails = new Map();
+const transcriptRequests = new Map();
+
+function loadTranscript(id) {
+    if (transcriptDetails.has(id)) return Promise.resolve(transcriptDetails.get(id));
+    if (!transcriptRequests.has(id)) {
+        transcriptRequests.set(id, fetch(`/api/transcript/${id}`)
+            .then(res => res.ok ? res.json() : Promise.reject(new Error(`HTTP ${res.status}`)))
+            .then(detail => {
+                transcriptDetails.set(id, detail);
+                itemModels.delete(id);
+                return detail;
+            })
+            .finally(() => transcriptRequests.delete(id)));
+    }
+    return transcriptRequests.get(id);
+}
+
+// 一条录音过滤掉无效片段、清洗文本后的渲染数据; 全文未读取时只有列表中的预览
+function getItemModel(item) {
+    let model = itemModels.get(item.id);
+    if (model) return model;
+    const detail = transcriptDetails.get(item.id);
+    if (!detail) {
+        model = {
+            loaded: false,
+            valid: (item.speakers || []).length > 0 || hasMeaningfulContent(item.preview),
+            segments: [],
+            fullText: cleanText(item.preview)
+        };
+        itemModels.set(item.id, model);
+        return model;
+    }
+    const hasSegments = detail.segments && detail.segments.length > 0;
+    const segments = hasSegments ? detail.segments
+        .filter(seg => hasMeaningfulContent(seg.text))
+        .map(seg => ({ seg, txt: cleanText(seg.text) })) : [];
+    model = {
+        loaded: true,
+        // 全文都没有有效内容(去标点后为空)的录音不显示
+        valid: hasSegments ? segments.length > 0 : hasMeaningfulContent(detail.full_text),
+        segments,
+        fullText: hasSegments ? '' : cleanText(detail.full_text)
+    };
+    itemModels.set(item.id, model);
+    return model;
+}
+
+// 丢弃已经不在列表中的录音的缓存
+function pruneItemCaches(items) {
+    const current = new Set(items.map(item => item.id));
+    for (const id of itemModels.keys()) if (!current.has(id)) itemModels.delete(id);
+    for (const id of statsCache.keys()) if (!current.has(id)) statsCache.delete(id);
+    for (const id of transcriptDetails.keys()) if (!current.has(id)) transcriptDetails.delete(id);
+    for (const id of expandedCards) if (!current.has(id)) expandedCards.delete(id);
+}
+
+function formatDuration(ms) {
+    const seconds = Math.round((ms || 0) / 1000);
+    const h = Math.floor(seconds / 3600), m = Math.floor(seconds / 60) % 60, s = seconds % 60;
+    return h > 0 ? `${h}:${String(m).padStart(2, '0')}:${String(s).padStart(2, '0')}` : `${m}:${String(s).padStart(2, '0')}`;
+}
+
+// 按 key 调整容器中的节点顺序, 已在正确位置的节点不动
+function placeInOrder(container, elements, cursor) {
+    elements.forEach(el => {
+        if (el !== cursor) container.insertBefore(el, cursor);
+        else cursor = cursor.nextElementSibling;
+    });
+}
+
+const dashboardCards = new Map();
+const dashboardItems = new Map();
+// 已展开全文的卡片; 其余卡片只显示列表中的预览
+const expandedCards = new Set();
+
+function buildDashboardCard(item, model) {
+    const expanded = expandedCards.has(item.id) && model.loaded;
+    let segHtml = "";
+    if (!expanded) {
+        const more = expandedCards.has(item.id) ? '加载中...' : '展开全文';
+        segHtml = `<div class="segment card-preview" title="展开全文" onclick="toggleTranscript(${item.id})"><span>${cleanText(item.preview)}<span class="card-more">${more}</span></span></div>`;
+    } else if (model.segments.length > 0) {
+        model.segments.forEach(({ seg, txt }) => {
+            segHtml += `<div class="segment"><span class="timestamp playable" title="从这里播放" onclick="playSegment(${item.id}, ${seg.start || 0})">[${seg.start_fmt}]</span><span>${txt}</span></div>`;
+        });
+    } else {
+        segHtml = `<div class="segment"><span>${model.fullText}</span></div>`;
+    }
+    const card = document.createElement('div');
+    card.dataset.id = item.id;
+    const speakers = (item.speakers || []).length;
+    const summary = `${formatDuration(item.duration_ms)}${speakers ? ` · ${speakers} 位说话人` : ''}`;
+    const toggle = expanded ? `<a href="#" class="related-link" onclick="toggleTranscript(${item.id}); return false;">收起</a>` : '';
+    card.innerHTML = `
+        <div class="card-meta"><span class="filename">${item.filename} <span class="card-summary">${summary}</span></span><span>${item.time_full} ${toggle}<a href="#" class="related-link" onclick="toggleRelated(${item.id}, this); return false;">相关录音</a></span></div>
+        <div>${segHtml}</div>
+        <div class="related-list"></div>`;
+    return card;
+}
+
+// 重建单张卡片 (展开 / 收起), 保留其在列表中的位置
+function refreshDashboardCard(id) {
+    const old = dashboardCards.get(id), item = dashboardItems.get(id);
+    if (!old || !item) return;
+    const card = buildDashboardCard(item, getItemModel(item));
+    card.className = old.className;
+    old.replaceWith(card);
+    dashboardCards.set(id, card);
+}
+
+async function toggleTranscript(id) {
+    if (expandedCards.has(id)) {
+        expandedCards.delete(id);
+        refreshDashboardCard(id);
+        return;
+    }
+    expandedCards.add(id);
+    refreshDashboardCard(id);
+    try {
+        await loadTranscript(id);
+    } catch (e) {
+        console.error(e);
+        expandedCards.delete(id);
+    }
+    refreshDashboardCard(id);
+}
+
+// 相关录音: 按内容相似度列出其他录音, 点击从头播放
+async function toggleRelated(id, link) {
+    const list = link.closest('.transcript-card').querySelector('.related-list');
+    if (list.innerHTML) { list.innerHTML = ''; return; }
+    list.innerHTML = '<div class="related-item">查找中...</div>';
+    try {
+        const res = await fetch(`/api/related/${id}?k=5`);
+        const data = await res.json();
+        if (!res.ok) { list.innerHTML = `<div class="related-item">${data.error}</div>`; return; }
+        if (data.related.length === 0) { list.innerHTML = '<div class="related-item">没有找到相关录音</div>'; return; }
+        list.innerHTML = data.related.map(r =>
+            `<div class="related-item playable" title="播放" onclick="playSegment(${r.id}, 0)">` +
+            `<span class="related-score">${Math.round(r.score * 100)}%</span> ${r.time_full} · ${r.filename}<br><small>${r.preview}</small></div>`
+        ).join('');
+    } catch (e) {
+        list.innerHTML = `<div class="related-item">加载失败: ${e.message}</div>`;
+    }
+}
+
+function renderDashboard(items) {
+    const container = document.getElementById('dashboard-content');
+    const visible = items.filter(item => getItemModel(item).valid);
+    const keep = new Set(visible.map(item => item.id));
+    // 移除已不在列表中的卡片 (以及加载提示)
+    Array.from(container.children).forEach(el => {
+        if (!keep.has(Number(el.dataset.id))) el.remove();
+    });
+    for (const id of dashboardCards.keys()) if (!keep.has(id)) dashboardCards.delete(id);
+    dashboardItems.clear();
+    visible.forEach(item => dashboardItems.set(item.id, item));
+
+    const cards = visible.map(item => {
+        let card = dashboardCards.get(item.id);
+        if (!card) {
+            card = buildDashboardCard(item, getItemModel(item));
+            dashboardCards.set(item.id, card);
+        }
+        card.className = `transcript-card ${item.is_new ? 'new-item' : ''}`;
+        return card;
+    });
+    placeInOrder(container, cards, container.firstElementChild);
+}
+
+// === 对话视图虚拟滚动 ===
+// 只有可见区域 (上下各多留一屏) 的消息在 DOM 中; 行高测量后按 key 缓存, 未测量的行用估计值
+const chatView = { rows: [], offsets: [0], offsetRows: [], heights: new Map(), rendered: new Map(), frame: 0, items: [], refresh: 0 };
+const CHAT_ROW_ESTIMATE = { date: 60, file: 45, bubble: 90, text: 90 };
+
+function buildChatRows(items) {
+    const rows = [];
+    let currentDay = "";
+    items.forEach((item, index) => {
+        if (item.message_text !== undefined) {
+            // 已保存的历史会话: 每条消息一行
+            rows.push({ key: `m:${currentSessionId}:${index}`, type: 'bubble', spkId: item.speaker_id, spkName: item.speaker_name,
+                        txt: cleanText(item.message_text), time: item.start_fmt });
+            return;
+        }
+        const model = getItemModel(item);
+        if (!model.valid) return;
+        if (item.date_group !== currentDay) {
+            rows.push({ key: `d:${item.date_group}:${item.id}`, type: 'date', item });
+            currentDay = item.date_group;
+        }
+        rows.push({ key: `f:${item.id}`, type: 'file', item });
+        if (!model.loaded) {
+            // 全文还没有读取: 先显示预览, 滚动到可见区域时再请求
+            rows.push({ key: `p:${item.id}`, type: 'text', item, txt: model.fullText, pending: item.id });
+        } else if (model.segments.length > 0) {
+            model.segments.forEach(({ seg, txt }, i) => {
+                const spkId = seg.spk_id !== undefined ? seg.spk_id : 0;
+                rows.push({ key: `b:${item.id}:${i}`, type: 'bubble', spkId,
+                            spkName: typeof spkId === 'number' ? `说话人 ${spkId}` : spkId,
+                            txt, time: seg.start_fmt, play: [item.id, seg.start || 0] });
+            });
+        } else {
+            rows.push({ key: `t:${item.id}`, type: 'text', item, txt: model.fullText });
+        }
+    });
+    return rows;
+}
+
+function chatRowHtml(row) {
+    if (row.type === 'date') {
+        return `<div class="chat-date-separator"><span class="chat-date-label">${row.item.date_group}</span></div>`;
+    }
+    if (row.type === 'file') {
+        return `<div class="file-separator">来源: ${row.item.filename} (${row.item.time_simple})</div>`;
+    }
+    if (row.type === 'bubble') {
+        const avatarIdx = getAvatarIndex(row.spkId);
+        // 截取名字的第一个字作为头像文字
+        const iconText = String(row.spkName).slice(0, 1);
+        const time = row.play
+            ? `<div class="chat-time playable" title="从这里播放" onclick="playSegment(${row.play[0]}, ${row.play[1]})">${row.time}</div>`
+            : `<div class="chat-time">${row.time}</div>`;
+        return `
+            <div class="chat-bubble-row">
+                <div class="avatar avatar-${avatarIdx % 5}">${iconText}</div>
+                <div class="bubble-content">
+                    <div class="speaker-name">${row.spkName}</div>
+                    <div class="bubble">${row.txt}</div>
+                    ${time}
+                </div>
+            </div>`;
+    }
+    // 没有分段的录音: 整段全文一个气泡
+    const item = row.item;
+    let iconText = "未知";
+    if (item.speaker_stats && Object.keys(item.speaker_stats).length > 0) {
+        const firstSpkName = Object.values(item.speaker_stats)[0].speaker_name;
+        if (firstSpkName.length > 0) iconText = firstSpkName.slice(0, 1);
+    }
+    return `
+        <div class="chat-bubble-row">
+             <div class="avatar avatar-${getAvatarIndex(0) % 5}">${iconText}</div>
+             <div class="bubble-content">
+                <div class="bubble">${row.txt}</div>
+                <div class="chat-time">${row.pending ? '加载中...' : `来源时间: ${item.time_simple}`}</div>
+             </div>
+        </div>`;
+}
+
+function rowHeight(row) {
+    return chatView.heights.get(row.key) || CHAT_ROW_ESTIMATE[row.type];
+}
+
+function computeChatOffsets() {
+    const offsets = new Array(chatView.rows.length + 1);
+    offsets[0] = 0;
+    chatView.rows.forEach((row, i) => { offsets[i + 1] = offsets[i] + rowHeight(row); });
+    chatView.offsets = offsets;
+    chatView.offsetRows = chatView.rows;
+}
+
+// 二分查找 y 所在的行
+function findChatRow(y) {
+    const offsets = chatView.offsets;
+    let lo = 0, hi = Math.max(offsets.length - 2, 0);
+    while (lo < hi) {
+        const mid = (lo + hi + 1) >> 1;
+        if (offsets[mid] <= y) lo = mid; else hi = mid - 1;
+    }
+    return lo;
+}
+
+function renderChat(items) {
+    chatView.items = items;
+    chatView.rows = buildChatRows(items);
+    const keys = new Set(chatView.rows.map(row => row.key));
+    for (const key of chatView.heights.keys()) if (!keys.has(key)) chatView.heights.delete(key);
+    // 隐藏的视图无法测量行高, 切换到对话视图时再布局
+    if (document.getElementById('view-chat').classList.contains('active')) layoutChat();
+}
+
+function layoutChat() {
+    const scroller = document.getElementById('view-chat');
+    const container = document.getElementById('chat-content');
+    // 记住顶部可见的行, 新录音插入到上方后视线保持不动
+    let anchorKey = null, anchorDelta = 0;
+    const scrolled = scroller.scrollTop - container.offsetTop;
+    if (scrolled > 0 && chatView.offsetRows.length > 0) {
+        const i = findChatRow(scrolled);
+        anchorKey = chatView.offsetRows[i].key;
+        anchorDelta = scrolled - chatView.offsets[i];
+    }
+    computeChatOffsets();
+    if (anchorKey) {
+        const index = chatView.rows.findIndex(row => row.key === anchorKey);
+        if (index >= 0) scroller.scrollTop = container.offsetTop + chatView.offsets[index] + anchorDelta;
+    }
+    renderChatWindow();
+}
+
+function renderChatWindow() {
+    const scroller = document.getElementById('view-chat');
+    const container = document.getElementById('chat-content');
+    const rows = chatView.rows;
+    if (!container.dataset.virtual) {
+        container.innerHTML = '<div class="chat-spacer"></div><div class="chat-spacer"></div>';
+        container.dataset.virtual = '1';
+    }
+    const topSpacer = container.firstElementChild, bottomSpacer = container.lastElementChild;
+    const top = scroller.scrollTop - container.offsetTop;
+    const viewport = scroller.clientHeight;
+    const first = rows.length ? findChatRow(Math.max(top - viewport, 0)) : 0;
+    const last = rows.length ? findChatRow(top + 2 * viewport) : -1;
+
+    const wanted = new Set();
+    for (let i = first; i <= last; i++) wanted.add(rows[i].key);
+    for (const [key, el] of chatView.rendered) {
+        if (!wanted.has(key)) { el.remove(); chatView.rendered.delete(key); }
+    }
+    const elements = [], added = [];
+    for (let i = first; i <= last; i++) {
+        let el = chatView.rendered.get(rows[i].key);
+        if (!el) {
+            el = document.createElement('div');
+            el.className = 'chat-row';
+            el.innerHTML = chatRowHtml(rows[i]);
+            chatView.rendered.set(rows[i].key, el);
+            added.push([i, el]);
+        }
+        elements.push(el);
+    }
+    placeInOrder(container, elements, topSpacer.nextElementSibling);
+    container.appendChild(bottomSpacer);
+
+    // 用真实高度替换估计值; 视口上方的行高变化时补偿滚动位置
+    let changed = false, shiftAbove = 0;
+    added.forEach(([i, el]) => {
+        const height = el.offsetHeight;
+        const previous = rowHeight(rows[i]);
+        if (height && height !== previous) {
+            chatView.heights.set(rows[i].key, height);
+            if (chatView.offsets[i] < top) shiftAbove += height - previous;
+            changed = true;
+        }
+    });
+    if (changed) computeChatOffsets();
+    topSpacer.style.height = `${chatView.offsets[first] || 0}px`;
+    bottomSpacer.style.height = `${chatView.offsets[rows.length] - chatView.offsets[last + 1]}px`;
+    if (shiftAbove) scroller.scrollTop += shiftAbove;
+
+    const pending = [];
+    for (let i = first; i <= last; i++) if (rows[i].pending) pending.push(rows[i].pending);
+    if (pending.length) requestChatDetails(pending);
+}
+
+// 可见区域内还没有读取全文的录音: 并行请求, 全部返回后合并为一次重建
+function requestChatDetails(ids) {
+    const requests = ids.filter(id => !transcriptRequests.has(id)).map(id => loadTranscript(id).catch(e => console.error(e)));
+    if (requests.length === 0) return;
+    Promise.all(requests).then(details => {
+        // 全部失败时不重建, 避免可见区域内反复请求
+        if (!details.some(Boolean) || chatView.refresh) return;
+        chatView.refresh = requestAnimationFrame(() => {
+            chatView.refresh = 0;
+            timed('时光对话', () => renderChat(chatView.items));
+        });
+    });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    document.getElementById('view-chat').addEventListener('scroll', () => {
+        if (chatView.frame) return;
+        chatView.frame = requestAnimationFrame(() => {
+            chatView.frame = 0;
+            timed('对话滚动', renderChatWindow);
+        });
+    });
+    window.addEventListener('resize', () => {
+        // 宽度变化后行高全部失效
+        chatView.heights.clear();
+        chatView.rendered.forEach(el => el.remove());
+        chatView.rendered.clear();
+        if (document.getElementById('view-chat').classList.contains('active')) layoutChat();
+    });
+});
+
+// === 统计分析: 只累加新增录音, 减去移出列表的录音 ===
+const analysisState = { items: new Map(), speakers: {} };
+
+function applySpeakerStats(id, itemStats, sign) {
+    for (const [key, stats] of Object.entries(itemStats)) {
+        let speaker = analysisState.speakers[key];
+        if (!speaker) {
+            speaker = analysisState.speakers[key] = {
+                original_id: stats.original_id,
+                name: stats.speaker_name,
+                totalCount: 0,
+                totalDuration: 0,
+                filesParticipated: new Set()
+            };
+        }
+        speaker.totalCount += sign * stats.count;
+        speaker.totalDuration += sign * stats.total_duration;
+        if (sign > 0) speaker.filesParticipated.add(id);
+        else speaker.filesParticipated.delete(id);
+        if (speaker.filesParticipated.size === 0) delete analysisState.speakers[key];
+    }
+}
+
+function renderAnalysis(items) {
+    const container = document.getElementById('analysis-content');
+    const current = new Set(items.map(item => item.id));
+    for (const [id, itemStats] of analysisState.items) {
+        if (!current.has(id)) { applySpeakerStats(id, itemStats, -1); analysisState.items.delete(id); }
+    }
+    items.forEach(item => {
+        if (analysisState.items.has(item.id)) return;
+        const itemStats = item.speaker_stats || {};
+        applySpeakerStats(item.id, itemStats, 1);
+        analysisState.items.set(item.id, itemStats);
+    });
+    const globalSpeakerStats = analysisState.speakers;
+
+    let html = `
+        <div class="analysis-card">
+            <h3>📊 声纹识别统计分析</h3>
+            <p>共分析 ${items.length} 个录音文件，识别出 ${Object.keys(globalSpeakerStats).length} 位不同的说话人</p>
+        </div>
+        <div class="speaker-grid">`;
+    
+    const sortedStats = Object.values(globalSpeakerStats).sort((a, b) => b.totalCount - a.totalCount);
+
+    for (const stats of sortedStats) {
+        const avgDuration = stats.totalCount > 0 ? (stats.totalDuration / stats.totalCount / 1000).toFixed(1) : 0;
+        const filesCount = stats.filesParticipated.size;
+        const avatarIdx = getAvatarIndex(stats.original_id);
+        
+        // 截取名字的第一个字作为头像文字
+        let iconText = stats.name;
+        if(iconText.length > 0) iconText = iconText.slice(0, 1);
+        
+        html += `
+            <div class="speaker-card">
+                <div class="speaker-icon avatar-${avatarIdx % 5}">
+                    ${iconText}
+                </div>
+                <div class="speaker-info">
+                    <h4>${stats.name}</h4>
+                    <div class="speaker-stats-detail">
+                        <div><div style="font-weight: bold;">${stats.totalCount}</div><div style="font-size: 0.8em;">发言次数</div></div>
+                        <div><div style="font-weight: bold;">${avgDuration}s</div><div style="font-size: 0.8em;">平均时长</div></div>
+                        <div><div style="font-weight: bold;">${filesCount}</div><div style="font-size: 0.8em;">参与文件</div></div>
+                    </div>
+                </div>
+            </div>`;
+    }
+    
+    html += '</div>';
+    container.innerHTML = html;
+}
+
+// === 实时日志功能 ===
+let logsEventSource = null;
+let logsLineCount = 0;
+let isLogsConnected = false;
+
+// 初始化日志视图
+function initLogsView() {
+    // 如果已经连接，不需要重新初始化
+    if (logsEventSource && isLogsConnected) {
+        return;
+    }
+    
+    // 设置按钮事件
+    const toggleBtn = document.getElementById('toggle-logs-btn');
+    const clearBtn = document.getElementById('clear-logs-btn');
+    
+    toggleBtn.onclick = toggleLogsConnection;
+    clearBtn.onclick = clearLogsDisplay;
+    
+    // 更新状态显示
+    updateLogsStatus();
+}
+
+// 切换日志连接状态
+function toggleLogsConnection() {
+    const toggleBtn = document.getElementById('toggle-logs-btn');
+    
+    if (logsEventSource && isLogsConnected) {
+        // 断开连接
+        logsEventSource.close();
+        logsEventSource = null;
+        isLogsConnected = false;
+        toggleBtn.textContent = '开始接收日志';
+        updateLogsStatus();
+    } else {
+        // 建立连接
+        connectToLogsStream();
+        toggleBtn.textContent = '停止接收日志';
+    }
+}
+
+// 连接到SSE日志流
+function connectToLogsStream() {
+    try {
+        logsEventSource = new EventSource('/logs/stream');
+        
+        logsEventSource.onopen = function() {
+            isLogsConnected = true;
+            updateLogsStatus();
+            addLogMessage('系统', '已连接到日志流', 'info');
+        };
+        
+        logsEventSource.onmessage = function(event) {
+            try {
+                const data = JSON.parse(event.data);
+                
+                if (data.type === 'log') {
+                    addLogMessage('日志', data.message, 'log');
+                } else if (data.type === 'connected') {
+                    addLogMessage('系统', data.message, 'success');
+                } else if (data.type === 'heartbeat') {
+                    // 心跳消息，不显示
+                } else if (data.type === 'error') {
+                    addLogMessage('错误', data.message, 'error');
+                }
+            } catch (e) {
+                addLogMessage('解析错误', event.data, 'error');
+            }
+        };
+        
+        logsEventSource.onerror = function() {
+            isLogsConnected = false;
+            updateLogsStatus();
+            addLogMessage('系统', '日志流连接错误', 'error');
+            
+            // 5秒后尝试重连
+            setTimeout(function() {
+                if (document.getElementById('view-logs').classList.contains('active')) {
+                    connectToLogsStream();
+                }
+            }, 5000);
+        };
+        
+    } catch (e) {
+        addLogMessage('错误', '无法创建日志流连接: ' + e.message, 'error');
+    }
+}
+
+// 添加日志消息到显示区域
+function addLogMessage(source, message, type) {
+    const logsDisplay = document.getElementById('logs-display');
+    const timestamp = new Date().toLocaleTimeString();
+    
+    // 根据类型设置不同的颜色
+    let colorClass = '';
+    if (type === 'error') {
+        colorClass = 'color: #ff6b6b;';
+    } else if (type === 'success') {
+        colorClass = 'color: #51cf66;';
+    } else if (type === 'info') {
+        colorClass = 'color: #74c0fc;';
+    } else {
+        colorClass = 'color: var(--console-text);';
+    }
+    
+    const logEntry = document.createElement('div');
+    logEntry.style.marginBottom = '2px';
+    logEntry.innerHTML = `<span style="color: #888;">[${timestamp}]</span> <span style="color: #aaa;">[${source}]</span> <span style="${colorClass}">${message}</span>`;
+    
+    logsDisplay.appendChild(logEntry);
+    logsLineCount++;
+    
+    // 自动滚动到底部
+    logsDisplay.scrollTop = logsDisplay.scrollHeight;
+    
+    // 限制显示的行数，防止内存占用过多
+    const maxLines = 1000;
+    if (logsDisplay.children.length > maxLines) {
+        logsDisplay.removeChild(logsDisplay.firstChild);
+    }
+    
+    updateLogsStatus();
+}
+
+// 清空日志显示
+function clearLogsDisplay() {
+    const logsDisplay = document.getElementById('logs-display');
+    logsDisplay.innerHTML = '';
+    logsLineCount = 0;
+    updateLogsStatus();
+}
+
+// 更新日志状态显示
+function updateLogsStatus() {
+    const statusBadge = document.getElementById('logs-connection-status');
+    const linesCount = document.getElementById('logs-lines-count');
+    
+    if (isLogsConnected) {
+        statusBadge.textContent = '已连接';
+        statusBadge.className = 'badge bg-green';
+    } else {
+        statusBadge.textContent = '未连接';
+        statusBadge.className = 'badge bg-red';
+    }
+    
+    linesCount.textContent = `${logsLineCount} 行`;
+}
+
+setInterval(updateLoop, 3000);
+updateLoop();
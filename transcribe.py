@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
+import signal
 import subprocess
 import requests
 import json
@@ -10,6 +12,27 @@ import sqlite3
 import time
 import argparse
 import re
+import shutil
+import wave
+import hashlib
+import bisect
+import base64
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
+import alerts
+import analytics
+import similarity
+import partitions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # ---------------- 配置 ----------------
 CONFIG_FILE = "config.json"
@@ -22,9 +45,113 @@ DEFAULT_CONFIG = {
     "N8N_WEBHOOK_URL": "https://n8n.moco.fun/webhook/bea45d47-d1fc-498e-bf69-d48dc079f04a",
     "DB_PATH": "/volume2/download/records/Sony-2/transcripts.db",
     "LOG_FILE_PATH": "transcribe.log",
-    "WEB_PORT": 5010
+    "WEB_PORT": 5010,
+    # 队列排序策略: shortest (最短优先) / newest (最新录音优先) / fifo (先到先处理)
+    "QUEUE_POLICY": "shortest",
+    # shortest 策略的老化速率: 每等待 1 秒, 相当于时长减少多少秒
+    "QUEUE_AGING_RATE": 1.0,
+    # 任意策略下, 等待超过该秒数的文件直接插队到最前 (防止饿死)
+    "QUEUE_MAX_WAIT_SECONDS": 3600,
+    # 多个 ASR 服务端: ["http://a:5008/transcribe", {"url": "...", "weight": 2, "max_inflight": 2}]
+    # 为空时只使用 ASR_API_URL
+    "ASR_ENDPOINTS": [],
+    # 已下线服务端的重新探测间隔 (秒)
+    "ASR_PROBE_INTERVAL": 15,
+    # 转录进程状态文件 (服务端吞吐等), 供 web_viewer 读取
+    "STATUS_FILE_PATH": "transcriber_status.json",
+    # 熔断器: 连续失败多少个文件后暂停, 以及暂停时长的指数退避范围 (秒)
+    "ASR_BREAKER_THRESHOLD": 3,
+    "ASR_BREAKER_BASE_BACKOFF": 10,
+    "ASR_BREAKER_MAX_BACKOFF": 600,
+    # 已转换音频的缓存目录 (按文件身份命名), 上传失败后重试时直接复用; 为空时使用 SOURCE_DIR/.converted
+    "CONVERT_CACHE_DIR": "",
+    # 转换缓存的容量上限 (MB) 和最长保留天数, 超出时先删除最旧的
+    "CONVERT_CACHE_MAX_MB": 2048,
+    "CONVERT_CACHE_MAX_DAYS": 7,
+    # 上传格式: wav (16kHz PCM, 默认) / flac (无损压缩) / opus (有损, 码率见 ASR_UPLOAD_BITRATE)
+    # 也可以在 ASR_ENDPOINTS 中为单个服务端指定 "codec"
+    "ASR_UPLOAD_CODEC": "wav",
+    "ASR_UPLOAD_BITRATE": "32k",
+    # 上传前裁掉长时间静音 (需要 numpy), 返回的时间戳会映射回原始时间轴
+    # 默认关闭: 检测阈值还需要在实际录音上验证, 音量很低的录音可能被误判为静音
+    "VAD_ENABLED": False,
+    # 只裁掉长于该值的静音, 语音前后各保留 VAD_PAD_MS
+    "VAD_MIN_SILENCE_MS": 2000,
+    "VAD_PAD_MS": 300,
+    # 语音判定阈值 = 噪声底 + VAD_MARGIN_DB, 且不低于 VAD_FLOOR_DB (dBFS)
+    "VAD_MARGIN_DB": 12,
+    "VAD_FLOOR_DB": -55,
+    # 能裁掉的比例低于该值时不裁剪, 直接上传原音频
+    "VAD_MIN_REMOVED_RATIO": 0.1,
+    # 转录时顺便计算波形峰值 (需要 numpy), 保存为 TRANSCRIPT_DIR/<文件名>.peaks.json 供网页绘制波形
+    "PEAKS_ENABLED": True,
+    # 空闲时把 PROCESSED_DIR 中的归档音频重新压缩为 Opus (低优先级)
+    "ARCHIVE_COMPACT_ENABLED": False,
+    "ARCHIVE_COMPACT_BITRATE": "24k",
+    # 只压缩归档超过该天数的文件
+    "ARCHIVE_COMPACT_MIN_AGE_DAYS": 7,
+    # 转录队列空闲超过该秒数后才开始压缩
+    "ARCHIVE_COMPACT_IDLE_SECONDS": 60,
+    # 压缩后至少节省该比例的空间才替换原文件
+    "ARCHIVE_COMPACT_MIN_SAVING": 0.2,
+    # 关键词提醒规则文件, 命中时向 N8N_WEBHOOK_URL 发送 status=alert 的通知 (文件不存在时不启用)
+    "ALERT_RULES_PATH": "alert_rules.json",
+    # 通知先写入数据库发件箱, 由后台线程发送: 每次 POST 最多合并的事件数 (1 表示逐条发送, 保持旧的请求格式)
+    "WEBHOOK_BATCH_SIZE": 20,
+    # 发送失败后的重试间隔指数退避范围 (秒), 事件保留在发件箱中直到发送成功
+    "WEBHOOK_BASE_BACKOFF": 5,
+    "WEBHOOK_MAX_BACKOFF": 600,
+    # 录音按月份写入分区库的目录, 为空时使用 DB_PATH 所在目录下的 partitions/
+    "DB_PARTITION_DIR": "",
+    # 转录队列空闲时, 把超过该月数的分区的全文和分段压缩 (0 表示不压缩)
+    "DB_PARTITION_COMPRESS_MONTHS": 3,
+    # 收到 SIGTERM 后不再领取新文件, 最多等待在途任务这么多秒; 超时后记录检查点并退出
+    "SHUTDOWN_DRAIN_SECONDS": 900,
+    # 退出时未完成的任务, 重启后排在队列最前并保留排队时长
+    "CHECKPOINT_PATH": "transcriber_checkpoint.json",
+    # 进程 PID 文件, 防止重复启动; 为空时不写
+    "PID_FILE_PATH": "transcriber.pid",
+    # 调用方式: sync (一个请求等到转录完成) / async (提交任务后轮询结果, 任务编号保存在数据库中, 重启后继续取结果)
+    # 也可以在 ASR_ENDPOINTS 中为单个服务端指定 "mode"
+    "ASR_MODE": "sync",
+    # async 模式: 每次长轮询最多等待的秒数, 以及一个任务最长等待多久 (秒) 后放弃
+    "ASR_POLL_WAIT": 30,
+    "ASR_JOB_TIMEOUT": 21600,
+    # 自适应并发 (AIMD): 每个服务端的在途请求数在 [ASR_CONCURRENCY_MIN, max_inflight] 之间自动调整
+    # 请求在饱和状态下顺利完成时加性增加; 超时、服务端错误, 或归一化延迟 (耗时 / 音频时长) 超过近期最低值的
+    # ASR_AIMD_LATENCY_TOLERANCE 倍时, 乘以 ASR_AIMD_DECREASE
+    "ASR_ADAPTIVE_CONCURRENCY": True,
+    "ASR_CONCURRENCY_MIN": 1,
+    "ASR_AIMD_DECREASE": 0.5,
+    "ASR_AIMD_LATENCY_TOLERANCE": 2.0,
+    # 同一个文件 (大小和修改时间不变) 连续失败这么多次后不再重试, 也不再算作待处理 (0 为一直重试)
+    # 只计入音频转换失败和服务端拒绝该文件; 超时、服务端不可用和本地数据库错误不计入; 文件被替换后重新计数
+    "JOB_MAX_FAILURES": 5,
+    # 转换音频的 ffmpeg: 线程数上限 (0 为 ffmpeg 默认), nice 值 (0 为不调整),
+    # ionice 调度类 (0 为不调整, 2 为 best-effort, 3 为只用空闲 IO) 和 best-effort 下的优先级 (0-7)
+    "FFMPEG_THREADS": 2,
+    "FFMPEG_NICE": 10,
+    "FFMPEG_IONICE_CLASS": 2,
+    "FFMPEG_IONICE_LEVEL": 7,
+    # 资源调节: 每 GOVERNOR_INTERVAL 秒读取 1 分钟负载和磁盘繁忙度 (/proc/diskstats),
+    # 负载超过 GOVERNOR_MAX_LOAD (0 为 CPU 核数) 或任一磁盘繁忙比例超过 GOVERNOR_MAX_DISK_BUSY 时进入限流,
+    # 降到阈值的 80% 以下后恢复。GOVERNOR_DISKS 为空时检查所有物理磁盘 (如 ["sda", "md2"])
+    "GOVERNOR_ENABLED": True,
+    "GOVERNOR_INTERVAL": 5,
+    "GOVERNOR_MAX_LOAD": 0,
+    "GOVERNOR_MAX_DISK_BUSY": 0.8,
+    "GOVERNOR_DISKS": [],
+    # 同时进行的音频转换数: 正常 / 限流时
+    "GOVERNOR_MAX_CONVERSIONS": 2,
+    "GOVERNOR_THROTTLED_CONVERSIONS": 1,
+    # 上传到服务端的总带宽上限 (KB/s, 0 为不限): 正常 / 限流时
+    "GOVERNOR_UPLOAD_KBPS": 0,
+    "GOVERNOR_THROTTLED_UPLOAD_KBPS": 2048
 }
 
+# 代码中的默认值, 运行时重新加载 config.json 时以此为基础
+BUILTIN_CONFIG = DEFAULT_CONFIG.copy()
+
 # Load config from JSON file
 if os.path.exists(CONFIG_FILE):
     with open(CONFIG_FILE, "r", encoding="utf-8") as f:
@@ -32,7 +159,21 @@ if os.path.exists(CONFIG_FILE):
     DEFAULT_CONFIG.update(loaded_config)
 
 CONFIG = DEFAULT_CONFIG.copy()
-SUPPORTED_EXTENSIONS = ('.m4a', '.acc', '.aac', '.mp3', '.wav', '.ogg', '.flac')
+# 命令行参数覆盖的配置, 重新加载 config.json 后仍然有效
+CONFIG_OVERRIDES = {}
+# .opus 也是归档压缩的输出格式, backfill 等按扩展名识别归档音频时需要包含它
+SUPPORTED_EXTENSIONS = ('.m4a', '.acc', '.aac', '.mp3', '.wav', '.ogg', '.flac', '.opus')
+QUEUE_POLICIES = ('shortest', 'newest', 'fifo')
+
+# 上传格式: (扩展名, MIME 类型, ffmpeg 编码参数)
+UPLOAD_CODECS = {
+    "wav": (".wav", "audio/wav", ['-c:a', 'pcm_s16le', '-f', 'wav']),
+    "flac": (".flac", "audio/flac", ['-c:a', 'flac', '-f', 'flac']),
+    "opus": (".ogg", "audio/ogg", ['-c:a', 'libopus', '-application', 'voip', '-f', 'ogg']),
+}
+
+FFMPEG_PATH = "/usr/local/bin/ffmpeg"
+FFPROBE_PATH = "/usr/local/bin/ffprobe"
 
 # ---------------- 命令行参数 ----------------
 def parse_args():
@@ -44,10 +185,13 @@ def update_config(args):
     global CONFIG
     if args.source_path:
         base_path = args.source_path
-        CONFIG["SOURCE_DIR"] = base_path
-        CONFIG["TRANSCRIPT_DIR"] = os.path.join(base_path, "transcripts")
-        CONFIG["PROCESSED_DIR"] = os.path.join(base_path, "processed")
-        CONFIG["DB_PATH"] = os.path.join(base_path, "transcripts.db")
+        CONFIG_OVERRIDES.update({
+            "SOURCE_DIR": base_path,
+            "TRANSCRIPT_DIR": os.path.join(base_path, "transcripts"),
+            "PROCESSED_DIR": os.path.join(base_path, "processed"),
+            "DB_PATH": os.path.join(base_path, "transcripts.db"),
+        })
+        CONFIG.update(CONFIG_OVERRIDES)
         print(f"[配置] 使用自定义源路径: {base_path}")
 
 # ---------------- 工具函数 ----------------
@@ -76,50 +220,541 @@ def init_db():
             segments_json TEXT
         );
         ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive_compaction (
+            filename TEXT PRIMARY KEY,
+            archived_name TEXT,
+            status TEXT NOT NULL,
+            original_bytes INTEGER,
+            compacted_bytes INTEGER,
+            compacted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT
+        );
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS asr_jobs (
+            filename TEXT PRIMARY KEY,
+            identity TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            codec TEXT,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT,
+            polled_at TIMESTAMP
+        );
+        ''')
+        analytics.init_rollup_tables(cursor)
+        similarity.init_similarity_tables(cursor)
+        conn.commit()
+        # 列表摘要列 (时长 / 说话人 / 预览), 升级前的记录在这里补齐
+        analytics.fill_missing_summaries(conn)
+        partitions.init_catalog(cursor)
         conn.commit()
         conn.close()
     except Exception as e:
         print(f"数据库初始化失败: {e}")
 
-def save_to_db(filename, full_text, segments_list):
+def get_partition_dir():
+    return partitions.partition_dir(CONFIG["DB_PATH"], CONFIG.get("DB_PARTITION_DIR"))
+
+def save_to_db(filename, full_text, segments_list, events=()):
+    """写入转录记录; events 为 [(status, details)], 通知与记录在同一个事务中写入发件箱。"""
+    conn = None
     try:
         conn = sqlite3.connect(CONFIG["DB_PATH"])
+        # 录音写入按月分区的数据库, 编号索引、统计汇总、相似度词频和通知写入目录库, 两者在同一个事务中提交
+        created_at = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        partition = partitions.partition_key(filename, created_at)
+        schema = partitions.attach_for_write(conn, partition, get_partition_dir())
         cursor = conn.cursor()
         segments_json = json.dumps(segments_list, ensure_ascii=False)
-        cursor.execute(
-            "INSERT INTO transcriptions (filename, full_text, segments_json) VALUES (?, ?, ?)",
-            (filename, full_text, segments_json)
+        transcription_id = partitions.insert_transcription(
+            cursor, schema, partition, filename, created_at, full_text, segments_json,
+            analytics.summarize_transcript(full_text, segments_list)
         )
+        analytics.apply_rollup(cursor, analytics.rollup_segments(filename, created_at, segments_list))
+        similarity.store_terms(cursor, transcription_id, full_text, segments_list)
+        for status, details in events:
+            enqueue_webhook(cursor, status, filename, details)
         conn.commit()
-        conn.close()
-        print(f"  [DB] Saved {filename}")
+        WEBHOOK_WAKE.set()
+        print(f"  [DB] Saved {filename} -> {partition}")
         return True
     except Exception as e:
         print(f"  [DB Error] {e}")
         return False
+    finally:
+        # 出错时未提交的事务随连接关闭回滚, 不会一直占着数据库的写锁
+        if conn is not None:
+            conn.close()
 
-def notify_n8n(status, filename, details):
+ALERT_ENGINE = None
+
+def get_alert_engine():
+    global ALERT_ENGINE
+    if ALERT_ENGINE is None or ALERT_ENGINE.rules_path != CONFIG.get("ALERT_RULES_PATH"):
+        ALERT_ENGINE = alerts.AlertEngine(CONFIG.get("ALERT_RULES_PATH"))
+    return ALERT_ENGINE
+
+# ---------------- Webhook 发件箱 ----------------
+# 通知先写入 webhook_outbox, 由后台线程合并发送; 发送成功后才删除, 失败时整体退避重试
+WEBHOOK_WAKE = threading.Event()
+WEBHOOK_STATS = {"delivered": 0, "failures": 0, "last_error": None, "last_delivered_at": None, "retry_at": None}
+# 被唤醒后稍等片刻, 把相邻几个文件的通知合并到同一个请求
+WEBHOOK_LINGER_SECONDS = 1
+# 发件箱没有新事件时的轮询间隔 (秒), 兜底其他进程写入的事件
+WEBHOOK_POLL_INTERVAL = 30
+# 发件箱的读写语句, check_db.py 直接引用检查执行计划
+OUTBOX_INSERT_SQL = "INSERT INTO webhook_outbox (payload) VALUES (?)"
+# 按主键顺序读取队首, 取够 LIMIT 行即停止
+OUTBOX_BATCH_SQL = "SELECT id, payload FROM webhook_outbox ORDER BY id LIMIT ?"
+OUTBOX_FAILED_SQL = "UPDATE webhook_outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?"
+OUTBOX_DELETE_SQL = "DELETE FROM webhook_outbox WHERE id = ?"
+OUTBOX_COUNT_SQL = "SELECT COUNT(*) FROM webhook_outbox"
+
+def enqueue_webhook(cursor, status, filename, details):
+    """写入一条待发送的通知; 调用方负责事务。"""
     if not CONFIG["N8N_WEBHOOK_URL"]: return
     payload = {
-        "status": status, 
-        "filename": filename, 
-        "details": details, 
+        "status": status,
+        "filename": filename,
+        "details": details,
         "timestamp": datetime.datetime.now().isoformat()
     }
+    cursor.execute(OUTBOX_INSERT_SQL, (json.dumps(payload, ensure_ascii=False),))
+
+def notify_n8n(status, filename, details):
+    """不随转录记录写入的通知: 单独一个事务写入发件箱, 不在处理流程中等待网络。"""
+    if not CONFIG["N8N_WEBHOOK_URL"]: return
     try:
-        requests.post(CONFIG["N8N_WEBHOOK_URL"], json=payload, timeout=5)
-    except:
-        pass
+        conn = sqlite3.connect(CONFIG["DB_PATH"])
+        with conn:
+            enqueue_webhook(conn, status, filename, details)
+        conn.close()
+        WEBHOOK_WAKE.set()
+    except Exception as e:
+        print(f"  [Webhook] 写入发件箱失败: {e}")
+
+def webhook_backoff(failures):
+    base = float(CONFIG.get("WEBHOOK_BASE_BACKOFF", 5) or 5)
+    cap = float(CONFIG.get("WEBHOOK_MAX_BACKOFF", 600) or 600)
+    return min(base * 2 ** max(failures - 1, 0), cap) * random.uniform(0.8, 1.2)
+
+def deliver_webhook_batch():
+    """按写入顺序取出一批事件合并为一个请求发送。返回发送的条数, 发件箱为空时返回 0, 失败时抛出异常。"""
+    url = CONFIG["N8N_WEBHOOK_URL"]
+    if not url: return 0
+    batch_size = max(int(CONFIG.get("WEBHOOK_BATCH_SIZE", 20) or 1), 1)
+    conn = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        rows = conn.execute(OUTBOX_BATCH_SQL, (batch_size,)).fetchall()
+        if not rows: return 0
+        events = []
+        for event_id, payload in rows:
+            event = json.loads(payload)
+            # 重试可能导致重复投递, 接收端可按 event_id 去重
+            event["event_id"] = event_id
+            events.append(event)
+        body = events[0] if batch_size == 1 else {"events": events, "count": len(events)}
+        try:
+            response = requests.post(url, json=body, timeout=10)
+            response.raise_for_status()
+        except Exception as e:
+            with conn:
+                conn.executemany(OUTBOX_FAILED_SQL, [(str(e)[:500], event_id) for event_id, _ in rows])
+            raise
+        with conn:
+            conn.executemany(OUTBOX_DELETE_SQL, [(event_id,) for event_id, _ in rows])
+        return len(rows)
+    finally:
+        conn.close()
+
+def count_webhook_pending():
+    try:
+        conn = sqlite3.connect(CONFIG["DB_PATH"])
+        try:
+            return conn.execute(OUTBOX_COUNT_SQL).fetchone()[0]
+        finally:
+            conn.close()
+    except Exception:
+        return None
+
+def start_webhook_sender():
+    def run():
+        failures = 0
+        while True:
+            try:
+                sent = deliver_webhook_batch()
+            except Exception as e:
+                failures += 1
+                delay = webhook_backoff(failures)
+                WEBHOOK_STATS.update(failures=WEBHOOK_STATS["failures"] + 1, last_error=str(e)[:200],
+                                     retry_at=datetime.datetime.fromtimestamp(time.time() + delay).isoformat())
+                print(f"[Webhook] 发送失败 (连续第 {failures} 次): {e}，{delay:.0f}s 后重试")
+                # 退避期间不响应唤醒, 避免服务端故障时被新事件反复触发
+                time.sleep(delay)
+                continue
+            if sent:
+                if failures:
+                    print("[Webhook] 已恢复发送")
+                failures = 0
+                WEBHOOK_STATS.update(delivered=WEBHOOK_STATS["delivered"] + sent, retry_at=None,
+                                     last_delivered_at=datetime.datetime.now().isoformat())
+                continue
+            if WEBHOOK_WAKE.wait(WEBHOOK_POLL_INTERVAL):
+                time.sleep(WEBHOOK_LINGER_SECONDS)
+            WEBHOOK_WAKE.clear()
+    threading.Thread(target=run, name="webhook-sender", daemon=True).start()
 
 # ---------------- 音频处理 ----------------
-def convert_audio_to_wav(audio_path, wav_path):
-    FFMPEG_PATH = "/usr/local/bin/ffmpeg"
-    command = [
-        FFMPEG_PATH, '-y', '-i', audio_path, '-vn', '-map', '0:a',
-        '-ar', '16000', '-ac', '1', '-c:a', 'pcm_s16le', wav_path
-    ]
+def get_convert_dir():
+    return CONFIG.get("CONVERT_CACHE_DIR") or os.path.join(CONFIG["SOURCE_DIR"], ".converted")
+
+def get_upload_codec(endpoint=None):
+    codec = (endpoint or {}).get("codec") or CONFIG.get("ASR_UPLOAD_CODEC") or "wav"
+    codec = str(codec).lower()
+    if codec not in UPLOAD_CODECS:
+        print(f"  [Convert] 未知的上传格式 {codec}，改用 wav")
+        codec = "wav"
+    return codec
+
+def _read_flac_streaminfo(audio_path):
+    """读取 FLAC 的 STREAMINFO 块, 返回 (采样率, 声道数, 位深)。"""
+    with open(audio_path, 'rb') as f:
+        header = f.read(42)
+    if len(header) < 42 or header[:4] != b'fLaC' or (header[4] & 0x7f) != 0:
+        return None
+    info = int.from_bytes(header[18:21], 'big')
+    sample_rate = info >> 4
+    channels = ((info >> 1) & 0x07) + 1
+    bits = (((info & 0x01) << 4) | (header[21] >> 4)) + 1
+    return sample_rate, channels, bits
+
+def is_upload_ready(audio_path, codec):
+    """只读文件头, 判断源文件是否已经是 16kHz 单声道 16bit 的目标格式, 可以不经 ffmpeg 直接上传。"""
+    ext = os.path.splitext(audio_path)[1].lower()
+    try:
+        if codec == "wav" and ext == ".wav":
+            with wave.open(audio_path, 'rb') as w:
+                return (w.getframerate() == 16000 and w.getnchannels() == 1
+                        and w.getsampwidth() == 2 and w.getcomptype() == 'NONE')
+        if codec == "flac" and ext == ".flac":
+            return _read_flac_streaminfo(audio_path) == (16000, 1, 16)
+    except Exception:
+        return False
+    return False
+
+def get_cache_path(audio_path, codec, variant=""):
+    """转换缓存按文件身份 (文件名 + 大小 + 修改时间) 命名, 源文件变化后自然失效。"""
+    st = os.stat(audio_path)
+    identity = f"{os.path.basename(audio_path)}|{st.st_size}|{st.st_mtime_ns}"
+    key = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(get_convert_dir(), f"{key}{variant}{UPLOAD_CODECS[codec][0]}")
+
+def prune_convert_cache():
+    """按容量上限和保留天数清理转换缓存, 先删除最旧的。"""
+    cache_dir = get_convert_dir()
+    if not os.path.isdir(cache_dir): return
+    max_bytes = float(CONFIG.get("CONVERT_CACHE_MAX_MB", 2048) or 0) * 1024 * 1024
+    max_age = float(CONFIG.get("CONVERT_CACHE_MAX_DAYS", 7) or 0) * 86400
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    now = time.time()
+    for mtime, size, path in entries:
+        expired = max_age and now - mtime > max_age
+        if not expired and (not max_bytes or total <= max_bytes):
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+# ---------------- 资源调节 ----------------
+# 限流状态的滞回: 负载和磁盘繁忙度降到阈值的该比例以下才恢复
+GOVERNOR_RECOVER_RATIO = 0.8
+# 上传限速允许的突发 (秒), 避免每个数据块都 sleep
+UPLOAD_BURST_SECONDS = 0.5
+# /proc/diskstats 中不是物理磁盘的设备
+VIRTUAL_DISK_PREFIXES = ('loop', 'ram', 'zram', 'dm-', 'sr', 'fd')
+
+def read_diskstats():
+    """{设备名: 累计 IO 繁忙毫秒数}; 不是 Linux 时返回空"""
+    try:
+        with open('/proc/diskstats', 'r') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return {}
+    stats = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 13:
+            stats[fields[2]] = int(fields[12])
+    return stats
+
+def physical_disks(names):
+    """整块磁盘 (sda, nvme0n1, md2), 去掉分区和虚拟设备"""
+    disks = []
+    for name in names:
+        if name.startswith(VIRTUAL_DISK_PREFIXES):
+            continue
+        # /sys/block 下只有整块磁盘, 分区在其子目录中
+        if os.path.isdir('/sys/block') and not os.path.exists(os.path.join('/sys/block', name)):
+            continue
+        disks.append(name)
+    return disks
+
+class ResourceGovernor:
+    """按系统负载和磁盘繁忙度限制同时进行的音频转换数和上传带宽, 让 NAS 上的其他服务保持响应。"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.throttled = False
+        self.reason = ""
+        self.since = time.time()
+        self.throttled_seconds = 0.0
+        self.throttle_count = 0
+        self.load = None
+        self.disk_busy = {}
+        self.last_disk = None
+        self.converting = 0
+        self.waiting = 0
+        self.uploaded = 0
+        self.upload_rate = 0.0
+        self.last_uploaded = (time.time(), 0)
+        self.upload_next = 0.0
+
+    def _limits(self):
+        max_load = float(CONFIG.get("GOVERNOR_MAX_LOAD") or 0) or float(os.cpu_count() or 1)
+        max_busy = float(CONFIG.get("GOVERNOR_MAX_DISK_BUSY", 0.8) or 0)
+        return max_load, max_busy
+
+    def sample(self):
+        """读取一次负载和磁盘繁忙度, 更新限流状态; 状态变化时返回 True"""
+        now = time.time()
+        try:
+            load = os.getloadavg()[0]
+        except (OSError, AttributeError):
+            load = None
+        disks = read_diskstats()
+        busy = {}
+        if self.last_disk is not None and disks:
+            elapsed_ms = (now - self.last_disk[0]) * 1000
+            names = CONFIG.get("GOVERNOR_DISKS") or physical_disks(disks)
+            for name in names:
+                if name in disks and name in self.last_disk[1] and elapsed_ms > 0:
+                    busy[name] = round(min(max((disks[name] - self.last_disk[1][name]) / elapsed_ms, 0.0), 1.0), 3)
+        self.last_disk = (now, disks)
+        max_load, max_busy = self._limits()
+        with self.cond:
+            self.load = load
+            self.disk_busy = busy
+            uploaded_at, uploaded = self.last_uploaded
+            self.upload_rate = (self.uploaded - uploaded) / max(now - uploaded_at, 1e-6)
+            self.last_uploaded = (now, self.uploaded)
+            if not CONFIG.get("GOVERNOR_ENABLED"):
+                return self._set_throttled(False, "", now)
+            # 进入限流看阈值, 恢复要降到阈值的 GOVERNOR_RECOVER_RATIO 以下
+            ratio = GOVERNOR_RECOVER_RATIO if self.throttled else 1.0
+            reasons = []
+            if load is not None and load > max_load * ratio:
+                reasons.append(f"负载 {load:.1f} (上限 {max_load:g})")
+            hot = [f"{name} {value:.0%}" for name, value in busy.items() if max_busy and value > max_busy * ratio]
+            if hot:
+                reasons.append(f"磁盘繁忙 {', '.join(hot)}")
+            return self._set_throttled(bool(reasons), "; ".join(reasons), now)
+
+    def _set_throttled(self, throttled, reason, now):
+        if throttled:
+            self.reason = reason
+        if throttled == self.throttled:
+            return False
+        if self.throttled:
+            self.throttled_seconds += now - self.since
+            print(f"[资源] 负载恢复，解除限流 (持续 {int(now - self.since)}s)")
+        else:
+            self.throttle_count += 1
+            print(f"[资源] 系统繁忙，限制转换和上传: {reason}")
+        self.throttled = throttled
+        self.since = now
+        self.cond.notify_all()
+        return True
+
+    def conversion_slots(self):
+        key = "GOVERNOR_THROTTLED_CONVERSIONS" if self.throttled else "GOVERNOR_MAX_CONVERSIONS"
+        # 至少保留一个, 限流时转换变慢但不会停止
+        return max(int(CONFIG.get(key) or 1), 1)
+
+    def acquire_conversion(self):
+        with self.cond:
+            self.waiting += 1
+            try:
+                while self.converting >= self.conversion_slots():
+                    self.cond.wait(1.0)
+            finally:
+                self.waiting -= 1
+            self.converting += 1
+
+    def release_conversion(self):
+        with self.cond:
+            self.converting = max(self.converting - 1, 0)
+            self.cond.notify_all()
+
+    def upload_limit(self):
+        """当前的上传带宽上限 (字节/秒), 0 为不限"""
+        key = "GOVERNOR_THROTTLED_UPLOAD_KBPS" if self.throttled else "GOVERNOR_UPLOAD_KBPS"
+        return float(CONFIG.get(key) or 0) * 1024
+
+    def throttle_upload(self, nbytes):
+        """所有上传共用的令牌桶, 发送 nbytes 之前调用"""
+        rate = self.upload_limit()
+        with self.cond:
+            self.uploaded += nbytes
+            if not rate:
+                return
+            now = time.monotonic()
+            self.upload_next = max(self.upload_next, now - UPLOAD_BURST_SECONDS) + nbytes / rate
+            delay = self.upload_next - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def snapshot(self):
+        max_load, max_busy = self._limits()
+        with self.cond:
+            now = time.time()
+            return {
+                "enabled": bool(CONFIG.get("GOVERNOR_ENABLED")),
+                "state": "throttled" if self.throttled else "normal",
+                "reason": self.reason if self.throttled else "",
+                "since": datetime.datetime.fromtimestamp(self.since).isoformat(timespec='seconds'),
+                "load": round(self.load, 2) if self.load is not None else None,
+                "max_load": max_load,
+                "disk_busy": dict(self.disk_busy),
+                "max_disk_busy": max_busy,
+                "conversions": self.converting,
+                "conversions_waiting": self.waiting,
+                "conversion_slots": self.conversion_slots(),
+                "upload_kbps": round(self.upload_rate / 1024, 1),
+                "upload_limit_kbps": round(self.upload_limit() / 1024, 1),
+                "throttle_count": self.throttle_count,
+                "throttled_seconds": round(self.throttled_seconds + (now - self.since if self.throttled else 0), 1),
+            }
+
+GOVERNOR = ResourceGovernor()
+
+def start_resource_governor():
+    def run():
+        while not SHUTDOWN.is_set():
+            try:
+                if GOVERNOR.sample():
+                    write_status()
+            except Exception as e:
+                print(f"[资源] 读取系统负载失败: {e}")
+            time.sleep(max(float(CONFIG.get("GOVERNOR_INTERVAL", 5) or 5), 1))
+    threading.Thread(target=run, name="resource-governor", daemon=True).start()
+
+def priority_prefix(nice, io_class, io_level=None):
+    """nice / ionice 命令前缀; 系统没有对应命令时省略"""
+    prefix = []
+    if nice and shutil.which('nice'):
+        prefix += ['nice', '-n', str(int(nice))]
+    if io_class and shutil.which('ionice'):
+        prefix += ['ionice', '-c', str(int(io_class))]
+        if int(io_class) == 2 and io_level is not None:
+            prefix += ['-n', str(min(max(int(io_level), 0), 7))]
+    return prefix
+
+def ffmpeg_prefix():
+    """转换音频用的 ffmpeg 命令开头: 优先级前缀和线程数上限"""
+    command = priority_prefix(CONFIG.get("FFMPEG_NICE"), CONFIG.get("FFMPEG_IONICE_CLASS"),
+                              CONFIG.get("FFMPEG_IONICE_LEVEL")) + [FFMPEG_PATH, '-y']
+    threads = int(CONFIG.get("FFMPEG_THREADS") or 0)
+    if threads:
+        command += ['-threads', str(threads)]
+    return command
+
+class UploadBody:
+    """流式发送的 multipart 请求体: 边读文件边发送 (不把整个文件读进内存), 每块都经过上传限速。
+    格式与 requests 的 files= 相同。"""
+
+    def __init__(self, path, field, filename, mime, fields):
+        boundary = choose_boundary()
+        head = b''
+        for name, value in fields.items():
+            part = RequestField(name, str(value))
+            part.make_multipart()
+            head += f"--{boundary}\r\n".encode() + part.render_headers().encode() + str(value).encode() + b"\r\n"
+        part = RequestField(field, b'', filename=filename)
+        part.make_multipart(content_type=mime)
+        head += f"--{boundary}\r\n".encode() + part.render_headers().encode()
+        self.chunks = [head, None, f"\r\n--{boundary}--\r\n".encode()]
+        self.file = open(path, 'rb')
+        self.length = len(head) + os.path.getsize(path) + len(self.chunks[2])
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        size = 64 * 1024 if size is None or size < 0 else size
+        while self.chunks:
+            if self.chunks[0] is None:
+                data = self.file.read(size)
+                if not data:
+                    self.chunks.pop(0)
+                    continue
+                GOVERNOR.throttle_upload(len(data))
+                return data
+            data, rest = self.chunks[0][:size], self.chunks[0][size:]
+            if rest:
+                self.chunks[0] = rest
+            else:
+                self.chunks.pop(0)
+            return data
+        return b''
+
+    def close(self):
+        self.file.close()
+
+def convert_audio(audio_path, out_path, codec="wav"):
+    """转换为 16kHz 单声道的上传格式 (wav/flac/opus)。"""
+    # 上次服务端不可用时保留下来的转换结果, 源文件未变化则直接复用
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(audio_path):
+        print(f"  [Convert] 复用已转换的音频: {os.path.basename(out_path)}")
+        return True
+    # 先写入 .part 再改名, 中途被打断也不会留下半个文件被当作缓存复用
+    part_path = out_path + ".part"
+    codec_args = list(UPLOAD_CODECS[codec][2])
+    if codec == "opus":
+        codec_args[2:2] = ['-b:a', str(CONFIG.get("ASR_UPLOAD_BITRATE") or "32k")]
+    command = ffmpeg_prefix() + [
+        '-i', audio_path, '-vn', '-map', '0:a',
+        '-ar', '16000', '-ac', '1'
+    ] + codec_args + [part_path]
     try:
-        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        # 系统繁忙时排队等待转换名额
+        GOVERNOR.acquire_conversion()
+        try:
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        finally:
+            GOVERNOR.release_conversion()
+        os.replace(part_path, out_path)
         return True
     except subprocess.CalledProcessError as e:
         error_msg = e.stderr.decode().strip() if e.stderr else "Unknown error"
@@ -128,18 +763,353 @@ def convert_audio_to_wav(audio_path, wav_path):
     except Exception as e:
         print(f"  [Convert Error] {e}")
         return False
+    finally:
+        if os.path.exists(part_path): os.remove(part_path)
+
+def convert_audio_to_wav(audio_path, wav_path):
+    return convert_audio(audio_path, wav_path, "wav")
+
+# ---------------- 静音裁剪 (VAD) ----------------
+SAMPLE_RATE = 16000
+VAD_FRAME = 480  # 30ms
+VAD_CEILING_DB = -35
+VAD_BLOCK_FRAMES = 20000  # 分块计算能量, 每块约 10 分钟
+
+def vad_available():
+    return np is not None and bool(CONFIG.get("VAD_ENABLED"))
+
+def open_pcm(wav_path):
+    """以内存映射方式打开 16kHz 单声道 s16le WAV 的采样数据, 不整体读入内存。"""
+    with open(wav_path, 'rb') as f:
+        header = f.read(12)
+        if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        fmt_ok = False
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, chunk_size = chunk[:4], int.from_bytes(chunk[4:], 'little')
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                audio_format, channels = int.from_bytes(fmt[0:2], 'little'), int.from_bytes(fmt[2:4], 'little')
+                rate, bits = int.from_bytes(fmt[4:8], 'little'), int.from_bytes(fmt[14:16], 'little')
+                fmt_ok = (audio_format == 1 and channels == 1 and rate == SAMPLE_RATE and bits == 16)
+                if chunk_size % 2: f.seek(1, 1)
+            elif chunk_id == b'data':
+                if not fmt_ok:
+                    return None
+                offset = f.tell()
+                # ffmpeg 流式写出时 data 长度可能不准确, 以实际文件大小为准
+                size = min(chunk_size, os.path.getsize(wav_path) - offset)
+                if size < 2:
+                    return np.zeros(0, dtype='<i2')
+                return np.memmap(wav_path, dtype='<i2', mode='r', offset=offset, shape=(size // 2,))
+            else:
+                f.seek(chunk_size + (chunk_size % 2), 1)
+
+def frame_energy_db(pcm):
+    """按 30ms 分帧计算能量 (dBFS), 分块处理以限制内存占用。"""
+    n_frames = len(pcm) // VAD_FRAME
+    energy = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, VAD_BLOCK_FRAMES):
+        end = min(start + VAD_BLOCK_FRAMES, n_frames)
+        block = np.asarray(pcm[start * VAD_FRAME:end * VAD_FRAME], dtype=np.float32) / 32768.0
+        power = np.mean(block.reshape(-1, VAD_FRAME) ** 2, axis=1)
+        energy[start:end] = 10 * np.log10(power + 1e-10)
+    return energy
+
+def detect_voiced_regions(pcm):
+    """返回需要保留的区间 [(起始采样, 结束采样)]。"""
+    energy = frame_energy_db(pcm)
+    if len(energy) == 0:
+        return [(0, len(pcm))] if len(pcm) else []
+    noise_floor = float(np.percentile(energy, 10))
+    threshold = noise_floor + float(CONFIG.get("VAD_MARGIN_DB", 12))
+    threshold = min(max(threshold, float(CONFIG.get("VAD_FLOOR_DB", -55))), VAD_CEILING_DB)
+    voiced = energy > threshold
+    # 语音前后各扩展 VAD_PAD_MS
+    pad = int(float(CONFIG.get("VAD_PAD_MS", 300)) / 30)
+    if pad > 0 and voiced.any():
+        voiced = np.convolve(voiced.astype(np.int8), np.ones(2 * pad + 1, dtype=np.int8), mode='same') > 0
+    # 找出连续的语音区间, 间隔短于 VAD_MIN_SILENCE_MS 的静音不裁掉
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    min_gap = int(float(CONFIG.get("VAD_MIN_SILENCE_MS", 2000)) / 30)
+    regions = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if regions and start - regions[-1][1] < min_gap:
+            regions[-1][1] = end
+        else:
+            regions.append([start, end])
+    total = len(pcm)
+    result = [(start * VAD_FRAME, min(end * VAD_FRAME, total)) for start, end in regions]
+    # 末尾不足一帧的采样跟随最后一个区间
+    if result and result[-1][1] >= (total // VAD_FRAME) * VAD_FRAME:
+        result[-1] = (result[-1][0], total)
+    return result
+
+def write_regions_wav(pcm, regions, out_path):
+    part_path = out_path + ".part"
+    step = SAMPLE_RATE * 600
+    try:
+        with wave.open(part_path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            for start, end in regions:
+                for pos in range(start, end, step):
+                    w.writeframes(np.asarray(pcm[pos:min(pos + step, end)]).tobytes())
+        os.replace(part_path, out_path)
+    finally:
+        if os.path.exists(part_path): os.remove(part_path)
+
+class VadPlan:
+    """裁剪后时间轴到原始时间轴的映射。"""
+
+    def __init__(self, regions, total_samples):
+        self.regions = regions
+        self.total_samples = total_samples
+        self.offsets = []
+        kept = 0
+        for start, end in regions:
+            self.offsets.append(kept)
+            kept += end - start
+        self.kept_samples = kept
+
+    @property
+    def removed_ratio(self):
+        return 1 - self.kept_samples / self.total_samples if self.total_samples else 0.0
+
+    def to_original_ms(self, ms, is_end=False):
+        """is_end: 落在两个区间拼接点上的结束时间属于前一个区间, 否则会把中间删掉的静音也算进这一段"""
+        if not self.regions:
+            return ms
+        sample = int(round(float(ms) * SAMPLE_RATE / 1000))
+        if is_end:
+            i = max(bisect.bisect_left(self.offsets, sample) - 1, 0)
+        else:
+            i = max(bisect.bisect_right(self.offsets, sample) - 1, 0)
+        start, end = self.regions[i]
+        original = min(start + sample - self.offsets[i], end)
+        return int(round(original * 1000 / SAMPLE_RATE))
+
+    def remap_segments(self, segments):
+        for seg in segments:
+            for key in ('start', 'end'):
+                if isinstance(seg.get(key), (int, float)):
+                    seg[key] = self.to_original_ms(seg[key], is_end=key == 'end')
+        return segments
+
+# ---------------- 波形峰值 ----------------
+# 每个峰值覆盖的采样数 (16kHz 下分别为 0.25s / 1s / 4s), 2 小时录音最粗一级约 3.6KB
+PEAK_LEVELS = (4000, 16000, 64000)
+
+def compute_peaks(pcm):
+    """按 PEAK_LEVELS 计算各级 (最小值, 最大值) 峰值, 量化为 int8。"""
+    finest = PEAK_LEVELS[0]
+    n_peaks = -(-len(pcm) // finest)
+    mins = np.zeros(n_peaks, dtype=np.int16)
+    maxs = np.zeros(n_peaks, dtype=np.int16)
+    step = finest * 2400  # 每块约 10 分钟
+    for start in range(0, len(pcm), step):
+        block = np.asarray(pcm[start:start + step])
+        pad = -len(block) % finest
+        if pad:
+            block = np.concatenate((block, np.zeros(pad, dtype=block.dtype)))
+        block = block.reshape(-1, finest)
+        i = start // finest
+        mins[i:i + len(block)] = block.min(axis=1)
+        maxs[i:i + len(block)] = block.max(axis=1)
+    levels = []
+    for samples in PEAK_LEVELS:
+        # 粗级由最细一级合并得到, 不再重新扫描采样
+        factor = samples // finest
+        pad = -len(mins) % factor
+        lo = np.concatenate((mins, np.zeros(pad, dtype=mins.dtype))).reshape(-1, factor).min(axis=1)
+        hi = np.concatenate((maxs, np.zeros(pad, dtype=maxs.dtype))).reshape(-1, factor).max(axis=1)
+        pairs = np.empty(len(lo) * 2, dtype=np.int8)
+        pairs[0::2] = lo >> 8
+        pairs[1::2] = hi >> 8
+        levels.append({"samples_per_peak": samples, "length": len(lo),
+                       "data": base64.b64encode(pairs.tobytes()).decode('ascii')})
+    return {"sample_rate": SAMPLE_RATE, "duration_ms": int(len(pcm) * 1000 / SAMPLE_RATE), "levels": levels}
+
+def save_peaks(peaks, peaks_path):
+    part_path = peaks_path + ".part"
+    with open(part_path, 'w', encoding='utf-8') as f:
+        json.dump(peaks, f, separators=(',', ':'))
+    os.replace(part_path, peaks_path)
+
+# ---------------- 时长探测 ----------------
+# 探测结果按路径缓存, 大小和修改时间未变化时不会重复调用 ffprobe; 文件离开源目录后随 _FIRST_SEEN 一起清理
+_DURATION_CACHE = {}
+
+def _probe_wav_duration(audio_path):
+    # WAV 只需读取文件头
+    with wave.open(audio_path, 'rb') as w:
+        rate = w.getframerate()
+        return w.getnframes() / rate if rate else None
+
+def _probe_ffprobe_duration(audio_path):
+    command = [
+        FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1', audio_path
+    ]
+    output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, timeout=30).stdout
+    return float(output.decode().strip())
+
+def measure_duration(audio_path):
+    """实际测量的音频时长 (秒), 测量失败返回 None, 不做估算"""
+    try:
+        if audio_path.lower().endswith('.wav'):
+            duration = _probe_wav_duration(audio_path)
+        else:
+            duration = _probe_ffprobe_duration(audio_path)
+    except Exception:
+        return None
+    return duration if duration and duration > 0 else None
+
+def probe_duration(audio_path):
+    """返回音频时长 (秒)。探测失败时按文件大小粗略估算 (约 128kbps)。"""
+    try:
+        st = os.stat(audio_path)
+    except OSError:
+        return None
+    key = (st.st_size, st.st_mtime)
+    cached = _DURATION_CACHE.get(audio_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    duration = measure_duration(audio_path)
+    if not duration:
+        duration = st.st_size / 16000.0
+    _DURATION_CACHE[audio_path] = (key, duration)
+    return duration
+
+# ---------------- 任务队列 ----------------
+# 文件首次被发现的时间, 用于计算等待时长 (老化)
+_FIRST_SEEN = {}
+# 连续失败次数: 文件名 -> (文件身份, 次数, 最近的失败原因)
+_FAILURES = {}
+
+def record_job_failure(audio_path, reason):
+    filename = os.path.basename(audio_path)
+    try:
+        identity = source_identity(audio_path)
+    except OSError:
+        return
+    previous, count, _ = _FAILURES.get(filename, (identity, 0, None))
+    count = count + 1 if previous == identity else 1
+    _FAILURES[filename] = (identity, count, reason)
+    limit = int(CONFIG.get("JOB_MAX_FAILURES", 5) or 0)
+    if limit and count == limit:
+        print(f"[队列] {filename} 已连续失败 {count} 次 ({reason})，不再重试 (文件被替换或重启后重新处理)")
+        notify_n8n("failed", filename, {"failures": count, "error": reason})
+
+def given_up_snapshot():
+    """已达到失败次数上限、不再重试的文件, 写入状态文件"""
+    limit = int(CONFIG.get("JOB_MAX_FAILURES", 5) or 0)
+    if not limit:
+        return []
+    return [{"filename": filename, "failures": count, "error": reason}
+            for filename, (_, count, reason) in sorted(_FAILURES.items()) if count >= limit]
+
+def job_given_up(filename, audio_path):
+    """文件已达到失败次数上限; 文件变化后清除记录"""
+    limit = int(CONFIG.get("JOB_MAX_FAILURES", 5) or 0)
+    entry = _FAILURES.get(filename)
+    if not entry:
+        return False
+    try:
+        identity = source_identity(audio_path)
+    except OSError:
+        return False
+    if entry[0] != identity:
+        del _FAILURES[filename]
+        return False
+    return bool(limit) and entry[1] >= limit
+
+def scan_pending_jobs():
+    """扫描源目录, 返回按 QUEUE_POLICY 排好序的待处理任务列表。"""
+    source_dir = CONFIG["SOURCE_DIR"]
+    if not os.path.exists(source_dir):
+        return []
+    now = time.time()
+    jobs = []
+    for filename in os.listdir(source_dir):
+        if not filename.lower().endswith(SUPPORTED_EXTENSIONS): continue
+        if filename.endswith("_TEMP.wav"): continue
+        audio_path = os.path.join(source_dir, filename)
+        try:
+            mtime = os.path.getmtime(audio_path)
+        except OSError:
+            continue
+        if job_given_up(filename, audio_path): continue
+        first_seen = _FIRST_SEEN.setdefault(filename, now)
+        jobs.append({
+            "filename": filename,
+            "path": audio_path,
+            "mtime": mtime,
+            "duration": probe_duration(audio_path),
+            "waited": now - first_seen,
+        })
+    # 清理已经不在源目录中的记录
+    names = {job["filename"] for job in jobs}
+    for filename in list(_FIRST_SEEN):
+        if filename not in names:
+            del _FIRST_SEEN[filename]
+    paths = {job["path"] for job in jobs}
+    for audio_path in list(_DURATION_CACHE):
+        if audio_path not in paths:
+            del _DURATION_CACHE[audio_path]
+    for filename in list(_FAILURES):
+        if not os.path.exists(os.path.join(source_dir, filename)):
+            del _FAILURES[filename]
+    return order_jobs(jobs)
+
+def order_jobs(jobs, policy=None):
+    policy = (policy or CONFIG.get("QUEUE_POLICY") or "shortest").lower()
+    if policy not in QUEUE_POLICIES:
+        print(f"[队列] 未知策略 {policy}，改用 fifo")
+        policy = "fifo"
+    aging_rate = float(CONFIG.get("QUEUE_AGING_RATE", 0) or 0)
+    max_wait = float(CONFIG.get("QUEUE_MAX_WAIT_SECONDS", 0) or 0)
+
+    def score(job):
+        if policy == "shortest":
+            return (job["duration"] or 0) - aging_rate * job["waited"]
+        if policy == "newest":
+            return -job["mtime"]
+        return job["mtime"]
+
+    # 上次退出时未完成的文件和等待过久的文件按先来后到排在最前, 其余按策略排序
+    def is_starved(job):
+        return job["filename"] in RESUMED_FILES or (max_wait and job["waited"] >= max_wait)
+    starved = [job for job in jobs if is_starved(job)]
+    starved.sort(key=lambda job: job["mtime"])
+    normal = [job for job in jobs if not is_starved(job)]
+    normal.sort(key=lambda job: (score(job), job["filename"]))
+    return starved + normal
+
+def format_duration(seconds):
+    return format_time((seconds or 0) * 1000)
 
 # ---------------- TXT 保存 ----------------
+EMOTION_LABELS = {
+    "happy": "😊开心", "sad": "😔悲伤", "angry": "😡生气", 
+    "laughter": "🤣大笑", "fearful": "😨害怕", "surprised": "😲惊讶",
+    "neutral": ""
+}
+TXT_SUMMARY_HEADER = "=== 全文摘要 ==="
+TXT_DIALOGUE_HEADER = "=== 对话记录 (按说话人) ==="
+
 def save_transcript_with_spk(full_text, segments, txt_path):
     try:
         content_lines = []
-        emo_map = {
-            "happy": "😊开心", "sad": "😔悲伤", "angry": "😡生气", 
-            "laughter": "🤣大笑", "fearful": "😨害怕", "surprised": "😲惊讶",
-            "neutral": ""
-        }
-        content_lines.append(f"=== 全文摘要 ===\n{full_text}\n")
-        content_lines.append("=== 对话记录 (按说话人) ===")
+        emo_map = EMOTION_LABELS
+        content_lines.append(f"{TXT_SUMMARY_HEADER}\n{full_text}\n")
+        content_lines.append(TXT_DIALOGUE_HEADER)
         for seg in segments:
             start_str = format_time(seg.get('start', 0))
             spk_label = str(seg.get('spk', 'Unknown'))
@@ -157,74 +1127,1343 @@ def save_transcript_with_spk(full_text, segments, txt_path):
         print(f"  [Save TXT Error] {e}")
         return False
 
+# ---------------- ASR 服务端负载均衡 ----------------
+def load_endpoint_configs():
+    """把 ASR_ENDPOINTS 规范化为 [{"url", "weight", "max_inflight"}]。"""
+    configs = []
+    for item in CONFIG.get("ASR_ENDPOINTS") or []:
+        if isinstance(item, str):
+            item = {"url": item}
+        if not isinstance(item, dict) or not item.get("url"):
+            print(f"[ASR] 忽略无效的服务端配置: {item}")
+            continue
+        configs.append({
+            "url": item["url"],
+            "weight": max(float(item.get("weight", 1) or 1), 0.01),
+            "max_inflight": max(int(item.get("max_inflight", 1) or 1), 1),
+            "codec": item.get("codec"),
+            "mode": item.get("mode"),
+        })
+    if not configs:
+        configs.append({"url": CONFIG["ASR_API_URL"], "weight": 1.0, "max_inflight": 1, "codec": None, "mode": None})
+    return configs
+
+# 自适应并发: 计算延迟基准的最近样本数, 以及保留的调整记录条数
+AIMD_LATENCY_WINDOW = 50
+AIMD_HISTORY_SIZE = 50
+
+class EndpointPool:
+    """按 (在途请求数 / 权重) 选择最空闲的健康服务端, 连接失败的服务端标记为下线。
+    开启 ASR_ADAPTIVE_CONCURRENCY 时, 每个服务端的并发上限按 AIMD 在 [ASR_CONCURRENCY_MIN, max_inflight] 内调整。"""
+
+    def __init__(self, endpoint_configs):
+        self.cond = threading.Condition()
+        self.started_at = time.time()
+        self.endpoints = [self._new_endpoint(cfg) for cfg in endpoint_configs]
+
+    @staticmethod
+    def _new_endpoint(cfg):
+        ep = dict(cfg)
+        ep.update({
+            "healthy": True, "inflight": 0, "completed": 0, "failed": 0,
+            "audio_seconds": 0.0, "busy_seconds": 0.0, "bytes_sent": 0,
+            "last_error": "", "down_since": None,
+            # 该服务端是否已成功处理过当前上传格式 (用于格式协商); codec 可能被协商改为 wav, 另存配置值
+            "codec_verified": False,
+            "codec_config": cfg.get("codec"),
+            # 自适应并发: 当前上限 (小数, 取整后生效), 归一化延迟样本, 上次降低的时间, 调整记录
+            "limit": float(concurrency_floor(cfg["max_inflight"])),
+            "latency_samples": deque(maxlen=AIMD_LATENCY_WINDOW),
+            "limit_decreased_at": 0.0,
+            "limit_history": deque(maxlen=AIMD_HISTORY_SIZE),
+        })
+        return ep
+
+    @staticmethod
+    def _limit(ep):
+        """当前生效的并发上限"""
+        if not CONFIG.get("ASR_ADAPTIVE_CONCURRENCY"):
+            return ep["max_inflight"]
+        return min(max(int(ep["limit"]), concurrency_floor(ep["max_inflight"])), ep["max_inflight"])
+
+    def capacity(self):
+        with self.cond:
+            return sum(self._limit(ep) for ep in self.endpoints)
+
+    def _set_limit(self, ep, value, reason):
+        """调整并发上限 (调用方持有锁); 生效值变化时记录"""
+        old = self._limit(ep)
+        ep["limit"] = min(max(value, float(concurrency_floor(ep["max_inflight"]))), float(ep["max_inflight"]))
+        new = self._limit(ep)
+        if new < old:
+            ep["limit_decreased_at"] = time.time()
+        if new != old:
+            ep["limit_history"].append({"time": datetime.datetime.now().isoformat(timespec='seconds'),
+                                        "limit": new, "reason": reason})
+            print(f"  [并发] {ep['url']} 并发上限 {old} -> {new} ({reason})")
+
+    def _adapt(self, ep, success, elapsed, audio_seconds, congested):
+        """AIMD: 拥塞 (超时 / 服务端错误 / 延迟明显升高) 时乘性降低, 饱和状态下顺利完成时加性增加。
+        在上次降低之前就已开始的请求反映的是旧的并发, 不再触发降低。"""
+        started = time.time() - elapsed
+        decrease = min(max(float(CONFIG.get("ASR_AIMD_DECREASE", 0.5) or 0.5), 0.1), 0.9)
+        if congested:
+            if started >= ep["limit_decreased_at"]:
+                self._set_limit(ep, ep["limit"] * decrease, "超时或服务端错误")
+            return
+        # 文件本身的错误不反映服务端负载
+        if not success or not audio_seconds:
+            return
+        sample = elapsed / audio_seconds
+        samples = ep["latency_samples"]
+        baseline = min(samples) if samples else sample
+        samples.append(sample)
+        tolerance = max(float(CONFIG.get("ASR_AIMD_LATENCY_TOLERANCE", 2.0) or 2.0), 1.0)
+        if sample > baseline * tolerance:
+            if started >= ep["limit_decreased_at"]:
+                self._set_limit(ep, ep["limit"] * decrease, f"延迟升高到基准的 {sample / baseline:.1f} 倍")
+        elif ep["inflight"] + 1 >= self._limit(ep):
+            # 只有用满上限时才能说明还有余量
+            self._set_limit(ep, ep["limit"] + 1 / max(ep["limit"], 1), "请求顺利完成")
+
+    def reconfigure(self, endpoint_configs, codec_changed=False):
+        """配置修改后更新服务端列表。同一 URL 保留统计和在途计数; 移除的服务端上的在途请求照常完成。"""
+        with self.cond:
+            existing = {ep["url"]: ep for ep in self.endpoints}
+            endpoints = []
+            for cfg in endpoint_configs:
+                ep = existing.get(cfg["url"])
+                if ep is None:
+                    endpoints.append(self._new_endpoint(cfg))
+                    continue
+                ep["weight"] = cfg["weight"]
+                ep["max_inflight"] = cfg["max_inflight"]
+                ep["mode"] = cfg["mode"]
+                ep["limit"] = min(max(ep["limit"], float(concurrency_floor(ep["max_inflight"]))), float(ep["max_inflight"]))
+                if codec_changed or ep["codec_config"] != cfg["codec"]:
+                    # 上传格式变了, 丢弃之前协商的结果
+                    ep["codec"] = ep["codec_config"] = cfg["codec"]
+                    ep["codec_verified"] = False
+                endpoints.append(ep)
+            self.endpoints = endpoints
+            self.cond.notify_all()
+
+    def _pick(self, url=None):
+        candidates = [ep for ep in self.endpoints
+                      if ep["healthy"] and ep["inflight"] < self._limit(ep) and (url is None or ep["url"] == url)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda ep: (ep["inflight"] / ep["weight"], -ep["weight"], ep["failed"]))
+
+    def acquire(self, timeout=None, url=None):
+        """取得一个服务端槽位。没有健康服务端时立即返回 None, 全部繁忙时等待。
+        url: 优先使用的服务端 (已在该服务端提交了异步任务); 它不在列表中或已下线时任选一个。"""
+        deadline = time.time() + timeout if timeout else None
+        with self.cond:
+            while True:
+                if not any(ep["healthy"] for ep in self.endpoints):
+                    return None
+                preferred = url if any(ep["healthy"] and ep["url"] == url for ep in self.endpoints) else None
+                ep = self._pick(preferred)
+                if ep is not None:
+                    ep["inflight"] += 1
+                    return ep
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining if remaining is not None else 1.0)
+
+    def release(self, ep, success, elapsed, audio_seconds=0, bytes_sent=0, congested=False, measured=True):
+        """success 为 None 表示请求没有结果但也不算失败; congested 表示超时或服务端错误,
+        measured 为 False 表示耗时不完整 (恢复的异步任务), 这两项只用于自适应并发"""
+        with self.cond:
+            ep["inflight"] = max(ep["inflight"] - 1, 0)
+            ep["busy_seconds"] += elapsed
+            ep["bytes_sent"] += bytes_sent
+            if success:
+                ep["completed"] += 1
+                ep["audio_seconds"] += audio_seconds or 0
+            elif success is not None:
+                ep["failed"] += 1
+            if CONFIG.get("ASR_ADAPTIVE_CONCURRENCY"):
+                self._adapt(ep, success, elapsed, audio_seconds if measured else 0, congested)
+            self.cond.notify_all()
+
+    def mark_down(self, ep, error):
+        with self.cond:
+            if ep["healthy"]:
+                print(f"  [ASR] 服务端下线: {ep['url']} ({error})")
+            ep["healthy"] = False
+            self._set_limit(ep, 0, "服务端下线")
+            ep["last_error"] = str(error)[:200]
+            ep["down_since"] = ep["down_since"] or time.time()
+            self.cond.notify_all()
+
+    def mark_up(self, ep):
+        with self.cond:
+            if not ep["healthy"]:
+                print(f"[ASR] 服务端恢复: {ep['url']}")
+            ep["healthy"] = True
+            ep["down_since"] = None
+            self.cond.notify_all()
+
+    def probe_down_endpoints(self):
+        for ep in [ep for ep in self.endpoints if not ep["healthy"]]:
+            if probe_endpoint(ep["url"]):
+                self.mark_up(ep)
+
+    def snapshot(self):
+        with self.cond:
+            uptime_hours = max(time.time() - self.started_at, 1) / 3600
+            result = []
+            for ep in self.endpoints:
+                result.append({
+                    "url": ep["url"],
+                    "weight": ep["weight"],
+                    "max_inflight": ep["max_inflight"],
+                    "limit": self._limit(ep),
+                    "min_inflight": concurrency_floor(ep["max_inflight"]),
+                    # 归一化延迟 (每秒音频耗时多少秒): 最近一次和近期最低值
+                    "latency_recent": round(ep["latency_samples"][-1], 3) if ep["latency_samples"] else None,
+                    "latency_baseline": round(min(ep["latency_samples"]), 3) if ep["latency_samples"] else None,
+                    "limit_history": list(ep["limit_history"])[-20:],
+                    "healthy": ep["healthy"],
+                    "inflight": ep["inflight"],
+                    "completed": ep["completed"],
+                    "failed": ep["failed"],
+                    "audio_seconds": round(ep["audio_seconds"], 1),
+                    "bytes_sent": ep["bytes_sent"],
+                    "codec": get_upload_codec(ep),
+                    "mode": get_asr_mode(ep),
+                    "files_per_hour": round(ep["completed"] / uptime_hours, 2),
+                    # 实时倍率: 每占用 1 秒服务端能处理多少秒音频
+                    "realtime_factor": round(ep["audio_seconds"] / ep["busy_seconds"], 2) if ep["busy_seconds"] else None,
+                    "last_error": ep["last_error"],
+                })
+            return result
+
+def concurrency_floor(max_inflight):
+    return min(max(int(CONFIG.get("ASR_CONCURRENCY_MIN", 1) or 1), 1), max_inflight)
+
+def probe_endpoint(url):
+    try:
+        requests.get(url.replace("/transcribe", "/"), timeout=2)
+        return True
+    except requests.exceptions.RequestException:
+        return False
+
+ASR_POOL = None
+
+def get_asr_pool():
+    global ASR_POOL
+    if ASR_POOL is None:
+        ASR_POOL = EndpointPool(load_endpoint_configs())
+    return ASR_POOL
+
+def start_endpoint_prober():
+    def run():
+        while True:
+            time.sleep(max(float(CONFIG.get("ASR_PROBE_INTERVAL", 15) or 15), 1))
+            try:
+                get_asr_pool().probe_down_endpoints()
+            except Exception as e:
+                print(f"[ASR] 探测服务端失败: {e}")
+    threading.Thread(target=run, name="asr-prober", daemon=True).start()
+
+def write_status():
+    """把服务端状态写入 STATUS_FILE_PATH, 供 web_viewer 展示。"""
+    path = CONFIG.get("STATUS_FILE_PATH")
+    if not path: return
+    endpoints = get_asr_pool().snapshot()
+    status = {
+        "updated_at": datetime.datetime.now().isoformat(),
+        "endpoints": endpoints,
+        "concurrency": concurrency_snapshot(endpoints),
+        "breaker": ASR_BREAKER.snapshot(),
+        "vad": {key: round(value, 1) for key, value in VAD_STATS.items()},
+        "archive": dict(ARCHIVE_STATS),
+        "given_up": given_up_snapshot(),
+        "webhook": dict(WEBHOOK_STATS, pending=count_webhook_pending()),
+        "config": {key: value for key, value in CONFIG_STATE.items() if key != "mtime"},
+        "shutdown": shutdown_snapshot(),
+        "governor": GOVERNOR.snapshot(),
+    }
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"[状态] 写入状态文件失败: {e}")
+
+def concurrency_snapshot(endpoints):
+    """自适应并发汇总: 当前总上限、上下界和最近的调整记录 (按时间合并各服务端)"""
+    history = sorted((dict(item, url=ep["url"]) for ep in endpoints for item in ep["limit_history"]),
+                     key=lambda item: item["time"])
+    return {
+        "adaptive": bool(CONFIG.get("ASR_ADAPTIVE_CONCURRENCY")),
+        "limit": sum(ep["limit"] for ep in endpoints if ep["healthy"]),
+        "min": sum(ep["min_inflight"] for ep in endpoints),
+        "max": sum(ep["max_inflight"] for ep in endpoints),
+        "inflight": sum(ep["inflight"] for ep in endpoints),
+        "history": history[-20:],
+    }
+
+def print_endpoint_stats():
+    for ep in get_asr_pool().snapshot():
+        state = "在线" if ep["healthy"] else "离线"
+        rtf = f"{ep['realtime_factor']}x" if ep["realtime_factor"] else "-"
+        print(f"  [ASR] {ep['url']} {state} 完成 {ep['completed']} 失败 {ep['failed']} "
+              f"音频 {format_duration(ep['audio_seconds'])} 实时倍率 {rtf} 并发上限 {ep['limit']}/{ep['max_inflight']}")
+
+# ---------------- 熔断器 ----------------
+class ASRUnavailable(Exception):
+    """服务端整体不可用 (而不是某个文件本身的问题), 已转换的音频应保留。"""
+
+class CircuitBreaker:
+    """连续失败达到阈值后断开, 按指数退避暂停; 到期后先做一次轻量探测, 通过后放行一个试探任务。"""
+
+    def __init__(self, probe):
+        self.lock = threading.Lock()
+        self.probe = probe
+        self.state = "closed"
+        self.failures = 0
+        self.backoff = 0
+        self.open_until = 0
+        self.trial_running = False
+
+    def _settings(self):
+        threshold = max(int(CONFIG.get("ASR_BREAKER_THRESHOLD", 3) or 3), 1)
+        base = max(float(CONFIG.get("ASR_BREAKER_BASE_BACKOFF", 10) or 10), 1)
+        limit = max(float(CONFIG.get("ASR_BREAKER_MAX_BACKOFF", 600) or 600), base)
+        return threshold, base, limit
+
+    def _open(self, reason):
+        _, base, limit = self._settings()
+        self.backoff = min(self.backoff * 2, limit) if self.backoff else base
+        self.state = "open"
+        self.open_until = time.time() + self.backoff
+        self.trial_running = False
+        print(f"[熔断] ASR 服务不可用 ({reason})，暂停 {int(self.backoff)}s")
+
+    def allow(self):
+        """是否可以开始一个新任务 (包括音频转换)。"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "half_open":
+                if self.trial_running:
+                    return False
+                self.trial_running = True
+                return True
+            if time.time() < self.open_until:
+                return False
+        # 探测不持有锁, 避免阻塞其它线程
+        healthy = self.probe()
+        with self.lock:
+            if self.state != "open":
+                return False
+            if not healthy:
+                self._open("探测失败")
+                return False
+            print("[熔断] 探测成功，放行一个试探任务")
+            self.state = "half_open"
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print("[熔断] ASR 服务恢复正常")
+            self.state = "closed"
+            self.failures = 0
+            self.backoff = 0
+            self.trial_running = False
+
+    def record_failure(self, reason):
+        with self.lock:
+            self.failures += 1
+            threshold, _, _ = self._settings()
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= threshold):
+                self._open(reason)
+
+    def end_trial(self):
+        """试探任务没走到上传 (如转换失败) 就结束时, 让下一个任务继续试探。"""
+        with self.lock:
+            if self.state == "half_open":
+                self.trial_running = False
+
+    def is_open(self):
+        """仍处于暂停期 (不触发探测)。"""
+        return self.state == "open" and time.time() < self.open_until
+
+    def remaining(self):
+        return max(self.open_until - time.time(), 0) if self.state == "open" else 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "backoff": self.backoff,
+                "retry_in": round(self.remaining(), 1),
+            }
+
+def probe_asr_service():
+    """熔断器的健康探测: 任意一个服务端能响应即可。"""
+    pool = get_asr_pool()
+    pool.probe_down_endpoints()
+    return any(ep["healthy"] for ep in pool.endpoints)
+
+ASR_BREAKER = CircuitBreaker(probe_asr_service)
+
+# ---------------- 异步任务模式 ----------------
+# 协议: POST <服务端>/jobs (表单与 /transcribe 相同) 返回 {"job_id": "..."};
+# GET <服务端>/jobs/<job_id>?wait=秒 (长轮询) 返回 {"status": "queued|running|done|failed", "result": {...}, "error": "..."};
+# 服务端不认识该任务时返回 404。<服务端> 为服务端地址去掉末尾的 /transcribe。见 asr_stub_server.py。
+# 轮询连续出错多少次后认为服务端不可用 (任务编号保留, 恢复后继续取结果)
+ASR_POLL_MAX_ERRORS = 8
+
+class AsyncJobLost(Exception):
+    """服务端没有这个任务 (例如服务端重启), 需要重新提交"""
+
+class JobDetached(Exception):
+    """正在退出: 任务留在服务端继续转录, 重启后凭保存的任务编号取回结果"""
+
+def get_asr_mode(endpoint=None):
+    mode = (endpoint or {}).get("mode") or CONFIG.get("ASR_MODE") or "sync"
+    return "async" if str(mode).lower() == "async" else "sync"
+
+def jobs_url(url):
+    base = url[:-len("/transcribe")] if url.endswith("/transcribe") else url.rstrip("/")
+    return base + "/jobs"
+
+def source_identity(audio_path):
+    """源文件身份 (大小 + 修改时间); 文件被替换后, 之前提交的任务作废"""
+    st = os.stat(audio_path)
+    return f"{st.st_size}|{st.st_mtime_ns}"
+
+# asr_jobs 表的读写语句, check_db.py 直接引用检查执行计划
+ASR_JOB_SAVE_SQL = "INSERT OR REPLACE INTO asr_jobs (filename, identity, endpoint, job_id, codec, status) VALUES (?, ?, ?, ?, ?, 'submitted')"
+ASR_JOB_LOAD_SQL = "SELECT identity, endpoint, job_id, codec FROM asr_jobs WHERE filename = ?"
+ASR_JOB_UPDATE_SQL = "UPDATE asr_jobs SET status = ?, polled_at = CURRENT_TIMESTAMP WHERE filename = ?"
+ASR_JOB_DELETE_SQL = "DELETE FROM asr_jobs WHERE filename = ?"
+ASR_JOB_LIST_SQL = "SELECT filename FROM asr_jobs"
+
+def _asr_jobs_execute(sql, params=(), fetch=False):
+    conn = sqlite3.connect(CONFIG["DB_PATH"], timeout=30)
+    try:
+        with conn:
+            cursor = conn.execute(sql, params)
+            return cursor.fetchone() if fetch else None
+    finally:
+        conn.close()
+
+def save_asr_job(audio_path, endpoint_url, job_id, codec):
+    try:
+        _asr_jobs_execute(
+            ASR_JOB_SAVE_SQL,
+            (os.path.basename(audio_path), source_identity(audio_path), endpoint_url, job_id, codec))
+    except Exception as e:
+        # 只影响重启后能否继续取结果, 不影响本次转录
+        print(f"  [ASR] 保存任务编号失败: {e}")
+
+def load_asr_job(audio_path):
+    try:
+        row = _asr_jobs_execute(ASR_JOB_LOAD_SQL, (os.path.basename(audio_path),), fetch=True)
+        if row is None:
+            return None
+        if row[0] != source_identity(audio_path):
+            delete_asr_job(audio_path)
+            return None
+    except Exception as e:
+        print(f"  [ASR] 读取任务编号失败: {e}")
+        return None
+    return {"endpoint": row[1], "job_id": row[2], "codec": row[3]}
+
+def update_asr_job(audio_path, status):
+    try:
+        _asr_jobs_execute(ASR_JOB_UPDATE_SQL, (status, os.path.basename(audio_path)))
+    except Exception:
+        pass
+
+def delete_asr_job(audio_path):
+    try:
+        _asr_jobs_execute(ASR_JOB_DELETE_SQL, (os.path.basename(audio_path),))
+    except Exception as e:
+        print(f"  [ASR] 删除任务编号失败: {e}")
+
+def pending_asr_job_files():
+    """已提交但还没取回结果的文件"""
+    try:
+        conn = sqlite3.connect(CONFIG["DB_PATH"])
+        try:
+            return [row[0] for row in conn.execute(ASR_JOB_LIST_SQL)]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+
+def poll_async_job(endpoint, job_id, audio_path):
+    """长轮询直到任务完成, 返回结果 (失败时为 {"error": ...})。
+    服务端暂时连不上时退避重试, 连续出错过多抛出 ASRUnavailable; 正在退出时抛出 JobDetached。"""
+    url = f"{jobs_url(endpoint['url'])}/{job_id}"
+    wait_seconds = max(int(CONFIG.get("ASR_POLL_WAIT", 30) or 0), 0)
+    deadline = time.time() + float(CONFIG.get("ASR_JOB_TIMEOUT", 21600) or 21600)
+    errors = 0
+    last_status = None
+    while True:
+        if SHUTDOWN.is_set():
+            raise JobDetached(job_id)
+        if time.time() > deadline:
+            delete_asr_job(audio_path)
+            return {"error": f"任务 {job_id} 超过 {int(float(CONFIG.get('ASR_JOB_TIMEOUT', 21600)))}s 仍未完成"}
+        polled = time.time()
+        try:
+            response = requests.get(url, params={"wait": wait_seconds}, timeout=wait_seconds + 30)
+            if response.status_code == 404:
+                raise AsyncJobLost(job_id)
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.RequestException as e:
+            errors += 1
+            if errors >= ASR_POLL_MAX_ERRORS:
+                ASR_BREAKER.record_failure("轮询失败")
+                raise ASRUnavailable(f"轮询任务 {job_id} 失败: {e}")
+            print(f"  [ASR] 轮询任务 {job_id} 出错 ({e})，{min(2 ** errors, 60)}s 后重试")
+            SHUTDOWN.wait(min(2 ** errors, 60))
+            continue
+        errors = 0
+        status = data.get("status")
+        if status == "done":
+            return data.get("result") or {"error": "任务完成但没有结果"}
+        if status in ("failed", "error"):
+            delete_asr_job(audio_path)
+            return {"error": data.get("error") or f"任务 {job_id} 失败"}
+        if status != last_status:
+            print(f"  [ASR] 任务 {job_id}: {status}")
+            update_asr_job(audio_path, status)
+            last_status = status
+        # 服务端不支持长轮询 (立即返回) 时, 按间隔轮询
+        if time.time() - polled < 1:
+            SHUTDOWN.wait(min(max(wait_seconds, 1), 5))
+
 # ---------------- 调用服务端 ----------------
-def transcribe_wav(wav_path):
-    url = CONFIG["ASR_API_URL"]
+def fallback_to_wav(endpoint, codec, reason):
+    """服务端第一次收到压缩格式就失败时, 认为它不支持该格式, 之后改传 wav。"""
+    if codec == "wav" or endpoint["codec_verified"]:
+        return False
+    print(f"  [ASR] 服务端 {endpoint['url']} 不支持 {codec} ({reason})，改用 wav 上传")
+    endpoint["codec"] = "wav"
+    return True
+
+def transcribe_audio(prepare_upload, audio_seconds=None, audio_path=None):
+    """prepare_upload(codec) 返回该格式的待上传文件路径 (转换失败返回 None)。
+    返回转录结果; 文件本身处理失败返回 None; 服务端不可用、超时或传输出错时抛出 ASRUnavailable。
+    audio_seconds: 上传音频的时长 (VAD 裁剪后的时长), 用于自适应并发和实时倍率统计。
+    audio_path: 源文件, async 模式据此保存和恢复任务编号。"""
+    pool = get_asr_pool()
     max_retries = 3
+    # 上次 (可能是重启前) 已提交、还没取回结果的异步任务
+    pending_job = load_asr_job(audio_path) if audio_path else None
     for attempt in range(max_retries):
+        endpoint = pool.acquire(timeout=3600, url=pending_job["endpoint"] if pending_job else None)
+        if endpoint is None:
+            ASR_BREAKER.record_failure("没有可用的服务端")
+            raise ASRUnavailable("没有可用的服务端")
+        url = endpoint["url"]
+        codec = get_upload_codec(endpoint)
+        started = time.time()
+        success = False
+        upload_bytes = 0
+        # 超时或服务端错误, 自适应并发据此降低上限
+        congested = False
+        # 耗时是否反映了完整的一次转录 (恢复的异步任务只等了后半段)
+        measured = True
         try:
-            with open(wav_path, 'rb') as f:
-                files = {'audio_file': (os.path.basename(wav_path), f, 'audio/wav')}
+            if pending_job and pending_job["endpoint"] == url:
+                job = pending_job
+                pending_job = None
+                measured = False
+                print(f"  [ASR] 继续等待已提交的任务 {job['job_id']} -> {url}")
+                try:
+                    data = poll_async_job(endpoint, job["job_id"], audio_path)
+                except AsyncJobLost:
+                    print(f"  [ASR] 服务端已没有任务 {job['job_id']}，重新提交")
+                    delete_asr_job(audio_path)
+                    data = None
+                if data is not None:
+                    ASR_BREAKER.record_success()
+                    if "error" in data:
+                        print(f"  [Server Error] {data['error']}")
+                        return None
+                    success = "full_text" in data
+                    return data if success else None
+            pending_job = None
+            measured = True
+            upload_path = prepare_upload(codec)
+            if not upload_path:
+                return None
+            upload_bytes = os.path.getsize(upload_path)
+            ext, mime, _ = UPLOAD_CODECS[codec]
+            asynchronous = get_asr_mode(endpoint) == "async" and audio_path
+            target = jobs_url(url) if asynchronous else url
+            # 服务端看到的是原录音文件名 (扩展名与上传格式一致), 缓存中的哈希文件名只在本地使用
+            upload_name = os.path.splitext(os.path.basename(audio_path or upload_path))[0] + ext
+            # 在表单中声明上传格式, 服务端可据此选择解码方式
+            body = UploadBody(upload_path, 'audio_file', upload_name, mime,
+                              {'format': codec, 'sample_rate': '16000'})
+            try:
                 if attempt > 0:
-                    print(f"  网络波动，正在重试 ({attempt+1}/{max_retries})...")
+                    print(f"  正在重试 ({attempt+1}/{max_retries}) -> {target}")
+                elif asynchronous:
+                    print(f"  正在上传 {upload_bytes / 1024 / 1024:.1f} MB ({codec}) 并提交转录任务 -> {target}")
                 else:
-                    print(f"  正在上传并等待转录结果 (超时: 3600s)...")
-                response = requests.post(url, files=files, timeout=3600)
+                    print(f"  正在上传 {upload_bytes / 1024 / 1024:.1f} MB ({codec}) 并等待转录结果 (超时: 3600s) -> {url}")
+                # 异步提交只需等上传完成, 不必等转录
+                response = requests.post(target, data=body, headers={'Content-Type': body.content_type},
+                                         timeout=(10, 600) if asynchronous else 3600)
+            finally:
+                body.close()
+            if response.status_code >= 400 and fallback_to_wav(endpoint, codec, f"HTTP {response.status_code}"):
+                continue
+            if response.status_code >= 500:
+                ASR_BREAKER.record_failure(f"HTTP {response.status_code}")
+                raise ASRUnavailable(f"{response.status_code} Server Error for url: {target}")
             response.raise_for_status()
             data = response.json()
+            if asynchronous and "error" not in data:
+                job_id = str(data.get("job_id") or "")
+                if not job_id:
+                    print(f"  [Server Error] 提交任务没有返回 job_id: {str(data)[:200]}")
+                    return None
+                save_asr_job(audio_path, url, job_id, codec)
+                print(f"  [ASR] 已提交任务 {job_id}，等待结果")
+                try:
+                    data = poll_async_job(endpoint, job_id, audio_path)
+                except AsyncJobLost:
+                    # 刚提交就丢失, 说明服务端刚刚重启, 按服务端错误重试
+                    delete_asr_job(audio_path)
+                    ASR_BREAKER.record_failure("任务丢失")
+                    raise ASRUnavailable(f"服务端丢失了任务 {job_id}")
+            ASR_BREAKER.record_success()
             if "error" in data:
+                if fallback_to_wav(endpoint, codec, data['error']):
+                    continue
                 print(f"  [Server Error] {data['error']}")
                 return None
-            return data if "full_text" in data else None
-        except requests.exceptions.ConnectionError:
-            print(f"  [Connection Error] 无法连接服务端，等待 5秒 后重试...")
-            time.sleep(5)
+            success = "full_text" in data
+            if success:
+                endpoint["codec_verified"] = True
+            return data if success else None
+        except requests.exceptions.ConnectionError as e:
+            print(f"  [Connection Error] 无法连接服务端 {url}，换用其他服务端重试...")
+            pool.mark_down(endpoint, e)
         except requests.exceptions.Timeout:
             print(f"  [Timeout] 请求超时，服务端仍在处理。")
-            return None
+            ASR_BREAKER.record_failure("请求超时")
+            congested = True
+            # 超时多半是服务端繁忙, 不是文件本身的问题, 不计入该文件的失败次数
+            raise ASRUnavailable("请求超时")
+        except JobDetached:
+            # 任务仍在服务端运行, 不算失败
+            success = None
+            raise
+        except ASRUnavailable:
+            congested = True
+            raise
         except Exception as e:
             print(f"  [Request Error] {e}")
+            if isinstance(e, requests.exceptions.RequestException) and not isinstance(e, requests.exceptions.HTTPError):
+                # 传输中断或响应无法解析, 属于服务端或网络问题, 不计入该文件的失败次数
+                congested = True
+                raise ASRUnavailable(str(e))
             return None
-    print("  [Failed] 重试次数耗尽，跳过此文件")
-    return None
+        finally:
+            pool.release(endpoint, success, time.time() - started, audio_seconds, upload_bytes,
+                         congested=congested, measured=measured)
+    ASR_BREAKER.record_failure("重试次数耗尽")
+    raise ASRUnavailable("重试次数耗尽")
 
 # ---------------- 处理循环 ----------------
+class PreparedAudio:
+    """一个待转录文件在各上传格式下的音频 (含 VAD 裁剪), 中间结果都放在转换缓存中。"""
+
+    def __init__(self, audio_path):
+        self.audio_path = audio_path
+        self.cache_paths = []
+        self.uploads = {}
+        self.vad_plan = None
+        self.trimmed_path = None
+        self.trimmed_variant = ""
+        self.vad_checked = False
+        self.decoded = None
+        self.pcm = None
+
+    def _cache_path(self, codec, variant=""):
+        path = get_cache_path(self.audio_path, codec, variant)
+        self.cache_paths.append(path)
+        return path
+
+    def decoded_wav(self):
+        """16kHz 单声道 WAV, 只解码一次, VAD、波形峰值和上传转换共用"""
+        if self.decoded is None:
+            if is_upload_ready(self.audio_path, "wav"):
+                self.decoded = self.audio_path
+            else:
+                path = self._cache_path("wav")
+                self.decoded = path if convert_audio(self.audio_path, path, "wav") else ""
+        return self.decoded or None
+
+    def load_pcm(self):
+        if self.pcm is None:
+            wav_path = self.decoded_wav()
+            self.pcm = open_pcm(wav_path) if wav_path else None
+        return self.pcm
+
+    def plan_vad(self):
+        """在 16kHz PCM 上做静音检测, 得到裁剪方案 (时间戳映射), 不生成裁剪文件。"""
+        if self.vad_checked:
+            return
+        self.vad_checked = True
+        pcm = self.load_pcm()
+        if pcm is None:
+            return
+        started = time.time()
+        plan = VadPlan(detect_voiced_regions(pcm), len(pcm))
+        total = format_duration(plan.total_samples / SAMPLE_RATE)
+        kept = format_duration(plan.kept_samples / SAMPLE_RATE)
+        print(f"  [VAD] 静音占比 {plan.removed_ratio:.1%} ({total} -> {kept}, 耗时 {time.time() - started:.1f}s)")
+        VAD_STATS["files"] += 1
+        VAD_STATS["total_seconds"] += plan.total_samples / SAMPLE_RATE
+        if not plan.regions:
+            # 多半是音量很低的录音被误判, 上传完整音频, 由服务端决定有没有内容
+            print("  [VAD] 警告: 没有检测到语音 (录音音量可能过低)，上传未裁剪的完整音频")
+            VAD_STATS["no_speech"] += 1
+            return
+        if plan.removed_ratio < float(CONFIG.get("VAD_MIN_REMOVED_RATIO", 0.1) or 0):
+            return
+        VAD_STATS["removed_seconds"] += (plan.total_samples - plan.kept_samples) / SAMPLE_RATE
+        self.vad_plan = plan
+        # 裁剪结果随 VAD 参数变化, 缓存名中带上区间的摘要, 参数热加载后不会复用旧的裁剪文件
+        self.trimmed_variant = ".vad-" + hashlib.sha1(repr(plan.regions).encode('ascii')).hexdigest()[:8]
+
+    def run_vad(self):
+        """静音检测, 值得裁剪时生成只含语音的 WAV。"""
+        self.plan_vad()
+        if self.vad_plan is None or self.trimmed_path:
+            return
+        self.trimmed_path = self._cache_path("wav", self.trimmed_variant)
+        if not os.path.exists(self.trimmed_path):
+            write_regions_wav(self.pcm, self.vad_plan.regions, self.trimmed_path)
+
+    def upload_path(self, codec):
+        """返回该格式的待上传文件路径, 转换失败返回 None。"""
+        if codec in self.uploads:
+            return self.uploads[codec]
+        if vad_available():
+            self.run_vad()
+        if self.trimmed_path:
+            source, variant = self.trimmed_path, self.trimmed_variant
+        elif self.decoded:
+            # VAD 或波形峰值已经解码过的 WAV 比原始文件转换更快
+            source, variant = self.decoded, ""
+        else:
+            source, variant = self.audio_path, ""
+        if is_upload_ready(source, codec):
+            if source == self.audio_path:
+                print(f"  [Convert] 源文件已是 16kHz 单声道 {codec}，直接上传")
+            path = source
+        else:
+            path = self._cache_path(codec, variant)
+            if not convert_audio(source, path, codec):
+                path = None
+        self.uploads[codec] = path
+        return path
+
+    def peaks(self):
+        """波形峰值; VAD 已经打开 PCM 时直接复用, 否则解码一次, 之后的上传转换也从这份 WAV 开始。"""
+        pcm = self.load_pcm()
+        return compute_peaks(pcm) if pcm is not None else None
+
+    def remap_segments(self, segments):
+        return self.vad_plan.remap_segments(segments) if self.vad_plan else segments
+
+    def cleanup(self):
+        self.pcm = None
+        for path in self.cache_paths:
+            if os.path.exists(path): os.remove(path)
+
+VAD_STATS = {"files": 0, "total_seconds": 0.0, "removed_seconds": 0.0, "no_speech": 0}
+
+def process_file(job):
+    filename = job["filename"]
+    print(f"\n>>> 处理: {filename} (时长 {format_duration(job['duration'])}, 已等待 {int(job['waited'])}s)")
+    audio_path = job["path"]
+    base_name = os.path.splitext(filename)[0]
+    txt_path = os.path.join(CONFIG["TRANSCRIPT_DIR"], f"{base_name}.txt")
+    processed_audio_path = os.path.join(CONFIG["PROCESSED_DIR"], filename)
+    # 各上传格式的转换结果, 服务端要求换格式时才会再转换一次
+    audio = PreparedAudio(audio_path)
+    success = False
+    # 只有音频转换失败和服务端拒绝该文件才计入失败次数
+    failure_reason = None
+    try:
+        job["stage"] = "converting"
+        resuming = load_asr_job(audio_path) is not None
+        if resuming:
+            # 重启前提交的任务还在服务端: 直接轮询结果, 只重建时间戳映射所需的 VAD 方案;
+            # 任务丢失需要重新提交时, 上传文件由 transcribe_audio 按需转换
+            print("  [ASR] 服务端已有该文件的任务，直接取回结果")
+            if vad_available():
+                audio.plan_vad()
+        # 波形峰值在转换阶段算好, 与 VAD 和上传转换共用一次解码; 入库阶段只写文件, 不拖长退出时的等待
+        peaks = None
+        if np is not None and CONFIG.get("PEAKS_ENABLED"):
+            try:
+                peaks = audio.peaks()
+            except Exception as e:
+                print(f"  [Peaks] 波形峰值生成失败: {e}")
+        # 先按默认格式转换好, 避免占着服务端槽位等待 ffmpeg
+        if not resuming and not audio.upload_path(get_upload_codec()):
+            failure_reason = "音频转换失败"
+            return False
+        job["stage"] = "transcribing"
+        # 自适应并发的归一化延迟和实时倍率按服务端实际处理的时长计算, VAD 裁剪后比原始录音短
+        upload_seconds = audio.vad_plan.kept_samples / SAMPLE_RATE if audio.vad_plan else job["duration"]
+        result_data = transcribe_audio(audio.upload_path, upload_seconds, audio_path)
+        if not result_data:
+            failure_reason = "转录失败"
+            return False
+        full_text = result_data.get("full_text", "")
+        segments = audio.remap_segments(result_data.get("segments", []))
+        filtered_segments = [seg for seg in segments if seg.get("text","").strip()]
+        # 从这里到归档完成之间退出会导致重复入库, 排空超时时也要等这一步结束
+        job["stage"] = "saving"
+        save_transcript_with_spk(full_text, filtered_segments, txt_path)
+        if peaks:
+            try:
+                save_peaks(peaks, os.path.join(CONFIG["TRANSCRIPT_DIR"], f"{base_name}.peaks.json"))
+            except Exception as e:
+                print(f"  [Peaks] 波形峰值保存失败: {e}")
+        events = [("success", full_text[:100])]
+        matched = get_alert_engine().scan(filtered_segments)
+        if matched:
+            print(f"  [提醒] 命中 {len(matched)} 处: " + ", ".join(f"{a['rule']}/{a['term']}@{a['start_fmt']}" for a in matched[:5]))
+            events.append(("alert", {"alerts": matched}))
+        if not save_to_db(filename, full_text, filtered_segments, events):
+            # 没有入库就不归档, 下次重试; 转换缓存和异步任务编号都还在, 重试不必重新转录
+            print("  [跳过] 写入数据库失败，保留源文件稍后重试")
+            return False
+        delete_asr_job(audio_path)
+        if os.path.exists(processed_audio_path): os.remove(processed_audio_path)
+        os.rename(audio_path, processed_audio_path)
+        print(f"  [完成] 已归档 -> {processed_audio_path} (入队至完成 {int(job['waited'] + time.time() - job['started'])}s)")
+        success = True
+        return True
+    except ASRUnavailable as e:
+        # 服务端不可用: 转换结果留在缓存中, 恢复后直接上传
+        print(f"  [跳过] ASR 服务不可用 ({e})，已转换音频保留在缓存中")
+        return False
+    except JobDetached as e:
+        print(f"  [退出] 任务 {e} 留在服务端继续转录，重启后取回结果")
+        return False
+    except Exception as e:
+        print(f"  [异常] {e}")
+        return False
+    finally:
+        # 只有成功归档后才删除缓存; 失败的文件下次重试时不必再次解码
+        if success:
+            audio.cleanup()
+            _FAILURES.pop(filename, None)
+        elif failure_reason and not SHUTDOWN.is_set():
+            record_job_failure(audio_path, failure_reason)
+        job["stage"] = "done"
+        ASR_BREAKER.end_trial()
+
+# 同时处理的文件数上限 (线程池大小); 实际并发为所有服务端的 max_inflight 之和
+MAX_JOB_WORKERS = 32
+
 def process_one_loop():
     processed_count = 0
+    if SHUTDOWN.is_set():
+        return 0
     if not os.path.exists(CONFIG["SOURCE_DIR"]):
         print(f"源目录不存在: {CONFIG['SOURCE_DIR']}")
         return 0
-    files = [f for f in os.listdir(CONFIG["SOURCE_DIR"]) if f.lower().endswith(SUPPORTED_EXTENSIONS)]
-    if not files: return 0
-    print(f"发现 {len(files)} 个新文件，开始处理...")
+    jobs = scan_pending_jobs()
+    if not jobs: return 0
+    # 熔断期间不做任何转换, 避免空耗 NAS 的 CPU 和磁盘
+    if ASR_BREAKER.is_open():
+        return 0
+    print(f"发现 {len(jobs)} 个新文件，开始处理 (策略: {CONFIG.get('QUEUE_POLICY')})...")
     os.makedirs(CONFIG["TRANSCRIPT_DIR"], exist_ok=True)
     os.makedirs(CONFIG["PROCESSED_DIR"], exist_ok=True)
-    for filename in files:
-        print(f"\n>>> 处理: {filename}")
-        audio_path = os.path.join(CONFIG["SOURCE_DIR"], filename)
-        base_name = os.path.splitext(filename)[0]
-        wav_path = os.path.join(CONFIG["SOURCE_DIR"], f"{base_name}_TEMP.wav")
-        txt_path = os.path.join(CONFIG["TRANSCRIPT_DIR"], f"{base_name}.txt")
-        processed_audio_path = os.path.join(CONFIG["PROCESSED_DIR"], filename)
+    os.makedirs(get_convert_dir(), exist_ok=True)
+    attempted = set()
+    running = {}
+    # 线程按需创建, 实际并发由下面的 workers 控制
+    with ThreadPoolExecutor(max_workers=MAX_JOB_WORKERS, thread_name_prefix="job") as executor:
+        while True:
+            # 任务之间检查 config.json; 路径类修改等在途任务全部完成后才应用
+            if reload_config(idle=not running) & PATH_CONFIG_KEYS:
+                # 目录变了, 回到主循环按新目录重新扫描
+                break
+            # 并发数等于所有服务端的在途上限之和, 配置修改后随之变化
+            workers = min(max(get_asr_pool().capacity(), 1), MAX_JOB_WORKERS)
+            # 每次有空闲 worker 时重新扫描排序, 新到的短录音可以插队; 有待应用的路径修改时不再开始新任务
+            while len(running) < workers and not CONFIG_STATE["pending"] and not SHUTDOWN.is_set():
+                if jobs is None:
+                    jobs = [j for j in scan_pending_jobs() if j["filename"] not in attempted]
+                if not jobs: break
+                if not ASR_BREAKER.allow():
+                    if ASR_BREAKER.is_open():
+                        print(f"[熔断] 暂停处理剩余 {len(jobs)} 个文件，{int(ASR_BREAKER.remaining())}s 后重试")
+                    break
+                job = jobs.pop(0)
+                jobs = None
+                attempted.add(job["filename"])
+                RESUMED_FILES.discard(job["filename"])
+                job["started"] = time.time()
+                job["first_seen"] = _FIRST_SEEN.get(job["filename"], job["started"])
+                ACTIVE_JOBS[job["filename"]] = job
+                running[executor.submit(process_file, job)] = job
+            if not running: break
+            done = set()
+            while not done:
+                done, _ = wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                if not done and drain_expired():
+                    abandon_active_jobs(f"等待在途任务超过 {int(float(CONFIG.get('SHUTDOWN_DRAIN_SECONDS', 900) or 0))}s")
+            for future in done:
+                ACTIVE_JOBS.pop(running.pop(future)["filename"], None)
+                if future.result():
+                    processed_count += 1
+            write_status()
+            jobs = None
+    prune_convert_cache()
+    print_endpoint_stats()
+    write_status()
+    return processed_count
+
+# ---------------- 归档压缩 ----------------
+ARCHIVE_STATS = {"compacted": 0, "saved_bytes": 0}
+
+def has_pending_files():
+    """源目录中有需要转录的文件; 已达到失败次数上限的文件不算, 否则一个坏文件会让后台维护永远无法开始"""
+    source_dir = CONFIG["SOURCE_DIR"]
+    try:
+        names = os.listdir(source_dir)
+    except OSError:
+        return False
+    return any(name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.endswith("_TEMP.wav")
+               and not job_given_up(name, os.path.join(source_dir, name)) for name in names)
+
+def low_priority_prefix():
+    """nice / ionice 前缀, 让归档压缩只使用空闲的 CPU 和磁盘。"""
+    return priority_prefix(19, 3)
+
+# archive_compaction 表的读写语句, check_db.py 直接引用检查执行计划
+COMPACTION_RECORD_SQL = "INSERT OR REPLACE INTO archive_compaction (filename, archived_name, status, original_bytes, compacted_bytes) VALUES (?, ?, ?, ?, ?)"
+COMPACTION_HANDLED_SQL = "SELECT filename, archived_name FROM archive_compaction"
+
+def record_compaction(filename, status, archived_name=None, original_bytes=None, compacted_bytes=None):
+    conn = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        with conn:
+            conn.execute(COMPACTION_RECORD_SQL, (filename, archived_name, status, original_bytes, compacted_bytes))
+    finally:
+        conn.close()
+
+def next_compaction_candidate():
+    processed_dir = CONFIG["PROCESSED_DIR"]
+    if not os.path.isdir(processed_dir):
+        return None
+    conn = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        # 压缩后的 .opus 以 archived_name 记录, 同样不再处理
+        handled = set()
+        for filename, archived_name in conn.execute(COMPACTION_HANDLED_SQL):
+            handled.update((filename, archived_name))
+    finally:
+        conn.close()
+    min_age = float(CONFIG.get("ARCHIVE_COMPACT_MIN_AGE_DAYS", 7) or 0) * 86400
+    now = time.time()
+    candidates = []
+    for name in os.listdir(processed_dir):
+        if name in handled or not name.lower().endswith(SUPPORTED_EXTENSIONS):
+            continue
+        path = os.path.join(processed_dir, name)
         try:
-            if not convert_audio_to_wav(audio_path, wav_path): continue
-            result_data = transcribe_wav(wav_path)
-            if not result_data: continue
-            full_text = result_data.get("full_text", "")
-            segments = result_data.get("segments", [])
-            filtered_segments = [seg for seg in segments if seg.get("text","").strip()]
-            save_transcript_with_spk(full_text, filtered_segments, txt_path)
-            save_to_db(filename, full_text, filtered_segments)
-            if os.path.exists(processed_audio_path): os.remove(processed_audio_path)
-            os.rename(audio_path, processed_audio_path)
-            print(f"  [完成] 已归档 -> {processed_audio_path}")
-            notify_n8n("success", filename, full_text[:100])
-            processed_count += 1
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime >= min_age:
+            candidates.append((st.st_size, name))
+    # 先压缩最大的文件, 尽快腾出空间
+    return max(candidates)[1] if candidates else None
+
+def compact_archive_step():
+    """压缩一个归档文件。有新文件进入队列时立即中止, 原文件保持不变。"""
+    if has_pending_files():
+        return False
+    filename = next_compaction_candidate()
+    if not filename:
+        return False
+    processed_dir = CONFIG["PROCESSED_DIR"]
+    src_path = os.path.join(processed_dir, filename)
+    stem = os.path.splitext(filename)[0]
+    out_name = f"{stem}.opus"
+    out_path = os.path.join(processed_dir, out_name)
+    part_path = out_path + ".part"
+    original_bytes = os.path.getsize(src_path)
+    # 码率判断和时长校验都必须基于实测时长; 按文件大小估算的时长不可信, 这时不压缩
+    duration = measure_duration(src_path)
+    if not duration:
+        print(f"[归档压缩] 无法测量 {filename} 的时长，保留原文件")
+        record_compaction(filename, "failed", filename, original_bytes)
+        return True
+    bitrate = str(CONFIG.get("ARCHIVE_COMPACT_BITRATE") or "24k")
+    target_bps = float(bitrate.rstrip('kK')) * 1000 if bitrate[-1:] in 'kK' else float(bitrate)
+    min_saving = float(CONFIG.get("ARCHIVE_COMPACT_MIN_SAVING", 0.2) or 0)
+    # 原文件码率已经不高于目标码率, 重新编码没有意义
+    if original_bytes * 8 / duration <= target_bps / (1 - min_saving):
+        record_compaction(filename, "skipped", filename, original_bytes, original_bytes)
+        return True
+    command = low_priority_prefix() + [
+        FFMPEG_PATH, '-y', '-threads', '1', '-i', src_path, '-vn', '-map', '0:a',
+        '-c:a', 'libopus', '-b:a', bitrate, '-application', 'voip', '-f', 'ogg', part_path
+    ]
+    print(f"[归档压缩] {filename} ({original_bytes / 1024 / 1024:.1f} MB) -> Opus {bitrate}")
+    try:
+        proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while proc.poll() is None:
+            if has_pending_files() or SHUTDOWN.is_set():
+                proc.kill()
+                proc.wait()
+                print("[归档压缩] 有新文件需要转录或正在退出，中止压缩")
+                return False
+            time.sleep(0.5)
+        if proc.returncode != 0 or not os.path.exists(part_path):
+            print(f"[归档压缩] ffmpeg 失败 (返回码 {proc.returncode})")
+            record_compaction(filename, "failed", filename, original_bytes)
+            return True
+        compacted_bytes = os.path.getsize(part_path)
+        # 校验: 时长一致 (误差 1 秒或 1% 以内)
+        new_duration = measure_duration(part_path)
+        if not new_duration or abs(new_duration - duration) > max(1.0, duration * 0.01):
+            measured = f"{new_duration:.1f}s" if new_duration else "无法测量"
+            print(f"[归档压缩] 时长校验失败 ({duration:.1f}s -> {measured})，保留原文件")
+            record_compaction(filename, "failed", filename, original_bytes)
+            return True
+        if compacted_bytes > original_bytes * (1 - min_saving):
+            record_compaction(filename, "skipped", filename, original_bytes, original_bytes)
+            return True
+        if os.path.exists(out_path) and out_path != src_path:
+            print(f"[归档压缩] 目标文件已存在: {out_name}，跳过")
+            record_compaction(filename, "failed", filename, original_bytes)
+            return True
+        # 先落地新文件并记录, 再删除原文件; 任一步中断都不会丢失音频
+        os.replace(part_path, out_path)
+        record_compaction(filename, "compacted", out_name, original_bytes, compacted_bytes)
+        if out_path != src_path:
+            os.remove(src_path)
+        ARCHIVE_STATS["compacted"] += 1
+        ARCHIVE_STATS["saved_bytes"] += original_bytes - compacted_bytes
+        print(f"[归档压缩] 完成 {filename} -> {out_name}，节省 {(original_bytes - compacted_bytes) / 1024 / 1024:.1f} MB")
+        return True
+    except Exception as e:
+        print(f"[归档压缩] 出错: {e}")
+        return False
+    finally:
+        if os.path.exists(part_path): os.remove(part_path)
+
+def compress_partition_step():
+    """压缩一个超过 DB_PARTITION_COMPRESS_MONTHS 个月的分区, 没有到期分区时返回 False"""
+    conn = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        return partitions.compress_step(conn, CONFIG.get("DB_PARTITION_COMPRESS_MONTHS", 3)) is not None
+    except Exception as e:
+        print(f"[分区] 压缩失败: {e}")
+        return False
+    finally:
+        conn.close()
+
+# ---------------- 配置热加载 ----------------
+# 这些配置改变后, 在途任务仍在使用旧路径, 只在没有在途任务时应用
+PATH_CONFIG_KEYS = {"SOURCE_DIR", "TRANSCRIPT_DIR", "PROCESSED_DIR", "DB_PATH", "DB_PARTITION_DIR", "CONVERT_CACHE_DIR"}
+URL_CONFIG_KEYS = ("ASR_API_URL", "N8N_WEBHOOK_URL")
+CONFIG_STATE = {
+    "mtime": os.path.getmtime(CONFIG_FILE) if os.path.exists(CONFIG_FILE) else None,
+    "reloads": 0, "reloaded_at": None, "last_error": None, "pending": [],
+}
+
+def _is_url(value):
+    return isinstance(value, str) and re.match(r'^https?://[^/\s]+', value) is not None
+
+def validate_config(new_config, changed):
+    """检查修改后的配置, 返回错误列表。类型以代码中的默认值为准, 未知的键不检查。"""
+    errors = []
+    for key in sorted(changed):
+        if key not in new_config:
+            continue
+        value, default = new_config[key], BUILTIN_CONFIG.get(key)
+        if isinstance(default, bool):
+            if not isinstance(value, bool):
+                errors.append(f"{key} 应为 true/false")
+        elif isinstance(default, (int, float)):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"{key} 应为数字")
+            elif value < 0:
+                errors.append(f"{key} 不能为负数")
+        elif isinstance(default, str) and not isinstance(value, str):
+            errors.append(f"{key} 应为字符串")
+        elif isinstance(default, list) and not isinstance(value, list):
+            errors.append(f"{key} 应为列表")
+    if errors:
+        return errors
+    if "QUEUE_POLICY" in changed and new_config.get("QUEUE_POLICY") not in QUEUE_POLICIES:
+        errors.append(f"QUEUE_POLICY 应为 {' / '.join(QUEUE_POLICIES)}")
+    if "ASR_UPLOAD_CODEC" in changed and str(new_config.get("ASR_UPLOAD_CODEC")).lower() not in UPLOAD_CODECS:
+        errors.append(f"ASR_UPLOAD_CODEC 应为 {' / '.join(UPLOAD_CODECS)}")
+    for key in URL_CONFIG_KEYS:
+        # 通知地址可以为空 (不发送)
+        if key in changed and new_config.get(key) and not _is_url(new_config[key]):
+            errors.append(f"{key} 不是有效的 http(s) 地址: {new_config[key]}")
+    if "ASR_ENDPOINTS" in changed:
+        for item in new_config.get("ASR_ENDPOINTS") or []:
+            url = item.get("url") if isinstance(item, dict) else item
+            if not _is_url(url):
+                errors.append(f"ASR_ENDPOINTS 中的服务端地址无效: {item}")
+            elif isinstance(item, dict):
+                try:
+                    if float(item.get("weight", 1) or 1) <= 0 or int(item.get("max_inflight", 1) or 1) < 1:
+                        raise ValueError
+                except (TypeError, ValueError):
+                    errors.append(f"ASR_ENDPOINTS 中 {url} 的 weight / max_inflight 无效")
+    if "SOURCE_DIR" in changed and not os.path.isdir(new_config["SOURCE_DIR"]):
+        errors.append(f"源目录不存在: {new_config['SOURCE_DIR']}")
+    if "DB_PATH" in changed and not os.path.isdir(os.path.dirname(os.path.abspath(new_config["DB_PATH"]))):
+        errors.append(f"数据库所在目录不存在: {new_config['DB_PATH']}")
+    return errors
+
+def apply_config(new_config, keys):
+    """把已校验的配置写入 CONFIG, 并通知相关组件"""
+    for key in keys:
+        if key in new_config:
+            CONFIG[key] = new_config[key]
+        else:
+            CONFIG.pop(key, None)
+    print(f"[配置] 已应用修改: {', '.join(sorted(keys))}")
+    if keys & {"ASR_ENDPOINTS", "ASR_API_URL", "ASR_UPLOAD_CODEC"}:
+        get_asr_pool().reconfigure(load_endpoint_configs(), codec_changed="ASR_UPLOAD_CODEC" in keys)
+        for ep in get_asr_pool().endpoints:
+            print(f"[配置] ASR 服务端: {ep['url']} (权重 {ep['weight']}, 并发 {ep['max_inflight']})")
+    if keys & {"DB_PATH", "DB_PARTITION_DIR"}:
+        init_db()
+    if any(key.startswith("WEBHOOK_") or key == "N8N_WEBHOOK_URL" for key in keys):
+        WEBHOOK_WAKE.set()
+
+def reload_config(idle=False):
+    """config.json 修改后重新加载。校验失败时保留当前配置; 路径类配置在 idle (没有在途任务) 时才应用。
+    返回本次应用的配置键集合。"""
+    try:
+        mtime = os.path.getmtime(CONFIG_FILE)
+    except OSError:
+        return set()
+    if mtime == CONFIG_STATE["mtime"]:
+        return set()
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        if not isinstance(loaded, dict):
+            raise ValueError("顶层应为 JSON 对象")
+    except (OSError, ValueError) as e:
+        # 可能正好读到写了一半的文件, 记下修改时间, 文件再次修改后重试
+        CONFIG_STATE.update(mtime=mtime, last_error=f"读取失败: {e}")
+        print(f"[配置] {CONFIG_FILE} 读取失败，继续使用当前配置: {e}")
+        return set()
+    new_config = dict(BUILTIN_CONFIG)
+    new_config.update(loaded)
+    new_config.update(CONFIG_OVERRIDES)
+    changed = {key for key in set(new_config) | set(CONFIG) if new_config.get(key) != CONFIG.get(key)}
+    errors = validate_config(new_config, changed)
+    if errors:
+        CONFIG_STATE.update(mtime=mtime, last_error="; ".join(errors))
+        print(f"[配置] {CONFIG_FILE} 校验失败，继续使用当前配置: " + "; ".join(errors))
+        return set()
+    deferred = changed & PATH_CONFIG_KEYS if not idle else set()
+    applied = changed - deferred
+    if applied:
+        apply_config(new_config, applied)
+        CONFIG_STATE["reloads"] += 1
+        CONFIG_STATE["reloaded_at"] = datetime.datetime.now().isoformat()
+    if deferred:
+        # 不记录修改时间, 下次 (没有在途任务时) 再应用
+        if CONFIG_STATE["pending"] != sorted(deferred):
+            print(f"[配置] {', '.join(sorted(deferred))} 将在当前任务完成后应用")
+        CONFIG_STATE["pending"] = sorted(deferred)
+    else:
+        CONFIG_STATE.update(mtime=mtime, pending=[])
+    CONFIG_STATE["last_error"] = None
+    return applied
+
+# ---------------- 优雅退出 ----------------
+SHUTDOWN = threading.Event()
+SHUTDOWN_STATE = {"signal": None, "requested_at": None, "deadline": None, "stopped": False}
+# 正在处理的任务: 文件名 -> job, job["stage"] 为当前步骤 (converting / transcribing / saving / done)
+ACTIVE_JOBS = {}
+# 上次退出时未完成的文件, 重启后排在队列最前
+RESUMED_FILES = set()
+# 排空超时后, 最多再等正在入库归档的任务这么多秒
+SAVING_GRACE_SECONDS = 30
+
+def request_shutdown(signum, frame):
+    """SIGTERM: 不再领取新文件, 等在途任务完成后退出; 再次收到信号时记录检查点并立即退出。"""
+    if SHUTDOWN.is_set():
+        abandon_active_jobs(f"再次收到信号 {signum}")
+    drain = float(CONFIG.get("SHUTDOWN_DRAIN_SECONDS", 900) or 0)
+    now = time.time()
+    SHUTDOWN_STATE.update(signal=signum, requested_at=now, deadline=now + drain)
+    SHUTDOWN.set()
+    print(f"[退出] 收到信号 {signum}，不再领取新文件，等待 {len(ACTIVE_JOBS)} 个在途任务完成 (最多 {int(drain)}s)")
+
+def install_signal_handlers():
+    try:
+        signal.signal(signal.SIGTERM, request_shutdown)
+    except ValueError:
+        # 不在主线程中运行 (被其他脚本导入), 由调用方负责退出
+        pass
+
+def drain_expired():
+    return SHUTDOWN.is_set() and time.time() >= (SHUTDOWN_STATE["deadline"] or 0)
+
+def shutdown_snapshot():
+    state = "stopped" if SHUTDOWN_STATE["stopped"] else "draining" if SHUTDOWN.is_set() else "running"
+    deadline = SHUTDOWN_STATE["deadline"]
+    return {
+        "state": state,
+        "deadline": datetime.datetime.fromtimestamp(deadline).isoformat() if deadline else None,
+        "active": [{"filename": name, "stage": job.get("stage")} for name, job in list(ACTIVE_JOBS.items())],
+    }
+
+def save_checkpoint(jobs):
+    path = CONFIG.get("CHECKPOINT_PATH")
+    if not path: return
+    data = {
+        "saved_at": datetime.datetime.now().isoformat(),
+        "jobs": [{
+            "filename": job["filename"],
+            "stage": job.get("stage"),
+            "first_seen": job.get("first_seen"),
+            "started": job.get("started"),
+        } for job in jobs],
+    }
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"[退出] 写入检查点失败: {e}")
+
+def load_checkpoint():
+    """读取上次退出时的检查点: 这些文件恢复原来的排队时长并优先处理, 转换缓存照常复用。
+    已提交异步任务、还没取回结果的文件同样优先处理。"""
+    path = CONFIG.get("CHECKPOINT_PATH")
+    data = {}
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            os.remove(path)
         except Exception as e:
-            print(f"  [异常] {e}")
-        finally:
-            if os.path.exists(wav_path): os.remove(wav_path)
-    return processed_count
+            print(f"[恢复] 读取检查点失败: {e}")
+    now = time.time()
+    for item in data.get("jobs", []):
+        filename = item.get("filename")
+        if not filename or not os.path.exists(os.path.join(CONFIG["SOURCE_DIR"], filename)):
+            continue
+        RESUMED_FILES.add(filename)
+        if item.get("first_seen"):
+            _FIRST_SEEN[filename] = min(float(item["first_seen"]), now)
+    for filename in pending_asr_job_files():
+        if os.path.exists(os.path.join(CONFIG["SOURCE_DIR"], filename)):
+            RESUMED_FILES.add(filename)
+    if RESUMED_FILES:
+        print(f"[恢复] 上次退出时有 {len(RESUMED_FILES)} 个文件未完成，优先处理: " + ", ".join(sorted(RESUMED_FILES)))
+
+def remove_stale_parts():
+    """上次被强制退出时留下的半成品转换文件"""
+    for directory in (get_convert_dir(), CONFIG["PROCESSED_DIR"]):
+        if not os.path.isdir(directory): continue
+        for name in os.listdir(directory):
+            if name.endswith(".part"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+def abandon_active_jobs(reason):
+    """在途的 HTTP 请求无法中断: 记录检查点后直接结束进程。正在入库归档的任务先等它完成, 避免重复入库。"""
+    grace_until = time.time() + SAVING_GRACE_SECONDS
+    while time.time() < grace_until and any(job.get("stage") == "saving" for job in list(ACTIVE_JOBS.values())):
+        time.sleep(0.2)
+    jobs = [job for job in list(ACTIVE_JOBS.values()) if job.get("stage") != "done"]
+    save_checkpoint(jobs)
+    print(f"[退出] {reason}，{len(jobs)} 个未完成的任务已记录检查点，重启后优先处理: "
+          + ", ".join(job["filename"] for job in jobs))
+    finish_shutdown()
+    sys.stdout.flush()
+    os._exit(0)
+
+def _pid_running(pid):
+    if os.name == "nt":
+        # Windows 上 os.kill(pid, 0) 会结束目标进程, 不做检查
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    cmdline_path = f"/proc/{pid}/cmdline"
+    if os.path.exists(cmdline_path):
+        # PID 可能已被其他程序复用: 只有运行的是同一个脚本才算
+        with open(cmdline_path, 'rb') as f:
+            return os.path.basename(sys.argv[0]).encode() in f.read()
+    return True
+
+def write_pid_file():
+    """写入 PID 文件; 另一个转录进程仍在运行时返回 False"""
+    path = CONFIG.get("PID_FILE_PATH")
+    if not path: return True
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        pid = 0
+    if pid and pid != os.getpid() and _pid_running(pid):
+        print(f"[启动] 另一个转录进程正在运行 (PID {pid}，见 {path})，退出")
+        return False
+    try:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(str(os.getpid()))
+    except OSError as e:
+        print(f"[启动] 写入 PID 文件失败: {e}")
+    return True
+
+def finish_shutdown():
+    SHUTDOWN_STATE["stopped"] = True
+    write_status()
+    path = CONFIG.get("PID_FILE_PATH")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read().strip() == str(os.getpid()):
+                os.remove(path)
+    except (OSError, TypeError):
+        pass
 
 # ---------------- 主函数 ----------------
 def main():
@@ -232,17 +2471,49 @@ def main():
     update_config(args)
     print("--- 启动实时监控模式 (SenseVoice 适配版) ---")
     print(f"监控目录: {CONFIG['SOURCE_DIR']}")
+    if not write_pid_file():
+        return 1
+    install_signal_handlers()
     init_db()
-    while True:
+    load_checkpoint()
+    remove_stale_parts()
+    for ep in get_asr_pool().endpoints:
+        print(f"ASR 服务端: {ep['url']} (权重 {ep['weight']}, 并发 {ep['max_inflight']})")
+    if CONFIG.get("VAD_ENABLED") and np is None:
+        print("[VAD] 未安装 numpy，静音裁剪已停用")
+    start_endpoint_prober()
+    start_webhook_sender()
+    start_resource_governor()
+    write_status()
+    try:
+        run_main_loop()
+    finally:
+        finish_shutdown()
+    print("[退出] 已停止")
+    return 0
+
+def run_main_loop():
+    last_busy = time.time()
+    while not SHUTDOWN.is_set():
         try:
-            process_one_loop()
-            time.sleep(3)
+            reload_config(idle=True)
+            if process_one_loop() or has_pending_files():
+                last_busy = time.time()
+            elif time.time() - last_busy >= float(CONFIG.get("ARCHIVE_COMPACT_IDLE_SECONDS", 60) or 0):
+                # 转录队列空闲时每轮只做一项后台维护: 压缩一个归档文件, 或压缩一个旧分区
+                if CONFIG.get("ARCHIVE_COMPACT_ENABLED") and compact_archive_step():
+                    write_status()
+                else:
+                    compress_partition_step()
+            SHUTDOWN.wait(3)
         except KeyboardInterrupt:
             print("停止监控。")
             break
         except Exception as e:
             print(f"主循环发生错误: {e}")
-            time.sleep(10)
+            SHUTDOWN.wait(10)
+    if SHUTDOWN.is_set():
+        print("[退出] 在途任务已全部完成")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
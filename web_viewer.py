@@ -5,13 +5,24 @@ import os
 import re
 import sqlite3
 import json
-from flask import Flask, render_template_string, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, send_file
 import datetime
 import requests
 import subprocess
 import argparse
 import time
 import threading
+import io
+import csv
+import zipfile
+import gzip
+import hashlib
+
+from analytics import parse_recorded_time, query_rollups, QUERY_BUCKETS, summarize_transcript, fill_missing_summaries
+import similarity
+import partitions
+# 待处理文件的判断与 transcribe.scan_pending_jobs 保持一致
+from transcribe import SUPPORTED_EXTENSIONS
 
 # --- 配置 ---
 # 获取脚本自身所在的目录
@@ -19,17 +30,23 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 DEFAULT_DB_PATH = "/volume2/download/records/Sony-2/transcripts.db"
 DEFAULT_SOURCE_DIR = "/volume2/download/records/Sony-2"
+DEFAULT_PROCESSED_DIR = os.path.join(DEFAULT_SOURCE_DIR, "processed")
+DEFAULT_TRANSCRIPT_DIR = os.path.join(DEFAULT_SOURCE_DIR, "transcripts")
 DEFAULT_ASR_API_URL = "http://192.168.1.111:5008/transcribe"
 DEFAULT_LOG_FILE_PATH = os.path.join(SCRIPT_DIR, "transcribe.log")
 DEFAULT_WEB_PORT = 5009 
+DEFAULT_STATUS_FILE_PATH = "transcriber_status.json"
 
 # 全局配置变量
 CONFIG = {
     "DB_PATH": DEFAULT_DB_PATH,
     "SOURCE_DIR": DEFAULT_SOURCE_DIR,
+    "PROCESSED_DIR": DEFAULT_PROCESSED_DIR,
+    "TRANSCRIPT_DIR": DEFAULT_TRANSCRIPT_DIR,
     "ASR_API_URL": DEFAULT_ASR_API_URL,
     "LOG_FILE_PATH": DEFAULT_LOG_FILE_PATH,
-    "WEB_PORT": DEFAULT_WEB_PORT
+    "WEB_PORT": DEFAULT_WEB_PORT,
+    "STATUS_FILE_PATH": DEFAULT_STATUS_FILE_PATH
 }
 
 # 从JSON文件加载配置
@@ -54,6 +71,8 @@ def update_config(args):
         base_path = args.source_path
         CONFIG["SOURCE_DIR"] = base_path
         CONFIG["DB_PATH"] = os.path.join(base_path, "transcripts.db")
+        CONFIG["PROCESSED_DIR"] = os.path.join(base_path, "processed")
+        CONFIG["TRANSCRIPT_DIR"] = os.path.join(base_path, "transcripts")
         print(f"[配置] 使用自定义源路径: {base_path}")
     
     if args.port:
@@ -65,7 +84,9 @@ def update_config(args):
 
 # -----------------
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
+# 相关录音索引 (需要 numpy), 首次查询时加载, 之后只增量读取新录音
+SIMILARITY_INDEX = similarity.SimilarityIndex(lambda: CONFIG["DB_PATH"]) if similarity.np is not None else None
 
 def format_timestamp(milliseconds):
     try:
@@ -76,11 +97,23 @@ def format_timestamp(milliseconds):
     except:
         return "00:00:00.000"
 
+def get_transcriber_status():
+    """读取 transcribe.py 写出的状态文件 (服务端吞吐等)"""
+    status_path = CONFIG.get("STATUS_FILE_PATH") or DEFAULT_STATUS_FILE_PATH
+    if not os.path.exists(status_path):
+        status_path = os.path.join(SCRIPT_DIR, os.path.basename(status_path))
+    try:
+        with open(status_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except:
+        return {}
+
 def get_system_status():
     status = {
         "asr_server": "unknown",
         "pending_files": 0,
-        "last_log": "等待日志..."
+        "last_log": "等待日志...",
+        "transcriber": get_transcriber_status()
     }
     try:
         try:
@@ -93,8 +126,8 @@ def get_system_status():
 
     try:
         if os.path.exists(CONFIG["SOURCE_DIR"]):
-            files = [f for f in os.listdir(CONFIG["SOURCE_DIR"]) 
-                     if f.lower().endswith(('.m4a', '.acc', '.aac', '.mp3', '.wav', '.ogg'))]
+            files = [f for f in os.listdir(CONFIG["SOURCE_DIR"])
+                     if f.lower().endswith(SUPPORTED_EXTENSIONS) and not f.endswith("_TEMP.wav")]
             status["pending_files"] = len(files)
         else:
             status["pending_files"] = -1
@@ -131,76 +164,145 @@ def get_system_status():
 
     return status
 
+def decorate_time(data):
+    """按录音时间补充分组和显示用的时间字段"""
+    dt = parse_recorded_time(data['filename'], data['created_at'])
+    if dt is not None:
+        now = datetime.datetime.now()
+        data['is_new'] = (now - dt).total_seconds() < 300
+        data['date_group'] = dt.strftime('%Y-%m-%d')
+        data['time_simple'] = dt.strftime('%H:%M') 
+        data['time_full'] = dt.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        data['is_new'] = False
+        data['date_group'] = "Unknown"
+        data['time_simple'] = ""
+        data['time_full'] = ""
+    return data
+
+def decorate_segments(segments_json):
+    try:
+        segments = json.loads(segments_json)
+    except:
+        segments = []
+    for seg in segments:
+        seg['start_fmt'] = format_timestamp(seg.get('start', 0))
+        # 兼容后端传来的 spk 字段 (可能是数字，可能是字符串"爸爸")
+        seg['spk_id'] = seg.get('spk', 0) 
+    return segments
+
+# ---------------- 分区查询 ----------------
+# 录音按月份分区保存, 查询只挂载需要的分区 (见 partitions.py), 结果在这里合并
+# 页面用到的查询语句, check_db.py 直接引用这些常量检查执行计划
+LIST_COLUMNS = "id, filename, created_at, duration_ms, speakers_json, preview"
+RECENT_SQL = "SELECT {columns} FROM transcriptions ORDER BY created_at DESC, id DESC LIMIT ?"
+BY_IDS_SQL = "SELECT {columns} FROM transcriptions WHERE id IN ({placeholders})"
+CHAT_SESSIONS_SQL = '''
+        SELECT session_id, MIN(created_at) as created_at, COUNT(*) as message_count
+        FROM chat_history
+        GROUP BY session_id
+        ORDER BY created_at DESC'''
+CHAT_MESSAGES_SQL = '''
+        SELECT speaker_id, speaker_name, message_text, timestamp
+        FROM chat_history
+        WHERE session_id = ?
+        ORDER BY timestamp ASC'''
+DELETE_CHAT_SQL = "DELETE FROM chat_history WHERE session_id = ?"
+ARCHIVED_NAME_SQL = "SELECT archived_name FROM archive_compaction WHERE filename = ? AND status = 'compacted'"
+
+def open_db():
+    db = sqlite3.connect(CONFIG["DB_PATH"])
+    db.row_factory = sqlite3.Row
+    return db
+
+def query_recent(db, columns, limit):
+    """最近入库的 limit 条录音, 只挂载它们所在的分区"""
+    rows = partitions.query(db, partitions.recent_partitions(db, limit),
+                            RECENT_SQL.format(columns=columns), (limit,))
+    rows.sort(key=lambda row: (row['created_at'] or '', row['id']), reverse=True)
+    return rows[:limit]
+
+def query_by_ids(db, columns, ids):
+    ids = list(ids)
+    if not ids:
+        return []
+    return partitions.query(db, partitions.partitions_for_ids(db, ids),
+                            BY_IDS_SQL.format(columns=columns, placeholders=','.join('?' * len(ids))), ids)
+
 def get_transcripts():
     if not os.path.exists(CONFIG["DB_PATH"]):
         return []
     try:
-        db = sqlite3.connect(CONFIG["DB_PATH"])
-        db.row_factory = sqlite3.Row
-        cursor = db.cursor()
+        db = open_db()
         # 获取最近 100 条记录
-        cursor.execute("SELECT id, filename, created_at, full_text, segments_json FROM transcriptions ORDER BY created_at DESC LIMIT 100")
-        rows = cursor.fetchall()
+        rows = query_recent(db, "id, filename, created_at, full_text, segments_json", 100)
         db.close()
         
         results = []
         for row in rows:
             data = dict(row)
-            try:
-                data['segments'] = json.loads(data['segments_json'])
-            except:
-                data['segments'] = []
-            
-            for seg in data['segments']:
-                seg['start_fmt'] = format_timestamp(seg.get('start', 0))
-                # 兼容后端传来的 spk 字段 (可能是数字，可能是字符串"爸爸")
-                seg['spk_id'] = seg.get('spk', 0) 
-            
-            # 解析时间
-            filename = data['filename']
-            dt = None
-            time_patterns = [
-                r'^\s*(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})\s*', 
-                r'^\s*recording-(\d{4})(\d{2})(\d{2})-(\d{2})(\d{2})(\d{2})\s*' 
-            ]
-            
-            for pattern in time_patterns:
-                match = re.match(pattern, os.path.splitext(filename)[0])
-                if match:
-                    try:
-                        if pattern == time_patterns[0]: 
-                            date_part = match.group(1)
-                            time_part = match.group(2)
-                            dt_str = f"{date_part} {time_part.replace('-', ':')}"
-                            dt = datetime.datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                        else: 
-                            year, month, day, hour, minute, second = match.groups()
-                            dt_str = f"{year}-{month}-{day} {hour}:{minute}:{second}"
-                            dt = datetime.datetime.strptime(dt_str, '%Y-%m-%d %H:%M:%S')
-                        break 
-                    except ValueError:
-                        continue 
-                        
-            if dt is None:
-                try: dt = datetime.datetime.fromisoformat(data['created_at'])
-                except: pass
-
-            if dt is not None:
-                now = datetime.datetime.now()
-                data['is_new'] = (now - dt).total_seconds() < 300
-                data['date_group'] = dt.strftime('%Y-%m-%d')
-                data['time_simple'] = dt.strftime('%H:%M') 
-                data['time_full'] = dt.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                data['is_new'] = False
-                data['date_group'] = "Unknown"
-                data['time_simple'] = ""
-                data['time_full'] = ""
-            results.append(data)
+            data['segments'] = decorate_segments(data['segments_json'])
+            results.append(decorate_time(data))
         return results
     except:
         return []
 
+def get_transcript_list(limit=100):
+    """列表只投影头信息、时长、说话人摘要和预览, 不读取全文和分段"""
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return []
+    try:
+        db = open_db()
+        rows = query_recent(db, LIST_COLUMNS, limit)
+        # 旧版转录进程写入的记录还没有摘要列, 临时从分段计算
+        missing = [row['id'] for row in rows if row['speakers_json'] is None]
+        fallback = {}
+        if missing:
+            for transcription_id, full_text, segments_json in query_by_ids(db, "id, full_text, segments_json", missing):
+                try:
+                    segments = json.loads(segments_json or '[]')
+                except ValueError:
+                    segments = []
+                fallback[transcription_id] = summarize_transcript(full_text, segments)
+        db.close()
+    except Exception as e:
+        print(f"读取录音列表失败: {e}")
+        return []
+    results = []
+    for row in rows:
+        data = dict(row)
+        if row['id'] in fallback:
+            data['duration_ms'], data['speakers_json'], data['preview'] = fallback[row['id']]
+        data['speakers'] = json.loads(data.pop('speakers_json') or '[]')
+        results.append(decorate_time(data))
+    return results
+
+def get_transcript(transcription_id):
+    """单条录音的全文和分段, 展开卡片时按需读取"""
+    db = open_db()
+    try:
+        rows = query_by_ids(db, "id, filename, created_at, full_text, segments_json", [transcription_id])
+    finally:
+        db.close()
+    if not rows:
+        return None
+    data = dict(rows[0])
+    data['segments'] = decorate_segments(data.pop('segments_json'))
+    return decorate_time(data)
+
+def init_transcript_summaries():
+    """为升级前的记录补齐列表摘要列 (时长 / 说话人 / 预览)"""
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return
+    try:
+        db = sqlite3.connect(CONFIG["DB_PATH"])
+        try:
+            fill_missing_summaries(db)
+        finally:
+            db.close()
+    except Exception as e:
+        print(f"补齐列表摘要失败: {e}")
+
 # ---------------- 对话历史功能 ----------------
 def init_chat_history_db():
     """初始化对话历史数据库表"""
@@ -250,7 +352,7 @@ def save_chat_session(session_id, chat_data):
         # 首先删除已存在的会话数据
         db = sqlite3.connect(CONFIG["DB_PATH"])
         cursor = db.cursor()
-        cursor.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
+        cursor.execute(DELETE_CHAT_SQL, (session_id,))
         
         # 然后插入新的聊天数据
         for item in chat_data:
@@ -291,12 +393,7 @@ def get_chat_sessions():
         db = sqlite3.connect(CONFIG["DB_PATH"])
         db.row_factory = sqlite3.Row
         cursor = db.cursor()
-        cursor.execute('''
-        SELECT session_id, MIN(created_at) as created_at, COUNT(*) as message_count
-        FROM chat_history
-        GROUP BY session_id
-        ORDER BY created_at DESC
-        ''')
+        cursor.execute(CHAT_SESSIONS_SQL)
         rows = cursor.fetchall()
         db.close()
         
@@ -318,12 +415,7 @@ def get_chat_session_messages(session_id):
         db = sqlite3.connect(CONFIG["DB_PATH"])
         db.row_factory = sqlite3.Row
         cursor = db.cursor()
-        cursor.execute('''
-        SELECT speaker_id, speaker_name, message_text, timestamp
-        FROM chat_history
-        WHERE session_id = ?
-        ORDER BY timestamp ASC
-        ''', (session_id,))
+        cursor.execute(CHAT_MESSAGES_SQL, (session_id,))
         rows = cursor.fetchall()
         db.close()
         
@@ -346,7 +438,7 @@ def delete_chat_session(session_id):
     try:
         db = sqlite3.connect(CONFIG["DB_PATH"])
         cursor = db.cursor()
-        cursor.execute("DELETE FROM chat_history WHERE session_id = ?", (session_id,))
+        cursor.execute(DELETE_CHAT_SQL, (session_id,))
         db.commit()
         db.close()
         return True
@@ -354,856 +446,265 @@ def delete_chat_session(session_id):
         print(f"删除聊天会话失败: {e}")
         return False
 
-# --- HTML 模板 ---
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>AI 录音存档</title>
-    <style>
-        :root { --primary: #007bff; --bg: #f0f2f5; --card-bg: #ffffff; --text: #333; --console-bg: #1e1e1e; --console-text: #00ff00; --chat-me: #d9fdd3; --chat-other: #ffffff; }
-        body { font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; background-color: var(--bg); color: var(--text); margin: 0; padding: 0; height: 100vh; display: flex; flex-direction: column; }
-        
-        /* 顶部导航 Tab */
-        .nav-header { background: var(--card-bg); padding: 10px 20px; box-shadow: 0 1px 3px rgba(0,0,0,0.1); z-index: 100; display: flex; justify-content: center; gap: 20px; }
-        .nav-btn { padding: 8px 20px; border: none; background: none; font-size: 1em; font-weight: 600; color: #666; cursor: pointer; border-bottom: 3px solid transparent; transition: all 0.3s; }
-        .nav-btn.active { color: var(--primary); border-bottom-color: var(--primary); }
-        .nav-btn:hover { color: var(--primary); }
-
-        /* 主内容区域 */
-        .view-container { flex: 1; overflow-y: auto; padding: 20px; display: none; }
-        .view-container.active { display: block; }
-
-        /* === 视图 1: 仪表盘样式 === */
-        .dashboard-panel { display: grid; grid-template-columns: 1fr 2fr; grid-template-rows: 1fr; gap: 20px; margin-bottom: 20px; max-width: 1000px; margin-left: auto; margin-right: auto; align-items: stretch; }
-        .status-card { background: var(--card-bg); padding: 20px; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.05); }
-        .status-item { margin-bottom: 15px; display: flex; justify-content: space-between; align-items: center; border-bottom: 1px solid #eee; padding-bottom: 10px; }
-        .status-item:last-child { border-bottom: none; }
-        .badge { padding: 4px 8px; border-radius: 4px; font-size: 0.9em; color: white; font-weight: bold; }
-        .bg-green { background-color: #28a745; } .bg-red { background-color: #dc3545; } .bg-blue { background-color: #17a2b8; }
-        
-        .console-window { background: var(--console-bg); color: var(--console-text); padding: 15px; border-radius: 8px; font-family: monospace; font-size: 0.85em; height: 150px; overflow-y: auto; white-space: pre-wrap; }
-        
-        .transcript-card { background: var(--card-bg); border-radius: 8px; margin-bottom: 15px; padding: 20px; max-width: 960px; margin-left: auto; margin-right: auto; box-shadow: 0 1px 3px rgba(0,0,0,0.1); }
-        .transcript-card.new-item { border-left: 4px solid #28a745; background-color: #f8fff9; }
-        .card-meta { display: flex; justify-content: space-between; color: #888; font-size: 0.85em; margin-bottom: 10px; border-bottom: 1px solid #eee; padding-bottom: 5px; }
-        .filename { font-weight: 600; color: #444; }
-        .segment { display: flex; gap: 10px; margin-bottom: 4px; }
-        .timestamp { font-family: monospace; color: #999; font-size: 0.8em; min-width: 80px; }
-
-        /* === 视图 2: 时光对话样式 (Chat) === */
-        .chat-container { max-width: 800px; margin: 0 auto; }
-        .chat-date-separator { text-align: center; margin: 20px 0; }
-        .chat-date-label { background-color: rgba(0,0,0,0.05); color: #666; padding: 4px 12px; border-radius: 12px; font-size: 0.85em; }
-        .file-separator { text-align: center; margin: 15px 0; font-size: 0.8em; color: #aaa; display: flex; align-items: center; gap: 10px; }
-        .file-separator::before, .file-separator::after { content: ""; flex: 1; height: 1px; background: #ddd; }
-
-        .chat-bubble-row { display: flex; margin-bottom: 15px; gap: 10px; }
-        .avatar { width: 40px; height: 40px; background-color: #ccc; border-radius: 50%; display: flex; justify-content: center; align-items: center; font-weight: bold; color: white; font-size: 0.9em; flex-shrink: 0; }
-        
-        .bubble-content { max-width: 70%; display: flex; flex-direction: column; }
-        .speaker-name { font-size: 0.75em; color: #888; margin-bottom: 2px; margin-left: 5px; }
-        .bubble { background-color: var(--chat-other); padding: 10px 14px; border-radius: 0 12px 12px 12px; position: relative; box-shadow: 0 1px 2px rgba(0,0,0,0.1); font-size: 1em; line-height: 1.5; }
-        .chat-time { font-size: 0.7em; color: #999; text-align: right; margin-top: 4px; margin-right: 5px; }
-
-        /* === 视图 3: 统计分析样式 (新增) === */
-        .analysis-card { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 12px; margin-bottom: 25px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }
-        .analysis-card h3 { margin: 0 0 10px 0; font-size: 1.5em; }
-        .analysis-card p { margin: 0; opacity: 0.9; }
-        .speaker-grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(280px, 1fr)); gap: 20px; }
-        .speaker-card { background: var(--card-bg); border-radius: 12px; padding: 20px; display: flex; align-items: center; gap: 15px; box-shadow: 0 2px 8px rgba(0,0,0,0.05); transition: transform 0.2s; border: 1px solid #eee; }
-        .speaker-card:hover { transform: translateY(-3px); box-shadow: 0 5px 15px rgba(0,0,0,0.1); }
-        .speaker-icon { width: 60px; height: 60px; border-radius: 50%; display: flex; justify-content: center; align-items: center; font-size: 1.5em; font-weight: bold; color: white; flex-shrink: 0; }
-        .speaker-info { flex: 1; }
-        .speaker-info h4 { margin: 0 0 10px 0; color: #333; font-size: 1.1em; }
-        .speaker-stats-detail { display: flex; justify-content: space-between; background: #f8f9fa; padding: 8px 12px; border-radius: 8px; text-align: center; }
-        
-        /* 头像颜色 (限定为 5 种高对比度色) */
-        .avatar-0 { background: #1A53E0; } /* 亮蓝色 */
-        .avatar-1 { background: #28A745; } /* 鲜绿色 */
-        .avatar-2 { background: #FF7733; } /* 亮橙色 */
-        .avatar-3 { background: #8E44AD; } /* 深紫色 */
-        .avatar-4 { background: #DC3545; } /* 鲜红色 */
-
-        /* === 视图 4: 实时日志样式 === */
-        .logs-header { display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px; padding-bottom: 10px; border-bottom: 1px solid #eee; }
-        .logs-controls { display: flex; gap: 10px; align-items: center; }
-        .logs-status { display: flex; gap: 10px; align-items: center; }
-        .logs-container { height: calc(100vh - 200px); }
-        .logs-window { 
-            background: var(--console-bg); 
-            color: var(--console-text); 
-            padding: 15px; 
-            border-radius: 8px; 
-            font-family: monospace; 
-            font-size: 0.85em; 
-            height: 100%; 
-            overflow-y: auto; 
-            white-space: pre-wrap; 
-        }
-        .btn { padding: 8px 16px; border: none; border-radius: 4px; cursor: pointer; font-size: 14px; }
-        .btn-primary { background-color: var(--primary); color: white; }
-        .btn-secondary { background-color: #6c757d; color: white; }
-
-    </style>
-</head>
-<body>
-
-    <div class="nav-header">
-        <button class="nav-btn active" onclick="switchTab('dashboard')">️ 仪表盘</button>
-        <button class="nav-btn" onclick="switchTab('chat')"> 时光对话</button>
-        <button class="nav-btn" onclick="switchTab('analysis')">📊 统计分析</button>
-        <button class="nav-btn" onclick="switchTab('logs')">📄 实时日志</button>
-        <button class="nav-btn" onclick="switchTab('config')">⚙️ 配置管理</button>
-    </div>
-
-    <div id="view-dashboard" class="view-container active">
-        <div class="dashboard-panel">
-            <div class="status-card">
-                <div class="status-item"><span class="status-label">PC 服务状态</span><span id="status-asr" class="badge bg-red">检测中...</span></div>
-                <div class="status-item"><span class="status-label">排队文件数</span><span id="status-files" class="badge bg-blue">0</span></div>
-                <div class="status-item"><span class="status-label">Web 界面</span><span class="badge bg-green">在线</span></div>
-            </div>
-            <div class="console-window">
-                <div style="border-bottom:1px solid #444; margin-bottom:5px; color:#888;">root@NAS: monitor_logs (实时)</div>
-                <div id="log-display">正在连接日志流...</div>
-            </div>
-        </div>
-        <div id="dashboard-content">
-            <div style="text-align: center; color: #999;">加载中...</div>
-        </div>
-    </div>
-
-    <div id="view-chat" class="view-container">
-        <div style="max-width: 800px; margin: 0 auto; padding: 10px; display: flex; justify-content: space-between; align-items: center;">
-            <h3 style="margin: 0; color: #007bff;">时光对话</h3>
-            <div>
-                <select id="chat-session-select" style="margin-right: 10px; padding: 5px;">
-                    <option value="">选择历史会话...</option>
-                </select>
-                <button id="save-chat-btn" class="btn btn-primary" style="padding: 5px 15px;">保存对话</button>
-                <button id="new-chat-btn" class="btn btn-secondary" style="padding: 5px 15px; margin-left: 5px;">新建会话</button>
-            </div>
-        </div>
-        <div class="chat-container" id="chat-content">
-            <div style="text-align: center; color: #999; margin-top: 50px;">正在生成对话流...</div>
-        </div>
-    </div>
-    
-    <div id="view-analysis" class="view-container">
-        <div id="analysis-content" style="max-width: 1000px; margin: 0 auto;">
-            <div style="text-align: center; color: #999; margin-top: 50px;">正在分析声纹数据...</div>
-        </div>
-    </div>
-
-    <div id="view-logs" class="view-container">
-        <div class="logs-header">
-            <h2>📄 实时日志</h2>
-            <div class="logs-controls">
-                <button id="toggle-logs-btn" class="btn btn-primary">开始接收日志</button>
-                <button id="clear-logs-btn" class="btn btn-secondary">清空日志</button>
-                <div class="logs-status">
-                    <span id="logs-connection-status" class="badge bg-red">未连接</span>
-                    <span id="logs-lines-count">0 行</span>
-                </div>
-            </div>
-        </div>
-        <div class="logs-container">
-            <div id="logs-display" class="logs-window"></div>
-        </div>
-    </div>
-
-    <div id="view-config" class="view-container">
-        <div id="config-content" style="max-width: 1000px; margin: 0 auto; padding: 20px;">
-            <h2 style="color: #007bff; margin-bottom: 20px;">系统配置</h2>
-            <div id="config-form">
-                <div style="text-align: center; color: #999;">正在加载配置...</div>
-            </div>
-            <div style="margin-top: 20px; text-align: center;">
-                <button id="save-config-btn" class="btn btn-primary" style="padding: 8px 30px; font-size: 16px;">保存配置</button>
-                <div id="save-status" style="margin-top: 10px; color: #28a745; font-weight: bold;"></div>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        let lastDataFingerprint = "";
-        const speakerColorMap = {};
-        let nextColorIndex = 0;
-
-        function switchTab(tabName) {
-            document.querySelectorAll('.view-container').forEach(el => el.classList.remove('active'));
-            document.querySelectorAll('.nav-btn').forEach(el => el.classList.remove('active'));
-            document.getElementById('view-' + tabName).classList.add('active');
-            
-            const btns = document.querySelectorAll('.nav-btn');
-            if(tabName === 'dashboard') btns[0].classList.add('active');
-            else if(tabName === 'chat') btns[1].classList.add('active');
-            else if(tabName === 'analysis') btns[2].classList.add('active');
-            else if(tabName === 'logs') btns[3].classList.add('active');
-            else if(tabName === 'config') btns[4].classList.add('active');
-            
-            // Load config when switching to config tab
-            if (tabName === 'config') {
-                loadConfig();
-            }
-            
-            // Initialize logs when switching to logs tab
-            if (tabName === 'logs') {
-                initLogsView();
-            }
-        }
-
-        // Load configuration from API
-        function loadConfig() {
-            fetch('/api/config')
-                .then(response => response.json())
-                .then(config => {
-                    const form = document.getElementById('config-form');
-                    form.innerHTML = '';
-                    
-                    for (const key in config) {
-                        const value = config[key];
-                        const div = document.createElement('div');
-                        div.style.marginBottom = '15px';
-                        
-                        const label = document.createElement('label');
-                        label.textContent = key;
-                        label.style.display = 'block';
-                        label.style.marginBottom = '5px';
-                        label.style.fontWeight = 'bold';
-                        
-                        const input = document.createElement('input');
-                        input.type = typeof value === 'number' ? 'number' : 'text';
-                        input.value = value;
-                        input.id = 'config-' + key;
-                        input.style.width = '100%';
-                        input.style.padding = '8px';
-                        input.style.border = '1px solid #ccc';
-                        input.style.borderRadius = '4px';
-                        input.style.fontSize = '14px';
-                        
-                        div.appendChild(label);
-                        div.appendChild(input);
-                        form.appendChild(div);
-                    }
-                })
-                .catch(error => {
-                    const form = document.getElementById('config-form');
-                    form.innerHTML = `<div style="text-align: center; color: #dc3545;">加载配置失败: ${error.message}</div>`;
-                });
-        }
-
-        // 对话历史相关功能
-        let currentChatData = [];
-        let currentSessionId = null;
-
-        // 加载聊天会话列表
-        function loadChatSessions() {
-            fetch('/api/chat/sessions')
-                .then(response => response.json())
-                .then(sessions => {
-                    const select = document.getElementById('chat-session-select');
-                    select.innerHTML = '<option value="">选择历史会话...</option>';
-                    
-                    sessions.forEach(session => {
-                        const option = document.createElement('option');
-                        option.value = session.session_id;
-                        // 格式化日期显示
-                        const createdDate = new Date(session.created_at).toLocaleString();
-                        option.textContent = `${session.session_id} (${createdDate})`;
-                        select.appendChild(option);
-                    });
-                })
-                .catch(error => {
-                    console.error('加载聊天会话失败:', error);
-                });
-        }
-
-        // 保存当前对话
-        function saveChatSession() {
-            if (!currentChatData || currentChatData.length === 0) {
-                alert('没有可保存的对话内容');
-                return;
-            }
-
-            const sessionName = prompt('请输入会话名称:', `对话_${new Date().toLocaleDateString()}`);
-            if (!sessionName) return;
-
-            const sessionId = sessionName.replace(/\s+/g, '_').replace(/[^\w\u4e00-\u9fa5]/g, '');
-            
-            // 准备符合后端期望的数据结构
-            const chatData = [];
-            currentChatData.forEach(item => {
-                if (item.segments) {
-                    chatData.push({
-                        segments: item.segments
-                    });
-                } else if (item.message_text) {
-                    // 如果是已加载的历史消息，转换为segments格式
-                    chatData.push({
-                        segments: [{
-                            text: item.message_text,
-                            spk_id: item.speaker_id,
-                            speaker_name: item.speaker_name,
-                            start: item.timestamp
-                        }]
-                    });
-                }
-            });
-            
-            fetch('/api/chat/session', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    session_id: sessionId,
-                    chat_data: chatData
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    alert('对话保存成功!');
-                    loadChatSessions(); // 重新加载会话列表
-                } else {
-                    alert('保存失败: ' + data.message);
-                }
-            })
-            .catch(error => {
-                alert('保存失败: ' + error.message);
-            });
-        }
-
-        // 加载特定会话的对话
-        function loadChatSession(sessionId) {
-            if (!sessionId) {
-                // 如果没有选择会话，则加载当前转录数据
-                updateLoop();
-                return;
-            }
-
-            fetch(`/api/chat/session/${sessionId}`)
-                .then(response => response.json())
-                .then(messages => {
-                    if (messages && messages.length > 0) {
-                        currentSessionId = sessionId;
-                        // 将消息转换为前端渲染需要的格式
-                        currentChatData = messages.map(msg => ({
-                            message_text: msg.message_text,
-                            speaker_id: msg.speaker_id,
-                            speaker_name: msg.speaker_name,
-                            timestamp: msg.timestamp,
-                            start_fmt: msg.start_fmt
-                        }));
-                        renderChat(currentChatData);
-                    } else {
-                        alert('没有找到该会话的对话内容');
-                    }
-                })
-                .catch(error => {
-                    alert('加载对话失败: ' + error.message);
-                });
-        }
-
-        // 新建会话
-        function newChatSession() {
-            currentSessionId = null;
-            document.getElementById('chat-session-select').value = '';
-            updateLoop(); // 加载当前转录数据
-        }
-
-        // 添加事件监听器
-        document.addEventListener('DOMContentLoaded', function() {
-            // 保存对话按钮
-            document.getElementById('save-chat-btn').addEventListener('click', saveChatSession);
-            
-            // 新建会话按钮
-            document.getElementById('new-chat-btn').addEventListener('click', newChatSession);
-            
-            // 会话选择下拉框
-            document.getElementById('chat-session-select').addEventListener('change', function() {
-                loadChatSession(this.value);
-            });
-            
-            // 初始加载会话列表
-            loadChatSessions();
-        });
-
-        // Save configuration to API
-        document.getElementById('save-config-btn')?.addEventListener('click', () => {
-            const form = document.getElementById('config-form');
-            const inputs = form.querySelectorAll('input');
-            const newConfig = {};
-            
-            inputs.forEach(input => {
-                const key = input.id.replace('config-', '');
-                const value = input.value;
-                
-                if (input.type === 'number') {
-                    newConfig[key] = parseInt(value) || parseFloat(value) || value;
-                } else {
-                    newConfig[key] = value;
-                }
-            });
-            
-            fetch('/api/config', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(newConfig)
-            })
-            .then(response => {
-                if (!response.ok) {
-                    return response.text().then(text => {
-                        throw new Error(`HTTP error! status: ${response.status}, message: ${text}`);
-                    });
-                }
-                return response.json();
-            })
-            .then(data => {
-                const status = document.getElementById('save-status');
-                if (data.success) {
-                    status.textContent = '配置保存成功!';
-                    status.style.color = '#28a745';
-                    setTimeout(() => status.textContent = '', 2000);
-                } else {
-                    status.textContent = '保存失败: ' + data.message;
-                    status.style.color = '#dc3545';
-                    setTimeout(() => status.textContent = '', 2000);
-                }
-            })
-            .catch(err => {
-                const status = document.getElementById('save-status');
-                status.textContent = `保存失败: ${err.message}`;
-                status.style.color = '#dc3545';
-                setTimeout(() => status.textContent = '', 2000);
-            });
-        });
-        
-        // --- 核心辅助函数 ---
-
-        // 1. 深度文本清洗：去除标签、标点、空格
-        function cleanText(text) {
-            if (!text) return "";
-            // 去除 SenseVoice 标签
-            let clean = text.replace(/<\|.*?\|>/g, "");
-            return clean;
-        }
-
-        // 2. 检查是否包含有效内容 (过滤掉只有标点符号的情况)
-        function hasMeaningfulContent(text) {
-            if (!text) return false;
-            const clean = cleanText(text);
-            // 去除所有标点符号、空格、换行
-            // 匹配：英文标点, 中文标点, 空白符
-            const stripped = clean.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()。，、？！：；“”‘’\s]/g, "");
-            return stripped.length > 0;
-        }
-
-        // 3. 获取头像颜色索引 (使用映射表确保颜色稳定)
-        function getAvatarIndex(spkId) {
-            if (spkId in speakerColorMap) {
-                return speakerColorMap[spkId];
-            }
-            const colorIndex = nextColorIndex % 5;
-            speakerColorMap[spkId] = colorIndex;
-            nextColorIndex++;
-            return colorIndex;
-        }
-
-        // 4. 预处理统计数据
-        function processStats(items) {
-            items.forEach(item => {
-                const stats = {};
-                if (item.segments && item.segments.length > 0) {
-                    item.segments.forEach(seg => {
-                        // 只有有效内容才计入统计
-                        if (!hasMeaningfulContent(seg.text)) return;
-
-                        const spkId = seg.spk_id !== undefined ? seg.spk_id : 'unknown';
-                        const spkName = typeof seg.spk_id === 'number' ? `说话人 ${seg.spk_id}` : (seg.spk_id || "未知");
-                        
-                        const key = String(spkId); 
-                        if (!stats[key]) {
-                            stats[key] = {
-                                original_id: spkId,
-                                speaker_name: spkName,
-                                count: 0,
-                                total_duration: 0
-                            };
-                        }
-                        stats[key].count += 1;
-                        const dur = (seg.end && seg.start) ? (seg.end - seg.start) : 0;
-                        stats[key].total_duration += dur;
-                    });
-                }
-                item.speaker_stats = stats;
-            });
-            return items;
-        }
-
-        async function updateLoop() {
-            try {
-                const statusRes = await fetch('/api/status');
-                const statusData = await statusRes.json();
-                const asrBadge = document.getElementById('status-asr');
-                if (statusData.asr_server === 'online') {
-                    asrBadge.innerText = "在线"; asrBadge.className = "badge bg-green";
-                } else {
-                    asrBadge.innerText = "离线"; asrBadge.className = "badge bg-red";
-                }
-                document.getElementById('status-files').innerText = statusData.pending_files;
-                document.getElementById('log-display').innerText = statusData.last_log;
-                const consoleWin = document.querySelector('.console-window');
-                consoleWin.scrollTop = consoleWin.scrollHeight;
-
-                const dataRes = await fetch('/api/data');
-                let items = await dataRes.json();
-                
-                // 更新当前对话数据
-                currentChatData = items;
-                
-                items = processStats(items);
-                
-                if (items.length === 0) return;
-                const currentFingerprint = items.length + "_" + items[0].id;
-                if (currentFingerprint === lastDataFingerprint) return;
-                lastDataFingerprint = currentFingerprint;
-
-                renderDashboard(items);
-                renderChat(items);
-                renderAnalysis(items);
-
-            } catch (e) { console.error(e); }
-        }
-
-        function renderDashboard(items) {
-            const container = document.getElementById('dashboard-content');
-            let html = "";
-            items.forEach(item => {
-                // === 严格过滤 ===
-                // 如果全文都没有有效内容(去标点后为空)，直接跳过整张卡片
-                let hasValidContent = false;
-                if (item.segments && item.segments.length > 0) {
-                    hasValidContent = item.segments.some(seg => hasMeaningfulContent(seg.text));
-                } else {
-                    hasValidContent = hasMeaningfulContent(item.full_text);
-                }
-                if (!hasValidContent) return; // 跳过无效文件
-                // ===============
-
-                let segHtml = "";
-                if (item.segments && item.segments.length > 0) {
-                    item.segments.forEach(seg => {
-                        if (!hasMeaningfulContent(seg.text)) return; // 跳过无效片段
-                        const txt = cleanText(seg.text);
-                        segHtml += `<div class="segment"><span class="timestamp">[${seg.start_fmt}]</span><span>${txt}</span></div>`;
-                    });
-                } else {
-                    const txt = cleanText(item.full_text);
-                    if (txt) segHtml = `<div class="segment"><span>${txt}</span></div>`;
-                }
-                
-                // 二次检查：如果过滤后没有 segHtml 了，也不渲染
-                if (!segHtml) return;
-
-                html += `
-                    <div class="transcript-card ${item.is_new ? 'new-item' : ''}">
-                        <div class="card-meta"><span class="filename">${item.filename}</span><span>${item.time_full}</span></div>
-                        <div>${segHtml}</div>
-                    </div>`;
-            });
-            container.innerHTML = html;
-        }
-
-        function renderChat(items) {
-            const container = document.getElementById('chat-content');
-            let html = "";
-            let currentDay = "";
-
-            items.forEach(item => {
-                // === 严格过滤 ===
-                let hasValidContent = false;
-                if (item.segments && item.segments.length > 0) {
-                    hasValidContent = item.segments.some(seg => hasMeaningfulContent(seg.text));
-                } else {
-                    hasValidContent = hasMeaningfulContent(item.full_text);
-                }
-                if (!hasValidContent) return; 
-                // ===============
-
-                if (item.date_group !== currentDay) {
-                    html += `<div class="chat-date-separator"><span class="chat-date-label">${item.date_group}</span></div>`;
-                    currentDay = item.date_group;
-                }
-                html += `<div class="file-separator">来源: ${item.filename} (${item.time_simple})</div>`;
-
-                if (item.segments && item.segments.length > 0) {
-                    item.segments.forEach(seg => {
-                        if (!hasMeaningfulContent(seg.text)) return; // 跳过无效气泡
-                        
-                        const txt = cleanText(seg.text);
-                        const spkId = seg.spk_id !== undefined ? seg.spk_id : 0;
-                        let spkName = typeof spkId === 'number' ? `说话人 ${spkId}` : spkId;
-                        let avatarIdx = getAvatarIndex(spkId);
-                        
-                        // 截取名字的第一个字作为头像文字
-                        let iconText = spkName;
-                        if(iconText.length > 0) iconText = iconText.slice(0, 1);
-
-                        html += `
-                            <div class="chat-bubble-row">
-                                <div class="avatar avatar-${avatarIdx % 5}">${iconText}</div>
-                                <div class="bubble-content">
-                                    <div class="speaker-name">${spkName}</div>
-                                    <div class="bubble">${txt}</div>
-                                    <div class="chat-time">${seg.start_fmt}</div>
-                                </div>
-                            </div>
-                        `;
-                    });
-                } else {
-                    const txt = cleanText(item.full_text);
-                    // 截取名字的第一个字作为头像文字
-                    let iconText = "未知"; // Default for full_text without speaker
-                    if (item.speaker_stats && Object.keys(item.speaker_stats).length > 0) {
-                        const firstSpkId = Object.keys(item.speaker_stats)[0];
-                        const firstSpkName = item.speaker_stats[firstSpkId].speaker_name;
-                        if (firstSpkName.length > 0) iconText = firstSpkName.slice(0, 1);
-                    }
-                    let avatarIdx = getAvatarIndex(0); // Default avatar for full_text
-                    html += `
-                        <div class="chat-bubble-row">
-                             <div class="avatar avatar-${avatarIdx % 5}">${iconText}</div>
-                             <div class="bubble-content">
-                                <div class="bubble">${txt}</div>
-                                <div class="chat-time">来源时间: ${item.time_simple}</div>
-                             </div>
-                        </div>`;
-                }
-            });
-            container.innerHTML = html;
-        }
-
-        function renderAnalysis(items) {
-            const container = document.getElementById('analysis-content');
-            const globalSpeakerStats = {};
-            let totalFiles = items.length;
-            
-            items.forEach(item => {
-                if (item.speaker_stats) {
-                    for (const [key, stats] of Object.entries(item.speaker_stats)) {
-                        if (!globalSpeakerStats[key]) {
-                            globalSpeakerStats[key] = {
-                                original_id: stats.original_id,
-                                name: stats.speaker_name,
-                                totalCount: 0,
-                                totalDuration: 0,
-                                filesParticipated: new Set()
-                            };
-                        }
-                        globalSpeakerStats[key].totalCount += stats.count;
-                        globalSpeakerStats[key].totalDuration += stats.total_duration;
-                        globalSpeakerStats[key].filesParticipated.add(item.filename);
-                    }
-                }
-            });
-            
-            let html = `
-                <div class="analysis-card">
-                    <h3>📊 声纹识别统计分析</h3>
-                    <p>共分析 ${totalFiles} 个录音文件，识别出 ${Object.keys(globalSpeakerStats).length} 位不同的说话人</p>
-                </div>
-                <div class="speaker-grid">`;
-            
-            const sortedStats = Object.values(globalSpeakerStats).sort((a, b) => b.totalCount - a.totalCount);
-
-            for (const stats of sortedStats) {
-                const avgDuration = stats.totalCount > 0 ? (stats.totalDuration / stats.totalCount / 1000).toFixed(1) : 0;
-                const filesCount = stats.filesParticipated.size;
-                const avatarIdx = getAvatarIndex(stats.original_id);
-                
-                // 截取名字的第一个字作为头像文字
-                let iconText = stats.name;
-                if(iconText.length > 0) iconText = iconText.slice(0, 1);
-                
-                html += `
-                    <div class="speaker-card">
-                        <div class="speaker-icon avatar-${avatarIdx % 5}">
-                            ${iconText}
-                        </div>
-                        <div class="speaker-info">
-                            <h4>${stats.name}</h4>
-                            <div class="speaker-stats-detail">
-                                <div><div style="font-weight: bold;">${stats.totalCount}</div><div style="font-size: 0.8em;">发言次数</div></div>
-                                <div><div style="font-weight: bold;">${avgDuration}s</div><div style="font-size: 0.8em;">平均时长</div></div>
-                                <div><div style="font-weight: bold;">${filesCount}</div><div style="font-size: 0.8em;">参与文件</div></div>
-                            </div>
-                        </div>
-                    </div>`;
-            }
-            
-            html += '</div>';
-            container.innerHTML = html;
-        }
-
-        // === 实时日志功能 ===
-        let logsEventSource = null;
-        let logsLineCount = 0;
-        let isLogsConnected = false;
-
-        // 初始化日志视图
-        function initLogsView() {
-            // 如果已经连接，不需要重新初始化
-            if (logsEventSource && isLogsConnected) {
-                return;
-            }
-            
-            // 设置按钮事件
-            const toggleBtn = document.getElementById('toggle-logs-btn');
-            const clearBtn = document.getElementById('clear-logs-btn');
-            
-            toggleBtn.onclick = toggleLogsConnection;
-            clearBtn.onclick = clearLogsDisplay;
-            
-            // 更新状态显示
-            updateLogsStatus();
-        }
-
-        // 切换日志连接状态
-        function toggleLogsConnection() {
-            const toggleBtn = document.getElementById('toggle-logs-btn');
-            
-            if (logsEventSource && isLogsConnected) {
-                // 断开连接
-                logsEventSource.close();
-                logsEventSource = null;
-                isLogsConnected = false;
-                toggleBtn.textContent = '开始接收日志';
-                updateLogsStatus();
-            } else {
-                // 建立连接
-                connectToLogsStream();
-                toggleBtn.textContent = '停止接收日志';
-            }
-        }
-
-        // 连接到SSE日志流
-        function connectToLogsStream() {
-            try {
-                logsEventSource = new EventSource('/logs/stream');
-                
-                logsEventSource.onopen = function() {
-                    isLogsConnected = true;
-                    updateLogsStatus();
-                    addLogMessage('系统', '已连接到日志流', 'info');
-                };
-                
-                logsEventSource.onmessage = function(event) {
-                    try {
-                        const data = JSON.parse(event.data);
-                        
-                        if (data.type === 'log') {
-                            addLogMessage('日志', data.message, 'log');
-                        } else if (data.type === 'connected') {
-                            addLogMessage('系统', data.message, 'success');
-                        } else if (data.type === 'heartbeat') {
-                            // 心跳消息，不显示
-                        } else if (data.type === 'error') {
-                            addLogMessage('错误', data.message, 'error');
-                        }
-                    } catch (e) {
-                        addLogMessage('解析错误', event.data, 'error');
-                    }
-                };
-                
-                logsEventSource.onerror = function() {
-                    isLogsConnected = false;
-                    updateLogsStatus();
-                    addLogMessage('系统', '日志流连接错误', 'error');
-                    
-                    // 5秒后尝试重连
-                    setTimeout(function() {
-                        if (document.getElementById('view-logs').classList.contains('active')) {
-                            connectToLogsStream();
-                        }
-                    }, 5000);
-                };
-                
-            } catch (e) {
-                addLogMessage('错误', '无法创建日志流连接: ' + e.message, 'error');
-            }
+# ---------------- 批量导出 ----------------
+EXPORT_FORMATS = ('jsonl', 'csv', 'srt', 'vtt')
+
+def clean_text(text):
+    """去除 SenseVoice 标签"""
+    return re.sub(r'<\|.*?\|>', '', text or '').strip()
+
+def parse_date_param(value, end_of_day=False):
+    """解析 YYYY-MM-DD 或 ISO 时间; 只有日期时, 结束时间取当天最后一刻"""
+    if not value:
+        return None
+    dt = datetime.datetime.fromisoformat(value)
+    if end_of_day and len(value) <= 10:
+        dt += datetime.timedelta(days=1) - datetime.timedelta(microseconds=1)
+    return dt
+
+def export_query(filters):
+    """导出在每个分区上分别执行的 (SQL, 参数); 日期和说话人在读取时过滤"""
+    sql = "SELECT id, filename, created_at, full_text, segments_json FROM transcriptions"
+    where, params = [], []
+    if filters.get('id') is not None:
+        where.append("id = ?")
+        params.append(filters['id'])
+    if filters.get('source'):
+        where.append("filename LIKE ?")
+        params.append(f"%{filters['source']}%")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY id", params
+
+def iter_export_records(filters):
+    """按条件逐行读取转录记录, 按编号排序, 内存占用与数据总量无关。
+    迟到的录音写入较早的分区, 各分区的编号互相交错: 每个分区按主键顺序读取, 再归并。"""
+    db = open_db()
+    try:
+        if filters.get('id') is not None:
+            names = partitions.partitions_for_ids(db, [filters['id']])
+        else:
+            # 分区按录音月份划分, 只挂载日期范围覆盖的分区
+            names = partitions.partitions_between(db, filters.get('from'), filters.get('to'))
+    finally:
+        db.close()
+    sql, params = export_query(filters)
+    yield from _iter_export_rows(partitions.query_merged(open_db, names, sql, params, key=lambda row: row['id']), filters)
+
+def _iter_export_rows(rows, filters):
+    """逐行处理导出结果, 按日期和说话人过滤"""
+    speakers = filters.get('speakers')
+    for row in rows:
+        recorded = parse_recorded_time(row['filename'], row['created_at'])
+        if filters.get('from') and (recorded is None or recorded < filters['from']):
+            continue
+        if filters.get('to') and (recorded is None or recorded > filters['to']):
+            continue
+        try:
+            segments = json.loads(row['segments_json'] or '[]')
+        except:
+            segments = []
+        if speakers:
+            segments = [seg for seg in segments if str(seg.get('spk', 0)) in speakers]
+            if not segments:
+                continue
+        yield {
+            'id': row['id'],
+            'filename': row['filename'],
+            'recorded_at': recorded.strftime('%Y-%m-%d %H:%M:%S') if recorded else '',
+            'created_at': row['created_at'],
+            'full_text': row['full_text'],
+            'segments': segments
         }
 
-        // 添加日志消息到显示区域
-        function addLogMessage(source, message, type) {
-            const logsDisplay = document.getElementById('logs-display');
-            const timestamp = new Date().toLocaleTimeString();
-            
-            // 根据类型设置不同的颜色
-            let colorClass = '';
-            if (type === 'error') {
-                colorClass = 'color: #ff6b6b;';
-            } else if (type === 'success') {
-                colorClass = 'color: #51cf66;';
-            } else if (type === 'info') {
-                colorClass = 'color: #74c0fc;';
-            } else {
-                colorClass = 'color: var(--console-text);';
-            }
-            
-            const logEntry = document.createElement('div');
-            logEntry.style.marginBottom = '2px';
-            logEntry.innerHTML = `<span style="color: #888;">[${timestamp}]</span> <span style="color: #aaa;">[${source}]</span> <span style="${colorClass}">${message}</span>`;
-            
-            logsDisplay.appendChild(logEntry);
-            logsLineCount++;
-            
-            // 自动滚动到底部
-            logsDisplay.scrollTop = logsDisplay.scrollHeight;
-            
-            // 限制显示的行数，防止内存占用过多
-            const maxLines = 1000;
-            if (logsDisplay.children.length > maxLines) {
-                logsDisplay.removeChild(logsDisplay.firstChild);
-            }
-            
-            updateLogsStatus();
-        }
+def subtitle_time(ms, sep):
+    ms = max(int(ms or 0), 0)
+    h, rest = divmod(ms, 3600000)
+    m, rest = divmod(rest, 60000)
+    s, ms = divmod(rest, 1000)
+    return f"{h:02}:{m:02}:{s:02}{sep}{ms:03}"
+
+def render_subtitles(record, fmt):
+    """单个录音的 SRT / VTT 字幕"""
+    sep = ',' if fmt == 'srt' else '.'
+    lines = ["WEBVTT", ""] if fmt == 'vtt' else []
+    segments = [seg for seg in record['segments'] if clean_text(seg.get('text'))]
+    for i, seg in enumerate(segments):
+        start = seg.get('start', 0) or 0
+        end = seg.get('end')
+        if not end or end <= start:
+            # 没有结束时间时, 取下一段的开始时间 (至少 2 秒)
+            next_start = segments[i + 1].get('start', 0) if i + 1 < len(segments) else 0
+            end = next_start if next_start > start else start + 2000
+        speaker = seg.get('spk', '')
+        text = clean_text(seg.get('text'))
+        if fmt == 'srt':
+            lines.append(str(i + 1))
+        lines.append(f"{subtitle_time(start, sep)} --> {subtitle_time(end, sep)}")
+        lines.append(f"[{speaker}] {text}" if speaker != '' else text)
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+class _StreamBuffer(io.RawIOBase):
+    """zipfile 的只写输出, 写入的数据由生成器取走, 不需要可 seek 的文件"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
 
-        // 清空日志显示
-        function clearLogsDisplay() {
-            const logsDisplay = document.getElementById('logs-display');
-            logsDisplay.innerHTML = '';
-            logsLineCount = 0;
-            updateLogsStatus();
-        }
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def generate_export(fmt, filters):
+    records = iter_export_records(filters)
+    if fmt == 'jsonl':
+        for record in records:
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM 让 Excel 正确识别 UTF-8
+        writer.writerow(['\ufeffid', 'filename', 'recorded_at', 'start_ms', 'end_ms', 'start', 'speaker', 'emotion', 'text'])
+        for record in records:
+            for seg in record['segments']:
+                text = clean_text(seg.get('text'))
+                if not text:
+                    continue
+                writer.writerow([record['id'], record['filename'], record['recorded_at'],
+                                 seg.get('start', ''), seg.get('end', ''), format_timestamp(seg.get('start', 0)),
+                                 seg.get('spk', ''), seg.get('emotion', ''), text])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif filters.get('id') is not None:
+        for record in records:
+            yield render_subtitles(record, fmt)
+    else:
+        # 多个录音的字幕打包为 zip, 每个录音一个文件, 边生成边输出
+        stream = _StreamBuffer()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for record in records:
+                name = f"{os.path.splitext(record['filename'])[0]}.{fmt}"
+                archive.writestr(name, render_subtitles(record, fmt))
+                yield stream.drain()
+        yield stream.drain()
+
+# ---------------- 音频回放 ----------------
+AUDIO_MIMETYPES = {
+    '.mp3': 'audio/mpeg', '.wav': 'audio/wav', '.m4a': 'audio/mp4', '.flac': 'audio/flac',
+    '.ogg': 'audio/ogg', '.opus': 'audio/ogg', '.aac': 'audio/aac', '.wma': 'audio/x-ms-wma'
+}
 
-        // 更新日志状态显示
-        function updateLogsStatus() {
-            const statusBadge = document.getElementById('logs-connection-status');
-            const linesCount = document.getElementById('logs-lines-count');
-            
-            if (isLogsConnected) {
-                statusBadge.textContent = '已连接';
-                statusBadge.className = 'badge bg-green';
-            } else {
-                statusBadge.textContent = '未连接';
-                statusBadge.className = 'badge bg-red';
-            }
-            
-            linesCount.textContent = `${logsLineCount} 行`;
-        }
+def resolve_audio_path(transcription_id):
+    """转录记录 -> PROCESSED_DIR 中的归档音频 (已压缩为 Opus 的取压缩后的文件)"""
+    db = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        rows = query_by_ids(db, "filename", [transcription_id])
+        if not rows:
+            return None
+        filename = os.path.basename(rows[0][0])
+        candidates = []
+        try:
+            compacted = db.execute(ARCHIVED_NAME_SQL, (filename,)).fetchone()
+            if compacted and compacted[0]:
+                candidates.append(os.path.basename(compacted[0]))
+        except sqlite3.OperationalError:
+            pass  # 旧数据库没有归档压缩表
+    finally:
+        db.close()
+    candidates += [filename, f"{os.path.splitext(filename)[0]}.opus"]
+    for name in candidates:
+        path = os.path.join(CONFIG["PROCESSED_DIR"], name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def resolve_peaks_path(transcription_id):
+    """转录进程生成的波形峰值文件 TRANSCRIPT_DIR/<文件名>.peaks.json"""
+    db = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        rows = query_by_ids(db, "filename", [transcription_id])
+    finally:
+        db.close()
+    if not rows:
+        return None
+    path = os.path.join(CONFIG["TRANSCRIPT_DIR"], f"{os.path.splitext(os.path.basename(rows[0][0]))[0]}.peaks.json")
+    return path if os.path.isfile(path) else None
+
+# ---------------- 前端资源 ----------------
+# 页面、样式和脚本放在 static/ 下, 启动时构建一次: 资源文件名带内容哈希, 预先压缩好 gzip 版本
+STATIC_DIR = os.path.join(SCRIPT_DIR, "static")
+FRONTEND_ASSETS = (
+    ("__APP_CSS__", "app.css", "text/css; charset=utf-8"),
+    ("__APP_JS__", "app.js", "application/javascript; charset=utf-8"),
+)
+# 带哈希的资源内容不会变化, 浏览器可以一直缓存
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+FRONTEND = {"index": None, "assets": {}}
+_frontend_lock = threading.Lock()
+
+def build_asset(body, mimetype):
+    return {
+        "body": body,
+        "gzip": gzip.compress(body, 9),
+        "mimetype": mimetype,
+        "etag": hashlib.sha1(body).hexdigest()[:16]
+    }
 
-        setInterval(updateLoop, 3000);
-        updateLoop();
-    </script>
-</body>
-</html>
-"""
+def build_frontend():
+    assets, urls = {}, {}
+    for placeholder, filename, mimetype in FRONTEND_ASSETS:
+        with open(os.path.join(STATIC_DIR, filename), 'rb') as f:
+            asset = build_asset(f.read(), mimetype)
+        stem, ext = os.path.splitext(filename)
+        hashed_name = f"{stem}.{asset['etag'][:10]}{ext}"
+        assets[hashed_name] = asset
+        urls[placeholder] = f"/assets/{hashed_name}"
+    with open(os.path.join(STATIC_DIR, "index.html"), 'r', encoding='utf-8') as f:
+        html = f.read()
+    for placeholder, url in urls.items():
+        html = html.replace(placeholder, url)
+    FRONTEND["assets"] = assets
+    FRONTEND["index"] = build_asset(html.encode('utf-8'), "text/html; charset=utf-8")
+    total = sum(len(asset["body"]) for asset in assets.values()) + len(FRONTEND["index"]["body"])
+    compressed = sum(len(asset["gzip"]) for asset in assets.values()) + len(FRONTEND["index"]["gzip"])
+    print(f"[前端] 已构建 {', '.join(urls.values())} ({total // 1024} KB, gzip 后 {compressed // 1024} KB)")
+
+def get_frontend():
+    if FRONTEND["index"] is None:
+        with _frontend_lock:
+            if FRONTEND["index"] is None:
+                build_frontend()
+    return FRONTEND
+
+def serve_asset(asset, cache_control):
+    """按 If-None-Match 返回 304, 客户端支持时直接发送预压缩的 gzip 版本"""
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = asset["etag"] + ("-gz" if use_gzip else "")
+    if request.if_none_match.contains(asset["etag"]) or request.if_none_match.contains(asset["etag"] + "-gz"):
+        response = Response(status=304)
+    else:
+        response = Response(asset["gzip"] if use_gzip else asset["body"], mimetype=asset["mimetype"])
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 @app.route('/api/status')
 def api_status():
@@ -1213,6 +714,154 @@ def api_status():
 def api_data():
     return jsonify(get_transcripts())
 
+@app.route('/api/list')
+def api_list():
+    """轻量列表: 每条录音只有头信息、时长、说话人摘要和预览; 内容未变化时返回 304"""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    response = jsonify(get_transcript_list(limit))
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/transcript/<int:transcription_id>')
+def api_transcript(transcription_id):
+    """单条录音的全文和全部分段"""
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return jsonify(error="数据库不存在"), 404
+    data = get_transcript(transcription_id)
+    if data is None:
+        return jsonify(error="录音不存在"), 404
+    return jsonify(data)
+
+@app.route('/api/export')
+def api_export():
+    """流式导出: /api/export?format=jsonl|csv|srt|vtt&from=2025-11-01&to=2025-11-30&speaker=0,爸爸&source=关键字&id=12"""
+    fmt = request.args.get('format', 'jsonl').lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify(error=f"format 必须是 {', '.join(EXPORT_FORMATS)} 之一"), 400
+    try:
+        filters = {
+            'from': parse_date_param(request.args.get('from')),
+            'to': parse_date_param(request.args.get('to'), end_of_day=True),
+            'source': request.args.get('source', '').strip(),
+            'id': request.args.get('id', type=int),
+            'speakers': {spk.strip() for spk in request.args.get('speaker', '').split(',') if spk.strip()}
+        }
+    except ValueError as e:
+        return jsonify(error=f"日期格式错误: {e}"), 400
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return jsonify(error="数据库不存在"), 404
+
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    mimetypes = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv', 'srt': 'application/x-subrip', 'vtt': 'text/vtt'}
+    if fmt in ('srt', 'vtt') and filters['id'] is None:
+        download_name, mimetype = f"export-{stamp}.zip", 'application/zip'
+    else:
+        download_name, mimetype = f"export-{stamp}.{fmt}", mimetypes[fmt]
+
+    def encoded():
+        for chunk in generate_export(fmt, filters):
+            if chunk:
+                yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+    response = Response(encoded(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/analytics')
+def api_analytics():
+    """按时间分桶的统计: /api/analytics?from=2025-11-01&to=2025-11-30&bucket=hour|day|month|hour_of_day"""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in QUERY_BUCKETS:
+        return jsonify(error=f"bucket 必须是 {', '.join(QUERY_BUCKETS)} 之一"), 400
+    try:
+        start = parse_date_param(request.args.get('from'))
+        end = parse_date_param(request.args.get('to'), end_of_day=True)
+    except ValueError as e:
+        return jsonify(error=f"日期格式错误: {e}"), 400
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return jsonify(error="数据库不存在"), 404
+    db = sqlite3.connect(CONFIG["DB_PATH"])
+    try:
+        result = query_rollups(db, start, end, bucket)
+    except sqlite3.OperationalError:
+        return jsonify(error="统计汇总表不存在, 请先运行 python analytics.py --rebuild"), 404
+    finally:
+        db.close()
+    result['from'] = start.strftime('%Y-%m-%d %H:%M:%S') if start else None
+    result['to'] = end.strftime('%Y-%m-%d %H:%M:%S') if end else None
+    return jsonify(result)
+
+@app.route('/api/related/<int:transcription_id>')
+def api_related(transcription_id):
+    """相关录音: 字符 n-gram TF-IDF 余弦相似度最高的 k 条 (/api/related/12?k=10)"""
+    if SIMILARITY_INDEX is None:
+        return jsonify(error="相关录音需要安装 numpy"), 503
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return jsonify(error="数据库不存在"), 404
+    k = max(1, min(request.args.get('k', 10, type=int), 100))
+    started = time.time()
+    try:
+        related = SIMILARITY_INDEX.related(transcription_id, k)
+    except sqlite3.OperationalError:
+        return jsonify(error="相似度词频表不存在, 请先运行 python similarity.py --rebuild"), 404
+    if related is None:
+        return jsonify(error="该录音不在相似度索引中, 请运行 python similarity.py --missing"), 404
+    results = []
+    if related:
+        db = sqlite3.connect(CONFIG["DB_PATH"])
+        try:
+            ids = [transcription_id for transcription_id, _ in related]
+            rows = {row[0]: row for row in query_by_ids(db, "id, filename, created_at, preview", ids)}
+        finally:
+            db.close()
+        for related_id, score in related:
+            if related_id not in rows:
+                continue
+            _, filename, created_at, preview = rows[related_id]
+            recorded = parse_recorded_time(filename, created_at)
+            results.append({
+                'id': related_id,
+                'filename': filename,
+                'time_full': recorded.strftime('%Y-%m-%d %H:%M:%S') if recorded else '',
+                'score': score,
+                'preview': (preview or '')[:80]
+            })
+    return jsonify(id=transcription_id, related=results, took_ms=round((time.time() - started) * 1000, 1))
+
+@app.route('/api/audio/<int:transcription_id>')
+def api_audio(transcription_id):
+    """归档音频回放, 支持 Range 请求 (206), 拖动进度条时只传输实际播放的部分"""
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return jsonify(error="数据库不存在"), 404
+    path = resolve_audio_path(transcription_id)
+    if not path:
+        return jsonify(error="归档音频不存在"), 404
+    mimetype = AUDIO_MIMETYPES.get(os.path.splitext(path)[1].lower(), 'application/octet-stream')
+    # conditional=True 时由 werkzeug 处理 Range / If-Range / ETag, 文件体通过 wsgi.file_wrapper 发送
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=86400)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/api/peaks/<int:transcription_id>')
+def api_peaks(transcription_id):
+    """波形峰值: 不带 level 时返回全部级别, level=0/1/2 只返回对应级别 (0 最细)"""
+    if not os.path.exists(CONFIG["DB_PATH"]):
+        return jsonify(error="数据库不存在"), 404
+    path = resolve_peaks_path(transcription_id)
+    if not path:
+        return jsonify(error="没有波形数据"), 404
+    level = request.args.get('level', type=int)
+    if level is None:
+        return send_file(path, mimetype='application/json', conditional=True, max_age=86400)
+    with open(path, 'r', encoding='utf-8') as f:
+        peaks = json.load(f)
+    if not 0 <= level < len(peaks['levels']):
+        return jsonify(error=f"level 超出范围 (0-{len(peaks['levels']) - 1})"), 400
+    peaks['levels'] = [peaks['levels'][level]]
+    return jsonify(peaks)
+
 @app.route('/api/config', methods=['GET'])
 def api_get_config():
     return jsonify(CONFIG)
@@ -1421,7 +1070,15 @@ def stream_logs():
 
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    # 页面本身每次都向服务器确认, 未变化时只返回 304
+    return serve_asset(get_frontend()["index"], "no-cache")
+
+@app.route('/assets/<name>')
+def frontend_asset(name):
+    asset = get_frontend()["assets"].get(name)
+    if not asset:
+        return jsonify(error="资源不存在"), 404
+    return serve_asset(asset, ASSET_CACHE_CONTROL)
 
 if __name__ == "__main__":
     args = parse_args()
@@ -1429,5 +1086,7 @@ if __name__ == "__main__":
     
     # 初始化对话历史数据库表
     init_chat_history_db()
+    init_transcript_summaries()
+    build_frontend()
     
     app.run(host='0.0.0.0', port=CONFIG["WEB_PORT"], debug=False)
\ No newline at end of file
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟 webhook 接收端 (代替 n8n), 可注入失败, 用于复现 transcribe.py 发件箱的发送顺序、合并和退避。
+
+    python webhook_stub_server.py --port 5009 --fail-first 3 --status 503
+    # transcribe.py 的 config.json 中: "N8N_WEBHOOK_URL": "http://127.0.0.1:5009/webhook"
+
+接口:
+    POST /webhook        接收通知: 合并格式 {"events": [...], "count": n} 或单条事件; 注入失败时返回 --status
+    GET  /events         已接收的事件 (按到达顺序) 和每次请求的记录, 并检查 event_id 是否重复、是否乱序
+    POST /admin/reset    清空记录和失败计数
+    POST /admin/fail     运行中调整失败注入, 表单或 JSON: {"fail_first": n, "fail_rate": 0.5, "status": 500}
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+
+from flask import Flask, request, jsonify
+
+app = Flask(__name__)
+
+SETTINGS = {"fail_first": 0, "fail_rate": 0.0, "status": 503, "delay": 0.0}
+EVENTS = []
+REQUESTS = []
+STATE_LOCK = threading.Lock()
+
+def should_fail():
+    """前 fail_first 个请求必定失败, 之后按 fail_rate 随机失败"""
+    with STATE_LOCK:
+        if SETTINGS["fail_first"] > 0:
+            SETTINGS["fail_first"] -= 1
+            return True
+    return random.random() < SETTINGS["fail_rate"]
+
+def unpack(body):
+    if isinstance(body, dict) and isinstance(body.get("events"), list):
+        return body["events"]
+    return [body] if body is not None else []
+
+@app.route('/')
+def index():
+    return "ok"
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    if SETTINGS["delay"]:
+        time.sleep(SETTINGS["delay"])
+    events = unpack(request.get_json(silent=True))
+    record = {"at": time.time(), "count": len(events),
+              "event_ids": [event.get("event_id") for event in events if isinstance(event, dict)]}
+    if should_fail():
+        record["status"] = SETTINGS["status"]
+        with STATE_LOCK:
+            REQUESTS.append(record)
+        print(f"[stub] 拒绝 {len(events)} 个事件 (HTTP {SETTINGS['status']})", flush=True)
+        return jsonify(error="模拟的接收失败"), SETTINGS["status"]
+    record["status"] = 200
+    with STATE_LOCK:
+        REQUESTS.append(record)
+        EVENTS.extend(events)
+    for event in events:
+        if isinstance(event, dict):
+            print(f"[stub] #{event.get('event_id')} {event.get('status')} {event.get('filename')}", flush=True)
+    return jsonify(received=len(events))
+
+@app.route('/events', methods=['GET'])
+def list_events():
+    with STATE_LOCK:
+        events = list(EVENTS)
+        requests_log = list(REQUESTS)
+    ids = [event.get("event_id") for event in events if isinstance(event, dict) and event.get("event_id") is not None]
+    seen = set()
+    duplicates = sorted({event_id for event_id in ids if event_id in seen or seen.add(event_id)})
+    out_of_order = [b for a, b in zip(ids, ids[1:]) if b <= a and b not in duplicates]
+    return jsonify(events=events, requests=requests_log, received=len(events),
+                   duplicates=duplicates, out_of_order=out_of_order)
+
+@app.route('/admin/reset', methods=['POST'])
+def reset():
+    with STATE_LOCK:
+        count = len(EVENTS)
+        EVENTS.clear()
+        REQUESTS.clear()
+        SETTINGS["fail_first"] = 0
+    return jsonify(cleared=count)
+
+@app.route('/admin/fail', methods=['POST'])
+def set_failure():
+    values = request.get_json(silent=True) or request.form
+    with STATE_LOCK:
+        if "fail_first" in values:
+            SETTINGS["fail_first"] = int(values["fail_first"])
+        if "fail_rate" in values:
+            SETTINGS["fail_rate"] = float(values["fail_rate"])
+        if "status" in values:
+            SETTINGS["status"] = int(values["status"])
+    return jsonify(SETTINGS)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='模拟 webhook 接收端')
+    parser.add_argument('--port', type=int, default=5009)
+    parser.add_argument('--fail-first', type=int, default=0, help='前 N 个请求返回失败')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='之后随机失败的比例')
+    parser.add_argument('--status', type=int, default=503, help='失败时返回的 HTTP 状态码')
+    parser.add_argument('--delay', type=float, default=0.0, help='每个请求的响应延迟 (秒)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    SETTINGS.update(fail_first=max(args.fail_first, 0), fail_rate=args.fail_rate,
+                    status=args.status, delay=max(args.delay, 0.0))
+    print(f"模拟 webhook 接收端: http://0.0.0.0:{args.port}/webhook "
+          f"(前 {args.fail_first} 个请求失败, 随机失败 {args.fail_rate:.0%}, HTTP {args.status})")
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())